@@ -14,8 +14,9 @@ Description:
 import argparse
 import pickle
 
-from src.conll import AnnCategory, ConllDataset
-from src.wordnet import get_wn_senses, make_sns_str
+from src.columnar import load_conll
+from src.conll import AnnCategory
+from src.wordnet import SenseIndex
 
 
 def create_arg_parser():
@@ -23,14 +24,18 @@ def create_arg_parser():
     parser.add_argument("-d", "--dataset", default='dev', type=str,
                         help="Type of data set: train, dev, eval or test",
                         choices=["dev", "eval", "test", "train"])
+    parser.add_argument("-s", "--sense_index", default=None, type=str,
+                        help="Path to a prebuilt sense index "
+                             "(see build_wordnet_cache.py)")
     args = parser.parse_args()
     return args
 
 
-def baseline(sns):
+def baseline(sns, sense_index):
     """Uses the synsets for extracting the lemma and pos-tag, then
     always predicts the first sense: e.g. extracts 'cloud' and 'n'
-    from 'cloud.n.02' and then predicts cloud.n.01"""
+    from 'cloud.n.02' and then predicts cloud.n.01. The senses are looked
+    up in the given SenseIndex."""
     predictions = []
 
     for syn in sns:
@@ -42,18 +47,13 @@ def baseline(sns):
 
         # Get the first sense from WordNet as our prediction
         lem, pos, _ = syn.split(".")
-        senses = get_wn_senses(lem, pos)
-        if not senses:
+        first_sense = sense_index.first_sense(lem, pos)
+        if not first_sense:
             print(f'No Wordnet entry found for: {syn}')
             predictions.append('NO WORDNET ENTRY FOUND')
             continue
 
-        # Check whether the lemma is in the list of all lemmas
-        lemma_names = {l.lower() for l in senses[0].lemma_names()}
-        if lem.lower() in lemma_names:
-            predictions.append(make_sns_str(lem, pos, 1))
-        else:
-            predictions.append(senses[0].name())
+        predictions.append(first_sense)
 
     return predictions
 
@@ -61,13 +61,19 @@ def baseline(sns):
 def main():
     # Load data set
     args = create_arg_parser()
-    dataset = ConllDataset("data/" + args.dataset + ".conll")
+    dataset = load_conll("data/" + args.dataset + ".conll")
 
-    print(f'\nLoaded {len(dataset)} documents\n')
+    # Without a prebuilt index, lemmas are looked up in WordNet once each
+    if args.sense_index:
+        sense_index = SenseIndex.load(args.sense_index)
+    else:
+        sense_index = SenseIndex()
 
-    # Predict senses for each document
-    predictions = [baseline(sns)
-                   for sns in dataset.get_category(AnnCategory.SNS)]
+    # Predict senses for each document, streamed from the data set
+    predictions = [baseline(doc.get_category(AnnCategory.SNS), sense_index)
+                   for doc in dataset]
+
+    print(f'\nPredicted senses for {len(predictions)} documents\n')
 
     # Write results to pickle file
     with open('results/baseline_predictions_' + args.dataset + '.pickle', 'wb') as pred_file:
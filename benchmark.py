@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+
+"""
+Filename:   benchmark.py
+Date:       18-10-2026
+Authors:    Wessel Poelman, Esther Ploeger, Frank van den Berg
+Description:
+    Measures how long the stages of the pipeline take on the .conll files:
+    parsing (ConllDataset and the columnar cache), WordNet sense lookup
+    (get_wn_senses), gloss context building (make_wn_context) for every
+    combination of context options, prediction with system.predict and
+    predict_batched, and evaluation. For every stage the throughput, the
+    latency percentiles and the peak memory use are reported and stored as
+    JSON, so the results of different commits can be compared with
+    --compare.
+
+    The prediction stages use a small randomly initialised BERT model that
+    is created on the fly, so they run offline and measure the pipeline
+    around the model rather than the model itself. The WordNet stages are
+    skipped when the WordNet data is not available.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import pickle
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from simpletransformers.classification import ClassificationModel
+
+from evaluate import evaluate_files
+from src.candidates import PrefilterStats
+from src.columnar import ColumnarConllDataset, load_conll
+from src.conll import AnnCategory, ConllDataset
+from src.evaluation import LabelEncoder
+from src.profiling import StageResult, compare_results, run_stage, timed
+from src.wordnet import (ContextOptions, GlossCache, SenseIndex,
+                         get_wn_senses, get_wordnet, make_wn_context)
+from system import predict, predict_batched
+
+STAGES = ('parse', 'parse_columnar', 'senses', 'context', 'predict',
+          'predict_batched', 'evaluate')
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--data_files", nargs='+', default=None,
+                        help="Files to parse, by default data/*.conll.")
+    parser.add_argument("-p", "--prediction_file", default='data/dev.conll',
+                        type=str, help="File to predict and evaluate.")
+    parser.add_argument("-s", "--stages", nargs='+', choices=STAGES,
+                        default=list(STAGES), help="Stages to run.")
+    parser.add_argument('--lemmas', default=500, type=int,
+                        help='Number of lemmas of the data files whose '
+                             'senses and gloss contexts are looked up.')
+    parser.add_argument('--predict_docs', default=100, type=int,
+                        help='Number of docs of the prediction file used in '
+                             'the prediction stages.')
+    parser.add_argument('--batch_size', default=64, type=int,
+                        help='Number of sentence pairs per forward pass.')
+    parser.add_argument('--repeats', default=5, type=int,
+                        help='Number of times the prediction file is '
+                             'evaluated.')
+    parser.add_argument('--threads', default=1, type=int,
+                        help='Number of torch threads.')
+    parser.add_argument('--no_memory', action='store_true', default=False,
+                        help='Skip the memory measurement, which runs every '
+                             'stage a second time.')
+    parser.add_argument('--gloss_cache', default=None, type=str,
+                        help='Gloss context cache for the prediction stages '
+                             '(see build_wordnet_cache.py).')
+    parser.add_argument('--sense_index', default=None, type=str,
+                        help='Sense index for the prediction stages (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument("-o", "--output_file",
+                        default='results/benchmark.json', type=str,
+                        help="JSON file the results are written to.")
+    parser.add_argument("-c", "--compare", default=None, type=str,
+                        help="Earlier results to compare with.")
+    return parser.parse_args()
+
+
+def wordnet_available() -> bool:
+    try:
+        get_wordnet().synsets('dog')
+    except LookupError:
+        return False
+    return True
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_stand_in_model(
+    path: str,
+    data_file: str,
+    vocab_size: int = 5000
+) -> ClassificationModel:
+    """A tiny randomly initialised BERT with a vocabulary of the words in
+    the data, saved to path"""
+    from transformers import (BertConfig, BertForSequenceClassification,
+                              BertTokenizerFast)
+
+    words = sorted({word.lower() for sent in load_conll(data_file).get_sents()
+                    for word in (sent or '').split()})
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words[:vocab_size]
+    with open(os.path.join(path, 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(vocab))
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=64,
+                        num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=128)
+    BertForSequenceClassification(config).save_pretrained(path)
+    BertTokenizerFast(os.path.join(path, 'vocab.txt')).save_pretrained(path)
+    return ClassificationModel('bert', path, use_cuda=False,
+                               args={'silent': True, 'max_seq_length': 128})
+
+
+def parse_stage(files: List[str]) -> Tuple[List[float], Dict[str, int]]:
+    """Parsing into ConllDocs, the latency is per doc"""
+    latencies = []
+    docs = tokens = 0
+    for file_path in files:
+        parsed = ConllDataset.iter_docs(file_path)
+        while True:
+            start = time.perf_counter()
+            doc = next(parsed, None)
+            if doc is None:
+                break
+            latencies.append(time.perf_counter() - start)
+            docs += 1
+            tokens += len(doc.tok)
+    return latencies, {'docs': docs, 'tokens': tokens}
+
+
+def columnar_stage(files: List[str]) -> Tuple[List[float], Dict[str, int]]:
+    """Parsing into the columnar format, the latency is per file"""
+    datasets = []
+    latencies = timed(
+        lambda file_path: datasets.append(
+            ColumnarConllDataset.from_file(file_path)
+        ), files
+    )
+    return latencies, {
+        'docs': sum(len(dataset) for dataset in datasets),
+        'tokens': sum(len(doc) for dataset in datasets for doc in dataset)
+    }
+
+
+def senses_stage(lemmas: List[Tuple[str, str]]):
+    latencies = timed(lambda lem_pos: get_wn_senses(*lem_pos), lemmas)
+    return latencies, {'lemmas': len(lemmas)}
+
+
+def context_stage(synsets: List[str], options: ContextOptions):
+    latencies = timed(lambda name: make_wn_context(name, options), synsets)
+    return latencies, {'synsets': len(synsets)}
+
+
+def predict_stage(predict_fn: Callable, docs: List):
+    """Prediction one doc at a time, for the latency per doc"""
+    stats = PrefilterStats()
+    latencies = timed(lambda doc: predict_fn([doc], stats=stats), docs)
+    return latencies, {'docs': len(docs),
+                       'tokens': sum(len(doc) for doc in docs),
+                       'pairs': stats.pairs}
+
+
+def evaluate_stage(gold_file: str, pred_file: str, repeats: int):
+    def evaluate_once(_):
+        dataset = load_conll(gold_file)
+        encoder = LabelEncoder()
+        evaluate_files(encoder.encode_dataset(dataset), encoder, [pred_file])
+
+    latencies = timed(evaluate_once, range(repeats))
+    dataset = load_conll(gold_file)
+    return latencies, {'docs': len(dataset) * repeats,
+                       'tokens': sum(len(doc) for doc in dataset) * repeats}
+
+
+def context_options() -> List[Tuple[str, ContextOptions]]:
+    """All combinations of context options that produce a context, i.e.
+    with the definition and/or the examples"""
+    combinations = []
+    for flags in itertools.product((False, True), repeat=5):
+        definition, example, hypo, hyper, side = flags
+        if not (definition or example):
+            continue
+        names = [name for name, flag in zip(
+            ('definition', 'example', 'hypo', 'hyper', 'side'), flags
+        ) if flag]
+        combinations.append(('+'.join(names), ContextOptions(
+            add_hypo=hypo, add_hyper=hyper, add_side=side,
+            add_example=example, add_definition=definition
+        )))
+    return combinations
+
+
+def print_results(results: List[StageResult]):
+    header = ['Stage', 'Seconds', 'Throughput', 'p50 (ms)', 'p90 (ms)',
+              'p99 (ms)', 'Peak Python (MB)']
+    print('|  ' + ' \t|  '.join(header) + ' \t|')
+    print('|' + '---\t|' * len(header))
+    for r in results:
+        throughput = ', '.join(f'{v} {k}' for k, v in r.throughput.items())
+        row = [r.name, r.seconds, throughput,
+               *(r.latency_ms.get(p, '-') for p in ('p50', 'p90', 'p99')),
+               r.peak_python_mb]
+        print('|  ' + ' \t|  '.join(str(value) for value in row) + ' \t|')
+
+
+def main():
+    args = create_arg_parser()
+    torch.set_num_threads(args.threads)
+    files = args.data_files or sorted(glob.glob('data/*.conll'))
+
+    results = []
+    stage = partial(run_stage, memory=not args.no_memory)
+    if 'parse' in args.stages:
+        results.append(stage('parse', partial(parse_stage, files)))
+    if 'parse_columnar' in args.stages:
+        results.append(stage('parse_columnar', partial(columnar_stage, files)))
+
+    # Lemmas in order of first occurrence in the data
+    lemmas = {}
+    for file_path in files:
+        for doc_sns in load_conll(file_path).get_category(AnnCategory.SNS):
+            for syn in doc_sns:
+                if syn:
+                    lem, pos, _ = syn.split(".")
+                    lemmas.setdefault((lem, pos), None)
+    lemmas = list(lemmas)[:args.lemmas]
+
+    has_wordnet = None
+    if {'senses', 'context'} & set(args.stages):
+        if not (has_wordnet := wordnet_available()):
+            print('WordNet is not available, skipping the senses and '
+                  'context stages')
+        else:
+            if 'senses' in args.stages:
+                results.append(stage('senses',
+                                     partial(senses_stage, lemmas)))
+            if 'context' in args.stages:
+                synsets = [sense.name() for lem, pos in lemmas
+                           for sense in get_wn_senses(lem, pos)]
+                for name, options in context_options():
+                    results.append(stage(
+                        f'context[{name}]',
+                        partial(context_stage, synsets, options)
+                    ))
+
+    model_stages = {'predict', 'predict_batched', 'evaluate'} & set(args.stages)
+    if model_stages and not args.sense_index and not (
+            has_wordnet if has_wordnet is not None else wordnet_available()):
+        print('WordNet is not available and no --sense_index is given, '
+              'skipping the prediction and evaluation stages')
+    elif model_stages:
+        options = ContextOptions(add_definition=True, add_example=True)
+        gloss_cache = (GlossCache(args.gloss_cache, read_only=True)
+                       if args.gloss_cache else None)
+        if args.sense_index:
+            sense_index = SenseIndex.load(args.sense_index)
+        else:
+            sense_index = SenseIndex()
+        docs = load_conll(args.prediction_file).docs[:args.predict_docs]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model = create_stand_in_model(tmp_dir, args.prediction_file)
+            kwargs = dict(model=model, options=options,
+                          gloss_cache=gloss_cache, sense_index=sense_index)
+            if 'predict' in args.stages:
+                results.append(stage('predict', partial(
+                    predict_stage, partial(predict, **kwargs), docs
+                )))
+            if 'predict_batched' in args.stages:
+                results.append(stage('predict_batched', partial(
+                    predict_stage,
+                    partial(predict_batched, batch_size=args.batch_size,
+                            **kwargs),
+                    docs
+                )))
+            if 'evaluate' in args.stages:
+                pred_file = os.path.join(tmp_dir, 'predictions.pickle')
+                predictions = predict_batched(
+                    load_conll(args.prediction_file), batch_size=args.batch_size,
+                    **kwargs
+                )
+                with open(pred_file, 'wb') as f:
+                    pickle.dump(predictions, f)
+                results.append(stage('evaluate', partial(
+                    evaluate_stage, args.prediction_file, pred_file,
+                    args.repeats
+                )))
+
+    print_results(results)
+    output = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'threads': args.threads,
+        'stages': [result.to_dict() for result in results],
+    }
+    if (folder := os.path.dirname(args.output_file)):
+        os.makedirs(folder, exist_ok=True)
+    with open(args.output_file, 'w') as f:
+        json.dump(output, f, indent=2)
+    print("Results have been written to file: " + args.output_file)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f'\nCompared to {args.compare} '
+              f'(commit {previous.get("commit")}), new / old:')
+        print('|  Stage \t|  Metric \t|  Old \t|  New \t|  Ratio \t|')
+        print('|' + '---\t|' * 5)
+        for row in compare_results(previous, output):
+            print('|  ' + ' \t|  '.join(str(value) for value in row) + ' \t|')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Filename:   benchmark_backends.py
+Date:       18-10-2026
+Authors:    Wessel Poelman, Esther Ploeger, Frank van den Berg
+Description:
+    Compares the inference backends of a model trained by system.py (fp32,
+    dynamic int8 quantization and ONNX Runtime) on a .conll file. For every
+    backend the latency of predicting single docs, the throughput of
+    predicting the whole file in batches and the accuracy are reported, as
+    well as the agreement of the predictions with those of the first
+    backend.
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from src.backends import BACKENDS, load_model
+from src.candidates import PrefilterStats
+from src.columnar import load_conll
+from src.evaluation import LabelEncoder, compute_scores
+from src.profiling import percentiles
+from src.wordnet import ContextOptions, GlossCache, SenseIndex
+from system import predict_batched
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_dir", default='outputs/', type=str,
+                        help="Directory of a model trained by system.py.")
+    parser.add_argument("--model_type", default='bert', type=str,
+                        help="Model type of the trained model.")
+    parser.add_argument("-p", "--prediction_file", default='data/dev.conll',
+                        type=str, help="File to predict and evaluate on.")
+    parser.add_argument("-b", "--backends", nargs='+', choices=BACKENDS,
+                        default=['fp32', 'int8'],
+                        help="Backends to compare, the first one is the "
+                             "reference for the agreement.")
+    parser.add_argument('--batch_size', default=64, type=int,
+                        help='Number of sentence pairs per forward pass.')
+    parser.add_argument('--threads', default=None, type=int,
+                        help='Number of torch threads.')
+    parser.add_argument('--latency_docs', default=200, type=int,
+                        help='Number of docs that are predicted one at a '
+                             'time to measure the latency.')
+    parser.add_argument('--add_hypo', action='store_true', default=False,
+                        help='Adds hyponym gloss information to context.')
+    parser.add_argument('--add_hyper', action='store_true', default=False,
+                        help='Adds hypernym gloss information to context.')
+    parser.add_argument('--add_side', action='store_true', default=False,
+                        help='Adds side-relation (hypo of hyper) gloss '
+                             'information to context.')
+    parser.add_argument('--add_definition', action='store_true', default=False,
+                        help='Adds definition to context for all selected '
+                             'relations (if available).')
+    parser.add_argument('--add_example', action='store_true', default=False,
+                        help='Adds example(s) to context for all selected '
+                             'relations (if available).')
+    parser.add_argument('--gloss_cache', default=None, type=str,
+                        help='Path to a gloss context cache (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument('--sense_index', default=None, type=str,
+                        help='Path to a prebuilt sense index (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument("-o", "--output_file", default=None, type=str,
+                        help="Also write the results as JSON to this file.")
+    return parser.parse_args()
+
+
+def agreement(
+    predictions: List[List[Optional[str]]],
+    reference: List[List[Optional[str]]]
+) -> float:
+    """Fraction of annotated tokens with the same prediction"""
+    pairs = [(pred, ref) for doc_pred, doc_ref in zip(predictions, reference)
+             for pred, ref in zip(doc_pred, doc_ref) if ref is not None]
+    return sum(pred == ref for pred, ref in pairs) / max(len(pairs), 1)
+
+
+def benchmark(backend: str, args, docs, options, gloss_cache, sense_index):
+    """Runs a single backend, returns its results and predictions"""
+    start = time.perf_counter()
+    model = load_model(args.model_dir, args.model_type, backend,
+                       args={'silent': True})
+    load_time = time.perf_counter() - start
+
+    # Latency of a single doc, after a warm-up doc
+    kwargs = dict(options=options, batch_size=args.batch_size,
+                  gloss_cache=gloss_cache, sense_index=sense_index)
+    predict_batched(docs.docs[:1], model, **kwargs)
+    latencies = []
+    for doc in docs.docs[:args.latency_docs]:
+        start = time.perf_counter()
+        predict_batched([doc], model, **kwargs)
+        latencies.append(time.perf_counter() - start)
+
+    stats = PrefilterStats()
+    start = time.perf_counter()
+    predictions = predict_batched(docs, model, stats=stats, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    encoder = LabelEncoder()
+    gold = encoder.encode_dataset(docs)
+    scores = compute_scores(gold, encoder.encode(predictions))
+    results: Dict[str, Any] = {
+        'backend': backend,
+        'load_s': round(load_time, 2),
+        'latency_ms': percentiles(latencies),
+        'docs_per_s': round(len(docs) / elapsed, 2),
+        'pairs_per_s': round(stats.pairs / elapsed, 2),
+        'synsets': round(scores.synsets, 4),
+        'mean_per_sentence': round(scores.mean_per_sentence, 4),
+        'full_sentences': round(scores.full_sentences, 4),
+    }
+    return results, predictions
+
+
+def main():
+    args = create_arg_parser()
+    options = ContextOptions(
+        add_hypo=args.add_hypo, add_hyper=args.add_hyper,
+        add_side=args.add_side, add_example=args.add_example,
+        add_definition=args.add_definition
+    )
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    gloss_cache = GlossCache(args.gloss_cache) if args.gloss_cache else None
+    if args.sense_index:
+        sense_index = SenseIndex.load(args.sense_index)
+    else:
+        sense_index = SenseIndex()
+    docs = load_conll(args.prediction_file)
+
+    all_results = []
+    reference = None
+    for backend in args.backends:
+        results, predictions = benchmark(backend, args, docs, options,
+                                         gloss_cache, sense_index)
+        if reference is None:
+            reference = predictions
+        results['agreement'] = round(agreement(predictions, reference), 4)
+        all_results.append(results)
+
+    if gloss_cache is not None:
+        gloss_cache.close()
+
+    header = ['Backend', 'Load (s)', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)',
+              'Docs/s', 'Pairs/s', 'Synsets', 'Agreement']
+    print('|  ' + ' \t|  '.join(header) + ' \t|')
+    print('|' + '---\t|' * len(header))
+    for r in all_results:
+        row = [r['backend'], r['load_s'], *r['latency_ms'].values(),
+               r['docs_per_s'], r['pairs_per_s'], r['synsets'],
+               r['agreement']]
+        print('|  ' + ' \t|  '.join(str(value) for value in row) + ' \t|')
+
+    if args.output_file:
+        with open(args.output_file, 'w') as f:
+            json.dump({'prediction_file': args.prediction_file,
+                       'threads': torch.get_num_threads(),
+                       'results': all_results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
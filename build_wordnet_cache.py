@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Filename:   build_wordnet_cache.py
+Date:       18-10-2026
+Authors:    Wessel Poelman, Esther Ploeger, Frank van den Berg
+Description:
+    Precomputes the WordNet gloss context for the given context options and
+    the lemma.pos -> senses index and stores them on disk, so the systems and
+    baselines don't have to query WordNet for every token. Both are built
+    either for all of WordNet or for the lemmas that occur in one or more
+    .conll files.
+"""
+
+import argparse
+from itertools import product
+
+from src.columnar import load_conll
+from src.conll import AnnCategory
+from src.wordnet import (ContextOptions, GlossCache, SenseIndex,
+                         ensure_wordnet, get_wordnet)
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--outfile", default='cache/glosses.sqlite',
+                        type=str, help="Path of the gloss cache.")
+    parser.add_argument("-s", "--sense_index", default='cache/senses.json',
+                        type=str, help="Path of the sense index.")
+    parser.add_argument("-c", "--conll_files", nargs='*', default=[],
+                        type=str, help="Only cache the senses of lemmas in "
+                                       "these files (default: all of WordNet).")
+    parser.add_argument('--all_options', action='store_true', default=False,
+                        help='Cache every combination of context options.')
+    parser.add_argument('--add_hypo', action='store_true', default=False)
+    parser.add_argument('--add_hyper', action='store_true', default=False)
+    parser.add_argument('--add_side', action='store_true', default=False)
+    parser.add_argument('--add_definition', action='store_true', default=False)
+    parser.add_argument('--add_example', action='store_true', default=False)
+    return parser.parse_args()
+
+
+def corpus_lemmas(file_paths):
+    """Returns all (lemma, pos) pairs in the given conll files"""
+    lemmas = set()
+    for file_path in file_paths:
+        for doc in load_conll(file_path):
+            lemmas.update(tuple(syn.split(".")[:2])
+                          for syn in doc.get_category(AnnCategory.SNS) if syn)
+    return sorted(lemmas)
+
+
+def main():
+    args = create_arg_parser()
+    ensure_wordnet()
+    wn = get_wordnet()
+
+    if args.all_options:
+        all_options = [ContextOptions(*flags)
+                       for flags in product([False, True], repeat=5)]
+    else:
+        all_options = [ContextOptions(
+            add_hypo=args.add_hypo, add_hyper=args.add_hyper,
+            add_side=args.add_side, add_example=args.add_example,
+            add_definition=args.add_definition
+        )]
+
+    lemmas = corpus_lemmas(args.conll_files) if args.conll_files else None
+    sense_index = SenseIndex.build(lemmas)
+    sense_index.save(args.sense_index)
+    print(f'Sense index of {len(sense_index)} lemmas (WordNet '
+          f'{sense_index.version}) has been written to file: '
+          + args.sense_index)
+
+    if args.conll_files:
+        synsets = {name for senses in sense_index.senses_dict.values()
+                   for name in senses}
+        synsets = [wn.synset(name) for name in sorted(synsets)]
+    else:
+        synsets = list(wn.all_synsets())
+    print(f'Caching gloss context of {len(synsets)} synsets')
+
+    cache = GlossCache(args.outfile)
+    for options in all_options:
+        written = cache.build(synsets, options)
+        print(f'{options}: {written} entries')
+    cache.close()
+    print("Gloss cache has been written to file: " + args.outfile)
+
+
+if __name__ == "__main__":
+    main()
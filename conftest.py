@@ -0,0 +1,3 @@
+# Makes the repository root importable for the tests, e.g. `from src.conll
+# import ConllDataset`, also when pytest is run as `pytest` instead of
+# `python -m pytest`.
@@ -7,15 +7,36 @@ Authors:    Wessel Poelman, Esther Ploeger, Frank van den Berg
 Description:
     This script script outputs evaluation metrics for Word Sense Disambiguation
     (WSD) prediction. It expects as input the .conll files of the gold standard 
-    and prints accuracy scores as output.
+    and prints accuracy scores as output. Multiple prediction files (or glob
+    patterns) can be given at once, the gold standard is then parsed only once
+    and the scores of all files are combined in one table.
 """
 
 
 import argparse
-import pickle
+import csv
+import glob
+import io
+import json
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from src.conll import AnnCategory, ConllDataset
-from src.utils import accuracy_score
+import numpy as np
+
+from src.breakdown import SliceIndex, lemma_counts, slice_rows
+from src.columnar import load_conll
+from src.evaluation import (EncodedLabels, LabelEncoder, Scores,
+                            compute_scores, doc_statistics, label_correctness)
+from src.predictions import iter_senses
+from src.significance import Comparison, DocStats, Interval, compare
+from src.wordnet import SenseIndex
+
+SCORE_COLUMNS = [
+    ('synsets', 'Acc. synsets'),
+    ('mean_per_sentence', 'Acc. per sentence'),
+    ('full_sentences', 'Fully correct sent.'),
+]
 
 
 def create_arg_parser():
@@ -23,86 +44,301 @@ def create_arg_parser():
     parser.add_argument("-e", "--evaluation_file",
                         default='data/dev.conll', type=str,
                         help="Path to evaluation file")
-    parser.add_argument("-p", "--prediction_file", type=str,
-                        default='results/baseline_predictions_dev.pickle',
-                        help="List of predictions as generated by a system")
+    parser.add_argument("-p", "--prediction_file", type=str, nargs='+',
+                        default=['results/baseline_predictions_dev.pickle'],
+                        help="List of predictions as generated by a system "
+                             "(.pickle or .jsonl), "
+                             "multiple files or glob patterns (quoted, e.g. "
+                             "'results/output_de_words*.pickle') are "
+                             "evaluated together")
+    parser.add_argument("-f", "--format", default=None,
+                        choices=['markdown', 'csv', 'json'],
+                        help="Output one combined table in this format. "
+                             "Defaults to markdown for multiple prediction "
+                             "files and the plain report for a single file.")
+    parser.add_argument("-o", "--output_file", default=None, type=str,
+                        help="Write the combined table to this file instead "
+                             "of printing it")
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help="Number of processes used to evaluate multiple "
+                             "prediction files and to run resamples")
+    parser.add_argument("--bootstrap", default=0, type=int,
+                        help="Number of paired bootstrap resamples (of "
+                             "documents) for confidence intervals and "
+                             "p-values, 0 to disable")
+    parser.add_argument("--randomization", default=0, type=int,
+                        help="Number of approximate randomization rounds to "
+                             "test differences between prediction files, 0 "
+                             "to disable")
+    parser.add_argument("--alpha", default=0.05, type=float,
+                        help="Significance level of the confidence intervals")
+    parser.add_argument("--seed", default=1, type=int,
+                        help="Random seed for the resampling")
+    parser.add_argument("--breakdown", action='store_true',
+                        help="Output the accuracy per lemma, POS, sense "
+                             "number, train frequency and polysemy instead "
+                             "of the overall scores")
+    parser.add_argument("-t", "--train_file", default='data/train.conll',
+                        type=str, help="Train file for the frequency "
+                                       "buckets of --breakdown")
+    parser.add_argument("-s", "--sense_index", default=None, type=str,
+                        help="Prebuilt sense index for the polysemy of "
+                             "--breakdown (see build_wordnet_cache.py)")
+    parser.add_argument("--min_count", default=1, type=int,
+                        help="Leave out slices with fewer gold labels from "
+                             "--breakdown")
     return parser.parse_args()
 
 
-def evaluate_synsets(gold, predictions, show_outputs=False):
-    """Print accuracy on synset level, given predictions and the gold standard"""
+def expand_prediction_files(patterns: List[str]) -> List[str]:
+    """Expand glob patterns into a list of files, in the given order and
+    without duplicates"""
+    files: List[str] = []
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise FileNotFoundError(f'No prediction files match {pattern}')
+        else:
+            matches = [pattern]
+        files.extend(match for match in matches if match not in files)
+    return files
+
+
+def print_scores(scores: Scores):
+    """Print the scores as a plain report"""
+    print("\n********** EVALUATION **********\n")
+
+    print("*** MICRO: EVALUATION ON SYNSET LEVEL ***")
+    print(f'Correct synsets (accuracy): {scores.synsets}\n')
+
+    print("*** MICRO: EVALUATION ON SENTENCE LEVEL ***")
+    print("Mean number of correct synsets (accuracy) per sentence: "
+          f"{scores.mean_per_sentence}")
+    print(f"Fully correct sentences (accuracy): {scores.full_sentences}\n")
+
+
+@dataclass
+class FileResult:
+    """Scores of a prediction file, with the per-doc statistics for
+    significance tests and the correctness of every gold label for the
+    breakdown if requested"""
+    scores: Scores
+    stats: Optional[DocStats] = None
+    correct: Optional[np.ndarray] = None
+
+
+_worker_state: Dict[str, Any] = {}
 
-    if show_outputs:
-        # Display the synsets that are compared, with either 0 (correct) or 1 (wrong)
-        for gold_sns, pred_sns in zip(gold, predictions):
-            print(f"{gold_sns} {pred_sns} {1 if gold_sns == pred_sns else 0}")
 
-    print(f'Correct synsets (accuracy): {accuracy_score(gold, predictions)}\n')
+def _init_evaluate_worker(
+    gold: EncodedLabels,
+    encoder: LabelEncoder,
+    with_stats: bool = False,
+    with_correct: bool = False,
+    doc_ids: Optional[List[Optional[str]]] = None
+):
+    _worker_state.update(gold=gold, encoder=encoder, with_stats=with_stats,
+                         with_correct=with_correct, doc_ids=doc_ids)
 
 
-def evaluate_sentences(gold, predictions):
-    """Print accuracy on sentence level, given predictions and the gold standard"""
-    accuracies = []
-    cleaned_gold = []
-    cleaned_pred = []
+def evaluate_file(pred_file: str) -> FileResult:
+    """Score one prediction file against the gold labels of the worker.
+    Predictions are read as a stream, from a .jsonl file (checked against
+    the gold doc ids) or a pickle. Labels that only occur in the predictions
+    get new ids in the (copied) encoder, they can never match a gold label
+    anyway."""
+    predictions = _worker_state['encoder'].encode(
+        iter_senses(pred_file, _worker_state['doc_ids'])
+    )
+    gold = _worker_state['gold']
+    result = FileResult(compute_scores(gold, predictions))
+    if _worker_state['with_stats']:
+        result.stats = doc_statistics(gold, predictions)
+    if _worker_state['with_correct']:
+        result.correct = label_correctness(gold, predictions)[1]
+    return result
 
-    for gold_sent, pred_sent in zip(gold, predictions):
-        gold_sent = remove_sns_none(gold_sent, mode='single')
-        cleaned_gold.append(gold_sent)
 
-        pred_sent = remove_sns_none(pred_sent, mode="single")
-        cleaned_pred.append(pred_sent)
+def evaluate_files(
+    gold: EncodedLabels,
+    encoder: LabelEncoder,
+    pred_files: List[str],
+    workers: int = 1,
+    with_stats: bool = False,
+    with_correct: bool = False,
+    doc_ids: Optional[List[Optional[str]]] = None
+) -> List[FileResult]:
+    """Evaluate all prediction files, in a process pool if workers > 1. The
+    encoded gold labels are sent to every worker once."""
+    workers = min(workers, len(pred_files))
+    initargs = (gold, encoder, with_stats, with_correct, doc_ids)
+    if workers <= 1:
+        _init_evaluate_worker(*initargs)
+        return [evaluate_file(pred_file) for pred_file in pred_files]
 
-        if gold_sent and pred_sent:
-            accuracies.append(accuracy_score(gold_sent, pred_sent))
+    with Pool(workers, initializer=_init_evaluate_worker,
+              initargs=initargs) as pool:
+        return pool.map(evaluate_file, pred_files)
 
-    m_acc = sum(accuracies) / len(accuracies)
-    sents_acc = accuracy_score(cleaned_gold, cleaned_pred)
 
-    print(f"Mean number of correct synsets (accuracy) per sentence: {m_acc}")
-    print(f"Fully correct sentences (accuracy): {sents_acc}\n")
+def render_table(
+    header: List[str],
+    keys: List[str],
+    rows: List[List[Any]],
+    table_format: str = 'markdown'
+) -> Union[str, List[Dict[str, Any]]]:
+    """Render rows as a markdown or csv table, or as a list of dicts with the
+    given keys for json"""
+    if table_format == 'json':
+        return [dict(zip(keys, row)) for row in rows]
 
+    if table_format == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+        return out.getvalue().rstrip('\n')
 
-def remove_sns_none(full_sns, mode="multiple"):
-    """ Remove SNS_NONE from lists, as it distorts scores"""
-    filtered = []
-    if mode == "multiple":
-        for sns_sent in full_sns:
-            for sense in sns_sent:
-                if sense:
-                    filtered.append(sense)
-    elif mode == "single":
-        for sense in full_sns:
-            if sense:
-                filtered.append(sense)
+    lines = ['|  ' + ' \t|  '.join(header) + ' \t|',
+             '|' + '---\t|' * len(header)]
+    lines.extend('|  ' + ' \t|  '.join(str(value) for value in row) + ' \t|'
+                 for row in rows)
+    return '\n'.join(lines)
 
-    return filtered
+
+def format_table(
+    pred_files: List[str],
+    all_scores: List[Scores],
+    table_format: str = 'markdown',
+    intervals: Optional[List[List[Interval]]] = None
+):
+    """Combine the scores of multiple prediction files into one table, with
+    the bounds of the confidence interval after every score if given"""
+    header, keys = ['Prediction file'], ['file']
+    for field, name in SCORE_COLUMNS:
+        header.append(name)
+        keys.append(field)
+        if intervals:
+            header.extend([f'{name} low', f'{name} high'])
+            keys.extend([f'{field}_low', f'{field}_high'])
+
+    rows = []
+    for i, (pred_file, scores) in enumerate(zip(pred_files, all_scores)):
+        row = [pred_file]
+        for j, (field, _) in enumerate(SCORE_COLUMNS):
+            row.append(getattr(scores, field))
+            if intervals:
+                row.extend([intervals[i][j].low, intervals[i][j].high])
+        rows.append(row)
+    return render_table(header, keys, rows, table_format)
+
+
+def format_comparisons(
+    pred_files: List[str],
+    comparisons: Dict[Tuple[int, int], List[Comparison]],
+    table_format: str = 'markdown'
+):
+    """Table with the difference and p-values per score for every pair of
+    prediction files"""
+    header = ['System A', 'System B', 'Eval. type', 'Difference (A - B)',
+              'p (bootstrap)', 'p (randomization)']
+    keys = ['file_a', 'file_b', 'score', 'delta', 'p_bootstrap',
+            'p_randomization']
+    rows = [
+        [pred_files[i], pred_files[j], name, comparison.delta,
+         comparison.p_bootstrap, comparison.p_randomization]
+        for (i, j), pair in comparisons.items()
+        for (_, name), comparison in zip(SCORE_COLUMNS, pair)
+    ]
+    return render_table(header, keys, rows, table_format)
+
+
+def format_breakdown(
+    pred_files: List[str],
+    index: SliceIndex,
+    results: List[FileResult],
+    table_format: str = 'markdown',
+    min_count: int = 1
+):
+    """Table with the accuracy of every prediction file per slice"""
+    header = ['Dimension', 'Slice', 'Gold labels'] + pred_files
+    keys = ['dimension', 'slice', 'count'] + pred_files
+    rows = slice_rows(index, [result.correct for result in results],
+                      min_count)
+    return render_table(header, keys, rows, table_format)
+
+
+def write_output(output: str, output_file: Optional[str]):
+    if output_file:
+        with open(output_file, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
 
 
 def main():
     args = create_arg_parser()
+    pred_files = expand_prediction_files(args.prediction_file)
+    with_stats = bool(args.bootstrap or args.randomization)
 
-    # Get gold labels / evaluation dataset
-    gold_data = ConllDataset(args.evaluation_file)
-    gold_labels_full = gold_data.get_category(AnnCategory.SNS)
+    # Get gold labels / evaluation dataset, encoded as integer ids once
+    encoder = LabelEncoder()
+    gold_dataset = load_conll(args.evaluation_file)
+    gold = encoder.encode_dataset(gold_dataset)
 
-    # Get predictions
-    pred_file = args.prediction_file
-    with open(pred_file, 'rb') as pred:
-        predictions_full = pickle.load(pred)
+    # Get predictions and evaluate them
+    results = evaluate_files(gold, encoder, pred_files, args.workers,
+                             with_stats, args.breakdown,
+                             gold_dataset.get_ids())
+    all_scores = [result.scores for result in results]
 
-    # Filter SNS_NONE from full synset collections
-    gold_labels = remove_sns_none(gold_labels_full)
-    predictions = remove_sns_none(predictions_full)
+    # Tables are written as markdown unless another format is requested
+    table_format: str = args.format or 'markdown'
 
-    # Print evaluation
-    print("\n********** EVALUATION **********\n")
+    if args.breakdown:
+        # Without a prebuilt index, lemmas are looked up in WordNet once each
+        if args.sense_index:
+            sense_index = SenseIndex.load(args.sense_index)
+        else:
+            sense_index = SenseIndex()
+        gold_ids = label_correctness(gold, gold)[0]
+        index = SliceIndex.build(
+            gold_ids, encoder.vocab,
+            lemma_counts(load_conll(args.train_file)),
+            sense_index
+        )
+        table = format_breakdown(pred_files, index, results, table_format,
+                                 args.min_count)
+        write_output(json.dumps(table, indent=2) if table_format == 'json'
+                     else table, args.output_file)
+        return
 
-    print("*** MICRO: EVALUATION ON SYNSET LEVEL ***")
-    evaluate_synsets(gold_labels, predictions, show_outputs=False)
+    # Print evaluation, a single file without a format gets the plain report
+    if (args.format is None and len(pred_files) == 1
+            and not args.output_file and not with_stats):
+        print_scores(all_scores[0])
+        return
 
-    print("*** MICRO: EVALUATION ON SENTENCE LEVEL ***")
-    evaluate_sentences(gold_labels_full, predictions_full)
+    intervals, comparisons = None, {}
+    if with_stats:
+        intervals, comparisons = compare(
+            [result.stats for result in results], args.bootstrap,
+            args.randomization, args.seed, args.workers, args.alpha
+        )
+
+    tables = {'scores': format_table(pred_files, all_scores, table_format,
+                                     intervals)}
+    if comparisons:
+        tables['comparisons'] = format_comparisons(pred_files, comparisons,
+                                                   table_format)
+
+    if table_format == 'json':
+        output = json.dumps(tables if with_stats else tables['scores'],
+                            indent=2)
+    else:
+        output = '\n\n'.join(tables.values())
+    write_output(output, args.output_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+"""
+Filename:   server.py
+Date:       18-10-2026
+Authors:    Wessel Poelman, Esther Ploeger, Frank van den Berg
+Description:
+    A long-running HTTP server for Word Sense Disambiguation with a model
+    trained by system.py. The model, sense index and gloss cache are loaded
+    once. Concurrent requests are combined into micro-batches, so their
+    sentence pairs are scored together.
+
+    Request (POST /disambiguate):
+        {"raw_sent": "The dog barks.", "lemmas": ["dog.n", "bark.v", null]}
+    Response:
+        {"senses": ["dog.n.01", "bark.v.04", null]}
+
+    Lemmas are given as lemma.pos, with pos one of n, v, a or r. Lemmas with
+    a single WordNet sense are not scored by the model, they get the
+    prediction of the statistical baseline (see statistical_baseline.py) if
+    --mfs_model is given, else their first sense. Lemmas without any sense
+    get "NO WORDNET ENTRY FOUND", like in the predictions of system.py.
+"""
+
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional, Tuple
+
+from simpletransformers.classification import ClassificationModel
+
+from src.backends import BACKENDS, load_model
+from src.inference import score_pairs
+from src.candidates import trivial_prediction
+from src.mfs import NO_ENTRY, MostFrequentSense
+from src.serving import MicroBatcher
+from src.wordnet import (ContextOptions, GlossCache, SenseIndex, make_sns_str,
+                         make_wn_context)
+
+Request = Tuple[str, List[Optional[str]]]
+
+# POS tags of the lemmas in a request, as in the synsets of the data
+POS_TAGS = ('n', 'v', 'a', 'r')
+
+
+def create_arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model_dir", default='outputs/', type=str,
+                        help="Directory of a model trained by system.py.")
+    parser.add_argument("--model_type", default='bert', type=str,
+                        help="Model type of the trained model.")
+    parser.add_argument('--backend', default='fp32', choices=BACKENDS,
+                        help='How the model is run: as is, with dynamic int8 '
+                             'quantization (CPU) or exported to ONNX Runtime '
+                             '(CPU).')
+    parser.add_argument("--host", default='127.0.0.1', type=str,
+                        help="Host to listen on.")
+    parser.add_argument("--port", default=8000, type=int,
+                        help="Port to listen on.")
+    parser.add_argument('--max_batch_size', default=32, type=int,
+                        help='Maximum number of requests per micro-batch.')
+    parser.add_argument('--max_latency_ms', default=10, type=float,
+                        help='Maximum time a request waits for other '
+                             'requests to join its micro-batch.')
+    parser.add_argument('--batch_size', default=64, type=int,
+                        help='Number of sentence pairs per forward pass.')
+    parser.add_argument('--add_hypo', action='store_true', default=False,
+                        help='Adds hyponym gloss information to context.')
+    parser.add_argument('--add_hyper', action='store_true', default=False,
+                        help='Adds hypernym gloss information to context.')
+    parser.add_argument('--add_side', action='store_true', default=False,
+                        help='Adds side-relation (hypo of hyper) gloss '
+                             'information to context.')
+    parser.add_argument('--add_definition', action='store_true', default=False,
+                        help='Adds definition to context for all selected '
+                             'relations (if available).')
+    parser.add_argument('--add_example', action='store_true', default=False,
+                        help='Adds example(s) to context for all selected '
+                             'relations (if available).')
+    parser.add_argument('--gloss_cache', default=None, type=str,
+                        help='Path to a gloss context cache (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument('--sense_index', default=None, type=str,
+                        help='Path to a prebuilt sense index (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument('--mfs_model', default=None, type=str,
+                        help='Fitted statistical baseline (see '
+                             'statistical_baseline.py --fit) used for '
+                             'lemmas with at most one sense. Without it, '
+                             'such lemmas get their first WordNet sense, as '
+                             'in system.py, instead of the most frequent '
+                             'sense in the train data.')
+    return parser.parse_args()
+
+
+class Disambiguator:
+    """Predicts the senses of the lemmas of a batch of sentences with a
+    sentence-pair classifier, in the same way as predict_batched in
+    system.py"""
+
+    def __init__(
+        self,
+        model: ClassificationModel,
+        options: ContextOptions,
+        sense_index: SenseIndex,
+        gloss_cache: Optional[GlossCache] = None,
+        mfs: Optional[MostFrequentSense] = None,
+        batch_size: int = 64
+    ) -> None:
+        self.model = model
+        self.options = options
+        self.sense_index = sense_index
+        self.gloss_cache = gloss_cache
+        self.mfs = mfs
+        self.batch_size = batch_size
+
+    def close(self) -> None:
+        """Closes the gloss cache, from the thread that used it"""
+        if self.gloss_cache is not None:
+            self.gloss_cache.close()
+
+    def gloss(self, sense: str) -> str:
+        if self.gloss_cache is not None:
+            return self.gloss_cache.get(sense, self.options)
+        return make_wn_context(sense, self.options)
+
+    def fallback(self, lem: str, pos: str, senses: List[str]) -> Optional[str]:
+        """Prediction for a lemma with at most one sense, NO_ENTRY if it
+        has no sense at all (the same as system.py)"""
+        if self.mfs is not None:
+            return self.mfs.predict_lemma(f'{lem}.{pos}') or NO_ENTRY
+        return trivial_prediction(lem, pos, senses)
+
+    def prepare(
+        self,
+        raw_sent: str,
+        lemmas: List[Optional[str]],
+        pairs: List[List[str]]
+    ) -> List[Any]:
+        """Adds the sentence pairs of a request to pairs. Returns, for every
+        lemma, None, the fallback prediction or the slice of pairs that
+        holds its candidates."""
+        request_spans: List[Any] = []
+        for lem_pos in lemmas:
+            if not lem_pos:
+                request_spans.append(None)
+                continue
+
+            lem, pos = lem_pos.rsplit(".", 1)
+            senses = self.sense_index.senses(lem, pos)
+            if len(senses) <= 1:
+                request_spans.append(self.fallback(lem, pos, senses))
+                continue
+
+            request_spans.append((lem, pos, len(pairs),
+                                  len(pairs) + len(senses)))
+            pairs.extend([raw_sent, self.gloss(sense)] for sense in senses)
+        return request_spans
+
+    def __call__(self, requests: List[Request]) -> List[Any]:
+        # Flatten the sentence pairs of all requests, remembering which slice
+        # belongs to which lemma. A request that fails gets its exception as
+        # result, the other requests of the batch are still answered.
+        pairs: List[List[str]] = []
+        spans: List[Any] = []
+        for raw_sent, lemmas in requests:
+            start = len(pairs)
+            try:
+                spans.append(self.prepare(raw_sent, lemmas, pairs))
+            except Exception as e:
+                logging.exception('Failed to prepare request')
+                del pairs[start:]
+                spans.append(e)
+
+        prob_1 = (score_pairs(self.model, pairs, self.batch_size)
+                  if pairs else [])
+        if self.gloss_cache is not None:
+            self.gloss_cache.flush()
+
+        results: List[Any] = []
+        for request_spans in spans:
+            if isinstance(request_spans, Exception):
+                results.append(request_spans)
+                continue
+
+            senses = []
+            for span in request_spans:
+                if not isinstance(span, tuple):
+                    senses.append(span)
+                    continue
+
+                lem, pos, start, end = span
+                token_probs = prob_1[start:end]
+                sense_num_most_probable = token_probs.index(max(token_probs)) + 1
+                senses.append(make_sns_str(lem, pos, sense_num_most_probable))
+            results.append(senses)
+        return results
+
+
+def check_lemma(lem_pos: Optional[str]) -> None:
+    """Raises a ValueError if a lemma of a request is not None or of the
+    form lemma.pos, so it is rejected before it joins a micro-batch"""
+    if lem_pos is None:
+        return
+    lem, _, pos = lem_pos.rpartition(".")
+    if not lem or pos not in POS_TAGS:
+        raise ValueError(f'{lem_pos!r} is not a lemma.pos with pos one of '
+                         f'{", ".join(POS_TAGS)}')
+
+
+class WSDRequestHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status: int, data) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        batcher = self.server.batcher
+        self.send_json(200, {'status': 'ok', 'batches': batcher.batches,
+                             'requests': batcher.items})
+
+    def do_POST(self):
+        if self.path != '/disambiguate':
+            self.send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            request = (str(data['raw_sent']),
+                       [str(lem) if lem else None for lem in data['lemmas']])
+            for lem_pos in request[1]:
+                check_lemma(lem_pos)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': f'Invalid request: {e}'})
+            return
+
+        try:
+            senses = self.server.batcher(request)
+        except Exception as e:
+            logging.exception('Failed to disambiguate request')
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'senses': senses})
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def create_server(
+    disambiguator: Disambiguator,
+    host: str = '127.0.0.1',
+    port: int = 8000,
+    max_batch_size: int = 32,
+    max_latency: float = 0.01
+) -> ThreadingHTTPServer:
+    """HTTP server with a started micro-batcher for the disambiguator. The
+    disambiguator is closed by the batcher's worker thread, the only thread
+    that uses its SQLite connection, see close_server()"""
+    batcher = MicroBatcher(disambiguator, max_batch_size, max_latency,
+                           on_close=disambiguator.close).start()
+    server = ThreadingHTTPServer((host, port), WSDRequestHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+def close_server(server: ThreadingHTTPServer) -> None:
+    """Closes the socket, then answers the queued requests and closes the
+    disambiguator on the worker thread"""
+    server.server_close()
+    server.batcher.close()
+
+
+def main():
+    args = create_arg_parser()
+    logging.basicConfig(level=logging.INFO)
+    options = ContextOptions(
+        add_hypo=args.add_hypo, add_hyper=args.add_hyper,
+        add_side=args.add_side, add_example=args.add_example,
+        add_definition=args.add_definition
+    )
+
+    # Without a prebuilt index, lemmas are looked up in WordNet once each
+    if args.sense_index:
+        sense_index = SenseIndex.load(args.sense_index)
+    else:
+        sense_index = SenseIndex()
+    gloss_cache = GlossCache(args.gloss_cache) if args.gloss_cache else None
+    mfs = (MostFrequentSense.load(args.mfs_model, sense_index)
+           if args.mfs_model else None)
+
+    model = load_model(args.model_dir, args.model_type, args.backend)
+    disambiguator = Disambiguator(model, options, sense_index, gloss_cache,
+                                  mfs, args.batch_size)
+    server = create_server(disambiguator, args.host, args.port,
+                           args.max_batch_size, args.max_latency_ms / 1000)
+    logging.info('Listening on http://%s:%d', args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_server(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional
+
+import torch
+from simpletransformers.classification import ClassificationModel
+
+# fp32: the saved model as is, int8: dynamic int8 quantization of the linear
+# layers, onnx: exported to ONNX and run by ONNX Runtime (CPU only)
+BACKENDS = ('fp32', 'int8', 'onnx')
+
+# File name of the exported model, where ClassificationModel(onnx=True)
+# looks for it
+ONNX_MODEL = 'onnx_model.onnx'
+
+
+def quantize(model: ClassificationModel) -> ClassificationModel:
+    ''' Replaces the linear layers of a model on the CPU by dynamically
+        quantized int8 versions, the weights are quantized once and the
+        activations on the fly. Most of the compute of BERT is in these
+        layers.
+    '''
+    model.model = torch.ao.quantization.quantize_dynamic(
+        model.model.cpu(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+    model.model.eval()
+    return model
+
+
+class _PositionalInputs(torch.nn.Module):
+    ''' The classifier with its inputs as positional arguments in a fixed
+        order and only the logits as output, for the ONNX exporter.
+    '''
+    def __init__(self, model: torch.nn.Module, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs: torch.Tensor) -> torch.Tensor:
+        return self.model(**dict(zip(self.input_names, inputs)))[0]
+
+
+def write_onnx(model: ClassificationModel, output_dir: str):
+    ''' Writes the model as ONNX with a dynamic batch size and sequence
+        length to output_dir, together with the tokenizer, config and model
+        args that ClassificationModel(onnx=True) loads from it. The inputs
+        are named after the tokenizer's model inputs, the output is logits.
+        ClassificationModel.convert_to_onnx() is not used, it fails on
+        recent versions of transformers and torch.
+    '''
+    input_names = list(model.tokenizer.model_input_names)
+    sample = model.tokenizer('a sentence', 'a gloss', return_tensors='pt')
+    axes: Dict[str, Dict[int, str]] = {
+        name: {0: 'batch', 1: 'sequence'} for name in input_names
+    }
+    axes['logits'] = {0: 'batch'}
+
+    wrapper = _PositionalInputs(model.model.cpu().eval(), input_names)
+    with torch.no_grad():
+        torch.onnx.export(wrapper, tuple(sample[name] for name in input_names),
+                          os.path.join(output_dir, ONNX_MODEL),
+                          input_names=input_names, output_names=['logits'],
+                          dynamic_axes=axes, opset_version=14, dynamo=False)
+    model.tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+    model.save_model_args(output_dir)
+
+
+def export_onnx(model_dir: str, model_type: str = 'bert') -> str:
+    ''' Exports the saved model in model_dir to model_dir/onnx (once) and
+        returns the directory of the export. Needs the onnx and onnxruntime
+        packages. The export is written to a temporary directory that is
+        only moved into place when it is complete, what is left of a failed
+        earlier export is removed first.
+    '''
+    onnx_dir = os.path.join(model_dir, 'onnx')
+    if os.path.exists(os.path.join(onnx_dir, ONNX_MODEL)):
+        return onnx_dir
+    if os.path.isdir(onnx_dir):
+        shutil.rmtree(onnx_dir)
+
+    tmp_dir = tempfile.mkdtemp(prefix='onnx.', dir=model_dir)
+    try:
+        model = ClassificationModel(model_type, model_dir, use_cuda=False,
+                                    args={'silent': True})
+        write_onnx(model, tmp_dir)
+        try:
+            os.rename(tmp_dir, onnx_dir)
+        except OSError:
+            # Fine if another process finished the same export first
+            if not os.path.exists(os.path.join(onnx_dir, ONNX_MODEL)):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return onnx_dir
+
+
+def load_model(
+    model_dir: str,
+    model_type: str = 'bert',
+    backend: str = 'fp32',
+    use_cuda: Optional[bool] = None,
+    args: Optional[dict] = None
+) -> ClassificationModel:
+    ''' Loads a model saved by system.py for prediction only. The int8 and
+        onnx backends always run on the CPU, fp32 uses the GPU if there is
+        one (unless use_cuda says otherwise).
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend}, expected one of '
+                         f'{", ".join(BACKENDS)}')
+    args = dict(args or {})
+    if use_cuda is None:
+        use_cuda = backend == 'fp32' and torch.cuda.is_available()
+
+    if backend == 'onnx':
+        args['onnx'] = True
+        return ClassificationModel(model_type,
+                                   export_onnx(model_dir, model_type),
+                                   use_cuda=False, args=args)
+
+    model = ClassificationModel(model_type, model_dir,
+                                use_cuda=use_cuda and backend == 'fp32',
+                                args=args)
+    return quantize(model) if backend == 'int8' else model
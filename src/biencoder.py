@@ -0,0 +1,312 @@
+import hashlib
+import json
+import os
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple)
+
+import numpy as np
+import torch
+from simpletransformers.classification import ClassificationModel
+
+from src.candidates import PrefilterStats, trivial_prediction
+from src.conll import AnnCategory, ConllDoc
+from src.wordnet import (ContextOptions, GlossCache, SenseIndex, make_sns_str,
+                         make_wn_context, options_key)
+
+
+def _encode(
+    model: ClassificationModel,
+    texts: Sequence[str],
+    with_offsets: bool = False
+) -> Tuple[np.ndarray, np.ndarray, Optional[List]]:
+    ''' Runs a batch of texts through the encoder of the model and returns
+        the last hidden states, the attention mask and (optionally) the
+        character offsets of every subword.
+    '''
+    encoded = model.tokenizer(
+        list(texts), padding=True, truncation=True,
+        max_length=model.args.max_seq_length,
+        return_offsets_mapping=with_offsets, return_tensors='pt'
+    )
+    offsets = encoded.pop('offset_mapping').tolist() if with_offsets else None
+    inputs = {k: v.to(model.device) for k, v in encoded.items()}
+
+    model.model.eval()
+    with torch.no_grad():
+        hidden = model.model.base_model(**inputs)[0]
+    return (hidden.cpu().numpy(), encoded['attention_mask'].numpy(), offsets)
+
+
+def _state_bytes(value: Any) -> Iterator[bytes]:
+    ''' The bytes of a state_dict entry: a tensor, or e.g. the packed
+        (weight, bias) tuple of a quantized linear layer.
+    '''
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        if value.is_quantized:
+            if value.qscheme() in (torch.per_tensor_affine,
+                                   torch.per_tensor_symmetric):
+                yield repr((value.q_scale(), value.q_zero_point())).encode()
+            else:
+                yield from _state_bytes(value.q_per_channel_scales())
+                yield from _state_bytes(value.q_per_channel_zero_points())
+            value = value.int_repr()
+        yield value.contiguous().numpy().tobytes()
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _state_bytes(item)
+    else:
+        yield repr(value).encode()
+
+
+def model_fingerprint(model: ClassificationModel) -> str:
+    ''' Hash of all weights of a model (its state_dict), used to check that
+        a gloss index was built with the same (fine-tuned) weights.
+    '''
+    sha1 = hashlib.sha1()
+    for name, value in sorted(model.model.state_dict().items()):
+        sha1.update(name.encode())
+        for chunk in _state_bytes(value):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def encode_texts(
+    model: ClassificationModel,
+    texts: Sequence[str],
+    batch_size: int = 64
+) -> np.ndarray:
+    ''' Returns L2-normalized, mean-pooled embeddings for a list of texts'''
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        hidden, mask, _ = _encode(model, texts[start:start + batch_size])
+        summed = (hidden * mask[..., None]).sum(axis=1)
+        embeddings.append(summed / np.maximum(mask.sum(axis=1), 1)[:, None])
+    if not embeddings:
+        return np.zeros((0, model.model.config.hidden_size), dtype=np.float32)
+    return _normalize(np.concatenate(embeddings).astype(np.float32))
+
+
+class GlossIndex:
+    ''' Matrix with an embedding for the WordNet gloss context of every
+        synset, stored as a .npy file that is memory-mapped when loaded, plus
+        a json file with the synset names of the rows. An index is only valid
+        for the model and context options it was built with.
+    '''
+
+    def __init__(
+        self,
+        names: List[str],
+        matrix: np.ndarray,
+        options: ContextOptions
+    ) -> None:
+        self.names = names
+        self.rows: Dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.matrix = matrix
+        self.options = options
+        self._extra: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def build(
+        cls,
+        model: ClassificationModel,
+        names: Iterable[str],
+        options: ContextOptions,
+        path: str,
+        gloss_cache: Optional[GlossCache] = None,
+        batch_size: int = 64
+    ) -> 'GlossIndex':
+        ''' Encodes the gloss context of the given synsets and writes the
+            matrix to <path>.npy and the row names to <path>.json.
+        '''
+        names = sorted(set(names))
+        if (folder := os.path.dirname(path)):
+            os.makedirs(folder, exist_ok=True)
+
+        matrix = np.lib.format.open_memmap(
+            path + '.npy', mode='w+', dtype=np.float32,
+            shape=(len(names), model.model.config.hidden_size)
+        )
+        chunk = batch_size * 16
+        for start in range(0, len(names), chunk):
+            glosses = [_gloss(name, options, gloss_cache)
+                       for name in names[start:start + chunk]]
+            matrix[start:start + len(glosses)] = encode_texts(
+                model, glosses, batch_size
+            )
+        matrix.flush()
+
+        with open(path + '.json', 'w') as f:
+            json.dump({
+                'model': model_fingerprint(model),
+                'options': options_key(options),
+                'names': names,
+            }, f)
+        return cls(names, matrix, options)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        model: ClassificationModel,
+        options: ContextOptions
+    ) -> Optional['GlossIndex']:
+        ''' Memory-maps an index, returns None if it doesn't exist or was
+            built with a different model or context options.
+        '''
+        if not os.path.exists(path + '.json'):
+            return None
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        if (meta['options'] != options_key(options)
+                or meta['model'] != model_fingerprint(model)):
+            return None
+        return cls(meta['names'], np.load(path + '.npy', mmap_mode='r'),
+                   options)
+
+    def vectors(
+        self,
+        names: Sequence[str],
+        model: ClassificationModel,
+        gloss_cache: Optional[GlossCache] = None
+    ) -> np.ndarray:
+        ''' Returns the embeddings of the given synsets. Synsets that are not
+            in the index are encoded on the fly and kept in memory.
+        '''
+        missing = [name for name in names
+                   if name not in self.rows and name not in self._extra]
+        if missing:
+            glosses = [_gloss(name, self.options, gloss_cache)
+                       for name in missing]
+            for name, vector in zip(missing, encode_texts(model, glosses)):
+                self._extra[name] = vector
+
+        return np.stack([
+            self.matrix[self.rows[name]] if name in self.rows
+            else self._extra[name]
+            for name in names
+        ])
+
+
+def _gloss(
+    name: str,
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache]
+) -> str:
+    if gloss_cache is not None:
+        return gloss_cache.get(name, options)
+    return make_wn_context(name, options)
+
+
+def _token_spans(
+    raw_sent: str,
+    tokens: Sequence[str]
+) -> List[Optional[Tuple[int, int]]]:
+    ''' Finds the character span of every token in the raw sentence'''
+    spans = []
+    cursor = 0
+    for tok in tokens:
+        start = raw_sent.find(tok, cursor)
+        if start < 0:
+            spans.append(None)
+            continue
+        cursor = start + len(tok)
+        spans.append((start, cursor))
+    return spans
+
+
+def _context_vectors(
+    model: ClassificationModel,
+    docs: Sequence[ConllDoc]
+) -> List[Dict[int, np.ndarray]]:
+    ''' Encodes every sentence once and returns, per doc, an
+        embedding for every annotated token: the mean of the subwords of
+        that token, or of the whole sentence if it can't be aligned.
+    '''
+    with_offsets = getattr(model.tokenizer, 'is_fast', False)
+    hidden, mask, offsets = _encode(
+        model, [doc.raw_sent for doc in docs], with_offsets
+    )
+
+    result = []
+    for i, doc in enumerate(docs):
+        sent_mask = mask[i].astype(bool)
+        sent_vector = hidden[i][sent_mask].mean(axis=0)
+        sns = doc.get_category(AnnCategory.SNS)
+        spans = _token_spans(doc.raw_sent, doc.get_category(AnnCategory.TOK))
+
+        vectors = {}
+        for j, (syn, span) in enumerate(zip(sns, spans)):
+            if not syn:
+                continue
+            vector = sent_vector
+            if offsets is not None and span is not None:
+                subwords = [k for k, (start, end) in enumerate(offsets[i])
+                            if sent_mask[k] and end > start
+                            and start < span[1] and end > span[0]]
+                if subwords:
+                    vector = hidden[i][subwords].mean(axis=0)
+            vectors[j] = vector
+        result.append(vectors)
+    return result
+
+
+def predict_biencoder(
+    to_predict_file: Iterable[ConllDoc],
+    model: ClassificationModel,
+    gloss_index: GlossIndex,
+    sense_index: SenseIndex,
+    gloss_cache: Optional[GlossCache] = None,
+    batch_size: int = 64,
+    stats: Optional[PrefilterStats] = None
+):
+    """ Predict all synsets from a file with separate sentence and gloss
+        embeddings: every sentence is encoded once and the candidate senses
+        of a token are ranked by the dot product of the token embedding with
+        their precomputed gloss embeddings. Tokens with less than two
+        candidate senses are resolved without the model.
+
+        Experimental: the embeddings are mean-pooled hidden states of the
+        encoder of the sentence-pair classifier, which was not trained as a
+        bi-encoder.
+    """
+    all_predictions = []
+    batch: List[ConllDoc] = []
+
+    def flush():
+        for doc, vectors in zip(batch, _context_vectors(model, batch)):
+            doc_pred = []
+            for j, syn in enumerate(doc.get_category(AnnCategory.SNS)):
+                if not syn:
+                    doc_pred.append(None)
+                    continue
+
+                lem, pos, _ = syn.split(".")
+                senses = sense_index.senses(lem, pos)
+                trivial = trivial_prediction(lem, pos, senses)
+                if stats is not None:
+                    stats.add(len(senses), trivial is not None)
+                if trivial is not None:
+                    doc_pred.append(trivial)
+                    continue
+
+                candidates = gloss_index.vectors(senses, model, gloss_cache)
+                scores = candidates @ _normalize(vectors[j])
+                sense_num_most_probable = int(np.argmax(scores)) + 1
+                doc_pred.append(make_sns_str(lem, pos, sense_num_most_probable))
+            all_predictions.append(doc_pred)
+        batch.clear()
+
+    for doc in to_predict_file:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return all_predictions
@@ -0,0 +1,170 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from src.columnar import ColumnarConllDataset
+from src.conll import AnnCategory, ConllDoc
+from src.wordnet import SenseIndex
+
+DIMENSIONS = ('lemma', 'pos', 'sense', 'train_freq', 'polysemy')
+
+# Upper bounds (inclusive) of the buckets, the last bucket is open
+FREQ_BUCKETS = (0, 4, 19, 99)
+POLYSEMY_BUCKETS = (0, 1, 2, 5, 10)
+
+
+def bucket_name(value: int, bounds: Tuple[int, ...]) -> str:
+    ''' Name of the bucket a value falls in, e.g. 7 -> '5-19' '''
+    low = 0
+    for high in bounds:
+        if value <= high:
+            return str(high) if low == high else f'{low}-{high}'
+        low = high + 1
+    return f'{low}+'
+
+
+def split_sense(label: str) -> Tuple[str, str, str]:
+    ''' Splits a synset string into lemma, pos and sense number'''
+    lem, pos, sense = label.rsplit('.', 2)
+    return lem, pos, sense
+
+
+def lemma_counts(
+    train: Union[ColumnarConllDataset, Iterable[ConllDoc]]
+) -> Dict[str, int]:
+    ''' Number of occurrences of every lemma.pos in the synset layer of a
+        dataset, the summed sense counts of create_freq_dict in
+        src/mfs.py. Any other iterable of docs (e.g. a stream from
+        ConllDataset.iter_docs) is counted doc by doc.
+    '''
+    lemmas: Dict[str, int] = {}
+    if not isinstance(train, ColumnarConllDataset):
+        for doc in train:
+            for label in doc.get_category(AnnCategory.SNS):
+                if label:
+                    lem, pos, _ = split_sense(label)
+                    key = f'{lem}.{pos}'
+                    lemmas[key] = lemmas.get(key, 0) + 1
+        return lemmas
+
+    column = np.frombuffer(train.columns[AnnCategory.SNS], dtype=np.uint32)
+    ids, counts = np.unique(column, return_counts=True)
+    for string_id, count in zip(ids.tolist(), counts.tolist()):
+        if (label := train.strings[string_id]):
+            lem, pos, _ = split_sense(label)
+            key = f'{lem}.{pos}'
+            lemmas[key] = lemmas.get(key, 0) + count
+    return lemmas
+
+
+class SliceIndex:
+    ''' Groups the rows (annotated gold labels) of an evaluation set by the
+        keys of every dimension: the rows of a key are a contiguous range in
+        the row order of that dimension.
+
+            codes['pos']:   [0, 1, 0, 2, ...]   key id per row
+            order['pos']:   [0, 2, ..., 1, ...] rows sorted by key id
+            offsets['pos']: [0, 1200, ...]      start of every key in order
+    '''
+
+    def __init__(self, keys: Dict[str, List[str]],
+                 codes: Dict[str, np.ndarray]) -> None:
+        self.keys = keys
+        self.codes = codes
+        self.order: Dict[str, np.ndarray] = {}
+        self.offsets: Dict[str, np.ndarray] = {}
+        for dimension, row_codes in codes.items():
+            self.order[dimension] = np.argsort(row_codes, kind='stable')
+            counts = np.bincount(row_codes, minlength=len(keys[dimension]))
+            self.offsets[dimension] = np.concatenate(([0], np.cumsum(counts)))
+
+    @classmethod
+    def build(
+        cls,
+        gold_ids: np.ndarray,
+        vocab: Dict[str, int],
+        train_counts: Optional[Dict[str, int]] = None,
+        sense_index: Optional[SenseIndex] = None
+    ) -> 'SliceIndex':
+        ''' Builds the index from the encoded gold labels. The keys are
+            derived once per unique label and then mapped to all rows. The
+            train frequency and polysemy dimensions need train_counts and a
+            sense_index respectively and are left out otherwise.
+        '''
+        names = {label_id: label for label, label_id in vocab.items()}
+        unique, inverse = np.unique(gold_ids, return_inverse=True)
+
+        key_fns: Dict[str, Callable[[str, str, str], str]] = {
+            'lemma': lambda lem, pos, _: f'{lem}.{pos}',
+            'pos': lambda _, pos, __: pos,
+            'sense': lambda _, __, sense: sense,
+        }
+        if train_counts is not None:
+            key_fns['train_freq'] = lambda lem, pos, _: bucket_name(
+                train_counts.get(f'{lem}.{pos}', 0), FREQ_BUCKETS
+            )
+        if sense_index is not None:
+            key_fns['polysemy'] = lambda lem, pos, _: bucket_name(
+                len(sense_index.senses(lem, pos)), POLYSEMY_BUCKETS
+            )
+
+        labels = [split_sense(names[label_id]) for label_id in unique.tolist()]
+        keys: Dict[str, List[str]] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for dimension, key_fn in key_fns.items():
+            label_keys = [key_fn(*label) for label in labels]
+            keys[dimension] = sorted(set(label_keys))
+            key_ids = {key: i for i, key in enumerate(keys[dimension])}
+            label_codes = np.array([key_ids[key] for key in label_keys],
+                                   dtype=np.int64)
+            codes[dimension] = label_codes[inverse]
+        return cls(keys, codes)
+
+    def rows(self, dimension: str, key: str) -> np.ndarray:
+        ''' Returns the rows with the given key'''
+        code = self.keys[dimension].index(key)
+        start, end = self.offsets[dimension][code:code + 2]
+        return self.order[dimension][start:end]
+
+    def counts(self, dimension: str) -> np.ndarray:
+        return np.diff(self.offsets[dimension])
+
+    def accuracy(self, correct: np.ndarray) -> Dict[str, np.ndarray]:
+        ''' Accuracy of every key of every dimension, given whether each row
+            was predicted correctly.
+        '''
+        return {
+            dimension: np.bincount(row_codes, weights=correct,
+                                   minlength=len(self.keys[dimension]))
+            / np.maximum(self.counts(dimension), 1)
+            for dimension, row_codes in self.codes.items()
+        }
+
+
+def slice_rows(
+    index: SliceIndex,
+    all_correct: Iterable[np.ndarray],
+    min_count: int = 1
+) -> List[List]:
+    ''' Rows of the slice table: dimension, key, number of gold labels and
+        the accuracy per system. The first row is the accuracy over all
+        labels, the slices of every dimension are sorted by size.
+    '''
+    all_correct = list(all_correct)
+    accuracies = [index.accuracy(correct) for correct in all_correct]
+
+    rows = [['all', 'all', len(all_correct[0]) if all_correct else 0]
+            + [float(np.mean(correct)) if len(correct) else 0.0
+               for correct in all_correct]]
+    for dimension in DIMENSIONS:
+        if dimension not in index.keys:
+            continue
+        counts = index.counts(dimension)
+        for code in np.argsort(-counts, kind='stable').tolist():
+            if counts[code] < min_count:
+                continue
+            rows.append([dimension, index.keys[dimension][code],
+                         int(counts[code])]
+                        + [float(accuracy[dimension][code])
+                           for accuracy in accuracies])
+    return rows
@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from src.mfs import NO_ENTRY
+from src.wordnet import SenseIndex, get_wn_senses, make_sns_str
+
+
+def candidate_names(
+    lem: str,
+    pos: str,
+    sense_index: Optional[SenseIndex] = None
+) -> List[str]:
+    ''' Returns the names of all possible synsets (senses) of a lemma and POS,
+        from the sense index or else from WordNet.
+    '''
+    if sense_index is not None:
+        return sense_index.senses(lem, pos)
+    return [sense.name() for sense in get_wn_senses(lem, pos)]
+
+
+def trivial_prediction(lem: str, pos: str, senses: List[str]) -> Optional[str]:
+    ''' Returns the prediction for a token that doesn't need the model: the
+        only sense if there is one candidate (what the model would pick as
+        well) or NO_ENTRY without candidates. Returns None for ambiguous
+        tokens.
+    '''
+    if len(senses) > 1:
+        return None
+    return make_sns_str(lem, pos, 1) if senses else NO_ENTRY
+
+
+@dataclass
+class PrefilterStats:
+    ''' Counts how much model work the candidate pre-filter avoided'''
+    tokens: int = 0
+    resolved: int = 0
+    pairs: int = 0
+    pairs_avoided: int = 0
+
+    def add(self, n_senses: int, resolved: bool) -> None:
+        self.tokens += 1
+        if resolved:
+            self.resolved += 1
+            self.pairs_avoided += n_senses
+        else:
+            self.pairs += n_senses
+
+    def merge(self, other: 'PrefilterStats') -> None:
+        self.tokens += other.tokens
+        self.resolved += other.resolved
+        self.pairs += other.pairs
+        self.pairs_avoided += other.pairs_avoided
+
+    def __str__(self) -> str:
+        tokens = max(self.tokens, 1)
+        pairs = max(self.pairs + self.pairs_avoided, 1)
+        return (f'{self.resolved} of {self.tokens} tokens '
+                f'({self.resolved / tokens:.1%}) resolved without the model, '
+                f'{self.pairs_avoided} of {self.pairs + self.pairs_avoided} '
+                f'sentence pairs ({self.pairs_avoided / pairs:.1%}) avoided')
@@ -0,0 +1,412 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+from src.conll import AnnCategory, ConllDataset, ConllDoc
+
+# Id of None (the nil/none aliases) in the string table
+NONE_ID = 0
+
+# Binary cache file layout: magic, format version and header length, followed
+# by a json header (string table and source file info) and the raw arrays.
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'CONLLCOL'
+CACHE_VERSION = 1
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGN = 8
+# Errors that loading a corrupt or truncated cache file can raise
+CACHE_ERRORS = (OSError, ValueError, KeyError, TypeError, struct.error)
+
+
+class LayerView(Sequence):
+    ''' A read-only, zero-copy view on a slice of an annotation column. It
+        behaves like the list of strings a ConllDoc holds, but only decodes
+        the string ids when they are accessed.
+    '''
+    __slots__ = ('ids', '_strings')
+
+    def __init__(self, ids: memoryview, strings: List[Optional[str]]) -> None:
+        self.ids = ids
+        self._strings = strings
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return LayerView(self.ids[idx], self._strings)
+        return self._strings[self.ids[idx]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other)
+        )
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class ColumnarTok:
+    ''' A single token of a ColumnarConllDataset, with the same annotation
+        attributes as a ConllTok.
+    '''
+    __slots__ = ('_dataset', '_pos')
+
+    def __init__(self, dataset: 'ColumnarConllDataset', pos: int) -> None:
+        self._dataset = dataset
+        self._pos = pos
+
+    def get_category(self, category: AnnCategory) -> Optional[str]:
+        return self._dataset.strings[self._dataset.columns[category][self._pos]]
+
+    tok = property(lambda self: self.get_category(AnnCategory.TOK))
+    sym = property(lambda self: self.get_category(AnnCategory.SYM))
+    sem = property(lambda self: self.get_category(AnnCategory.SEM))
+    cat = property(lambda self: self.get_category(AnnCategory.CAT))
+    sns = property(lambda self: self.get_category(AnnCategory.SNS))
+    rol = property(lambda self: self.get_category(AnnCategory.ROL))
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{category.value}={self.get_category(category)!r}'
+                           for category in AnnCategory)
+        return f'ColumnarTok({fields})'
+
+
+class ColumnarDoc:
+    ''' A document of a ColumnarConllDataset. It offers the same interface
+        as a ConllDoc, but is only a view on the columns of the dataset.
+    '''
+    __slots__ = ('_dataset', '_index', '_start', '_end')
+
+    def __init__(self, dataset: 'ColumnarConllDataset', index: int) -> None:
+        self._dataset = dataset
+        self._index = index
+        self._start = dataset.doc_offsets[index]
+        self._end = dataset.doc_offsets[index + 1]
+
+    @property
+    def id(self) -> Optional[str]:
+        return self._dataset.strings[self._dataset.doc_ids[self._index]]
+
+    @property
+    def raw_sent(self) -> Optional[str]:
+        return self._dataset.strings[self._dataset.doc_sents[self._index]]
+
+    tok = property(lambda self: self.get_category(AnnCategory.TOK))
+    sym = property(lambda self: self.get_category(AnnCategory.SYM))
+    sem = property(lambda self: self.get_category(AnnCategory.SEM))
+    cat = property(lambda self: self.get_category(AnnCategory.CAT))
+    sns = property(lambda self: self.get_category(AnnCategory.SNS))
+    rol = property(lambda self: self.get_category(AnnCategory.ROL))
+
+    def get_by_token(self, token: str) -> Optional[ColumnarTok]:
+        ''' Get all annotations for a specific token by string.
+            Returns None if the token does not exist in the sentence.
+        '''
+        try:
+            return self.get_by_index(self.tok.index(token))
+        except ValueError:
+            return None
+
+    def get_by_index(self, idx: int) -> Optional[ColumnarTok]:
+        ''' Get all annotations for a specific token by index.
+            Returns None if the token does not exist in the sentence.
+        '''
+        length = len(self)
+        if 0 < idx >= length:
+            return None
+        if idx < 0:
+            if idx < -length:
+                raise IndexError('token index out of range')
+            idx += length
+        return ColumnarTok(self._dataset, self._start + idx)
+
+    def get_category(self, category: AnnCategory) -> LayerView:
+        ''' Returns all annotations of a certain category'''
+        return LayerView(
+            self._dataset.columns[category][self._start:self._end],
+            self._dataset.strings
+        )
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __str__(self) -> str:
+        ''' Nicely formatted doc '''
+        return '\n'.join((
+            'ColumnarDoc(',
+            f'  id: {self.id}',
+            f'  raw_sent: {self.raw_sent}',
+            *(f'  {category.value}: {self.get_category(category)}'
+              for category in AnnCategory),
+            ')',
+        ))
+
+
+class _DocsView(Sequence):
+    ''' Sequence of ColumnarDocs, created on access '''
+    __slots__ = ('_dataset',)
+
+    def __init__(self, dataset: 'ColumnarConllDataset') -> None:
+        self._dataset = dataset
+
+    def __getitem__(self, idx: Union[int, slice]):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('doc index out of range')
+        return ColumnarDoc(self._dataset, idx)
+
+    def __len__(self) -> int:
+        return len(self._dataset)
+
+
+class ColumnarConllDataset:
+    ''' A column oriented alternative to the ConllDataset. Every annotation
+        layer is stored as a single flat array of string ids into a shared
+        string table, plus an array with the token offset of every doc:
+
+            doc_offsets: [0, 12, 30, ...]
+            tok:  [ 4,  5,  6, ...]  ->  strings[4] = 'A', ...
+            sym:  [...]
+            ...
+
+        Docs and tokens are lightweight views on these columns, so only the
+        unique strings are kept as Python objects.
+    '''
+
+    def __init__(self, docs: Iterable[ConllDoc]) -> None:
+        self.strings: List[Optional[str]] = [None]
+        self._string_ids: Optional[Dict[str, int]] = {}
+        self._mmap: Optional[mmap.mmap] = None
+
+        offsets = array('I', [0])
+        doc_ids = array('I')
+        doc_sents = array('I')
+        columns = {category: array('I') for category in AnnCategory}
+        for doc in docs:
+            doc_ids.append(self.intern(doc.id))
+            doc_sents.append(self.intern(doc.raw_sent))
+            for category, column in columns.items():
+                column.extend(map(self.intern, doc.get_category(category)))
+            offsets.append(len(columns[AnnCategory.TOK]))
+
+        self.doc_offsets = memoryview(offsets)
+        self.doc_ids = memoryview(doc_ids)
+        self.doc_sents = memoryview(doc_sents)
+        self.columns: Dict[AnnCategory, memoryview] = {
+            category: memoryview(column)
+            for category, column in columns.items()
+        }
+
+    @classmethod
+    def from_file(
+        cls,
+        file_path: str,
+        debug_log: bool = False
+    ) -> 'ColumnarConllDataset':
+        ''' Builds the columns from a conll file, streaming it doc by doc '''
+        return cls(ConllDataset.iter_docs(file_path, debug_log))
+
+    def save(self, path: str, source: Optional[dict] = None) -> None:
+        ''' Writes the columns and string table to a binary file that can be
+            memory-mapped by load(). Source file info is stored in the header
+            to check if the file is still up to date.
+        '''
+        arrays = [self.doc_offsets, self.doc_ids, self.doc_sents,
+                  *(self.columns[category] for category in AnnCategory)]
+        header = json.dumps({
+            'source': source,
+            'byteorder': sys.byteorder,
+            'n_docs': len(self),
+            'n_tokens': len(self.columns[AnnCategory.TOK]),
+            'strings': self.strings,
+        }).encode('utf-8')
+        header += b' ' * (-(_PREAMBLE.size + len(header)) % _ALIGN)
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_PREAMBLE.pack(CACHE_MAGIC, CACHE_VERSION, len(header)))
+            f.write(header)
+            for column in arrays:
+                f.write(column.tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        source: Optional[dict] = None
+    ) -> Optional['ColumnarConllDataset']:
+        ''' Memory-maps a file written by save(). Returns None if the file is
+            not a valid cache or was made from a different source file, and
+            raises one of CACHE_ERRORS if it is corrupt or truncated.
+        '''
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return None
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        dataset = None
+        try:
+            dataset = cls._from_mmap(mm, source)
+        finally:
+            # The dataset keeps the mmap open, it is closed otherwise
+            if dataset is None:
+                mm.close()
+        return dataset
+
+    @classmethod
+    def _from_mmap(
+        cls,
+        mm: mmap.mmap,
+        source: Optional[dict]
+    ) -> Optional['ColumnarConllDataset']:
+        magic, version, header_len = _PREAMBLE.unpack_from(mm)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            return None
+        header = json.loads(mm[_PREAMBLE.size:_PREAMBLE.size + header_len])
+        if header['byteorder'] != sys.byteorder:
+            return None
+        if source is not None and not _same_source(header['source'], source):
+            return None
+
+        # Check the size before any views on the mmap are made, a view that
+        # is still around would keep it from being closed
+        n_docs, n_tokens = int(header['n_docs']), int(header['n_tokens'])
+        itemsize = array('I').itemsize
+        n_items = n_docs + 1 + 2 * n_docs + len(AnnCategory) * n_tokens
+        if len(mm) != _PREAMBLE.size + header_len + n_items * itemsize:
+            raise ValueError('cache file has the wrong size')
+        strings = header['strings']
+        if not isinstance(strings, list):
+            raise TypeError('cache file has no string table')
+
+        dataset = cls.__new__(cls)
+        dataset.strings = strings
+        dataset._string_ids = None
+        dataset._mmap = mm
+
+        data = memoryview(mm).cast('B')
+        offset = _PREAMBLE.size + header_len
+
+        def take(length: int) -> memoryview:
+            nonlocal offset
+            view = data[offset:offset + length * itemsize].cast('I')
+            offset += length * itemsize
+            return view
+
+        dataset.doc_offsets = take(n_docs + 1)
+        dataset.doc_ids = take(n_docs)
+        dataset.doc_sents = take(n_docs)
+        dataset.columns = {category: take(n_tokens)
+                           for category in AnnCategory}
+        return dataset
+
+    def intern(self, string: Optional[str]) -> int:
+        ''' Returns the id of a string, adding it to the table if needed '''
+        if string is None:
+            return NONE_ID
+        if self._string_ids is None:
+            self._string_ids = {string: idx for idx, string
+                                in enumerate(self.strings) if idx != NONE_ID}
+        if (idx := self._string_ids.get(string)) is None:
+            idx = self._string_ids[string] = len(self.strings)
+            self.strings.append(string)
+        return idx
+
+    @property
+    def docs(self) -> Sequence:
+        return _DocsView(self)
+
+    def get_category(self, category: AnnCategory) -> List[LayerView]:
+        ''' Returns all annotations of a certain category, as views on the
+            column per doc.
+        '''
+        column = self.columns[category]
+        offsets = self.doc_offsets
+        return [LayerView(column[offsets[i]:offsets[i + 1]], self.strings)
+                for i in range(len(self))]
+
+    def get_sents(self) -> List[Optional[str]]:
+        ''' Returns all raw sentences in the dataset '''
+        return [self.strings[idx] for idx in self.doc_sents]
+
+    def get_ids(self) -> List[Optional[str]]:
+        ''' Returns all document ids in the dataset '''
+        return [self.strings[idx] for idx in self.doc_ids]
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self) -> Iterator[ColumnarDoc]:
+        return (ColumnarDoc(self, i) for i in range(len(self)))
+
+
+def _source_info(file_path: str, with_hash: bool = False) -> dict:
+    stat = os.stat(file_path)
+    info = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            while (chunk := f.read(1 << 20)):
+                sha1.update(chunk)
+        info['sha1'] = sha1.hexdigest()
+    return info
+
+
+def _same_source(cached: Optional[dict], source: dict) -> bool:
+    ''' A cache is valid if the source file has the same size and mtime, or
+        the same content hash if the file was only touched.
+    '''
+    if not cached or cached['size'] != source['size']:
+        return False
+    if cached['mtime_ns'] == source['mtime_ns']:
+        return True
+    if 'sha1' not in source:
+        source.update(_source_info(source['path'], with_hash=True))
+    return cached.get('sha1') == source['sha1']
+
+
+def load_conll(
+    file_path: str,
+    use_cache: bool = True,
+    debug_log: bool = False
+) -> ColumnarConllDataset:
+    ''' Loads a conll file as a ColumnarConllDataset. The parsed columns are
+        stored in a binary file next to the source (<file>.cache), which is
+        memory-mapped instead of parsing the text again on later calls. The
+        cache is rebuilt when the source file changes.
+    '''
+    if not use_cache:
+        return ColumnarConllDataset.from_file(file_path, debug_log)
+
+    cache_path = file_path + CACHE_SUFFIX
+    source = {'path': file_path, **_source_info(file_path)}
+    if os.path.exists(cache_path):
+        try:
+            dataset = ColumnarConllDataset.load(cache_path, source)
+            # An empty dataset is a valid cache as well
+            if dataset is not None:
+                return dataset
+        except CACHE_ERRORS as e:
+            logging.warning('Ignoring invalid cache %s: %s' % (cache_path, e))
+
+    dataset = ColumnarConllDataset.from_file(file_path, debug_log)
+    try:
+        source.update(_source_info(file_path, with_hash=True))
+        dataset.save(cache_path, source)
+    except OSError as e:
+        logging.warning('Could not write cache %s: %s' % (cache_path, e))
+    return dataset
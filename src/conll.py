@@ -1,7 +1,7 @@
 import logging
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional
 
 # Aliases for nil/none values in the dataset
 ROL_NONE = '[]'
@@ -105,59 +105,77 @@ class ConllDataset:
 
     def __init__(self, file_path: str, debug_log: bool = False) -> None:
         self.debug_log = debug_log
-        self.docs: List[ConllDoc] = self.__parse_docs(file_path)
-
-    def __parse_docs(self, file_path: str) -> List[ConllDoc]:
+        self.docs: List[ConllDoc] = list(self.iter_docs(file_path, debug_log))
+
+    @classmethod
+    def iter_docs(
+        cls,
+        file_path: str,
+        debug_log: bool = False
+    ) -> Iterator[ConllDoc]:
+        ''' Reads a conll file line by line and yields the ConllDocs one at
+            a time, as soon as the blank line that closes them is reached.
+            Only a single document is kept in memory, so this can be used on
+            files that are too big to load as a ConllDataset.
+        '''
         with open(file_path) as f:
-            docs = f.read().rstrip().split('\n\n')
-
-        result: List[ConllDoc] = []
-        for doc in docs:
-            temp_doc = {
-                'id': None,
-                'raw_sent': None,
-                'tok': [],
-                'sym': [],
-                'sem': [],
-                'cat': [],
-                'sns': [],
-                'rol': [],
-            }
-            # This is done in order to ensure we don't overwrite an id if a
-            # sentence / line contains this exact string for some reason.
-            found_id, found_sent = False, False
-            for line in doc.split('\n'):
-                if line.startswith('#'):
-                    if not found_id and 'newdoc id' in line:
-                        temp_doc['id'] = line.split(' = ')[-1]
-                        found_id = True
-                    elif not found_sent and 'raw sent' in line:
-                        temp_doc['raw_sent'] = line.split(' = ')[-1]
-                        found_sent = True
-                else:
-                    # Sanity check.
-                    items = line.split('\t')
-                    assert len(items) == 7, "Error in doc %s" % temp_doc['id']
-
-                    # tok:gold is in there two times for some reason?
-                    # That is why it is ignored here.
-                    tok, _, sym, sem, cat, sns, rol = items
-                    # assert tok == tok1, "What is different here"
-
-                    # None aliases are defined above.
-                    temp_doc['tok'].append(tok)
-                    temp_doc['sym'].append(sym)
-                    temp_doc['sem'].append(sem if sem != SEM_NONE else None)
-                    temp_doc['cat'].append(cat)
-                    temp_doc['sns'].append(sns if sns != SNS_NONE else None)
-                    temp_doc['rol'].append(rol if rol != ROL_NONE else None)
-
-            if not found_id and self.debug_log:
-                logging.warning('No id for doc with sent: %s' %
-                                temp_doc['raw_sent'])
-
-            result.append(ConllDoc(**temp_doc))
-        return result
+            lines: List[str] = []
+            for line in f:
+                line = line.rstrip('\n')
+                if line:
+                    lines.append(line)
+                elif lines:
+                    yield cls.__parse_doc(lines, debug_log)
+                    lines = []
+            if lines:
+                yield cls.__parse_doc(lines, debug_log)
+
+    @staticmethod
+    def __parse_doc(lines: Iterable[str], debug_log: bool) -> ConllDoc:
+        temp_doc = {
+            'id': None,
+            'raw_sent': None,
+            'tok': [],
+            'sym': [],
+            'sem': [],
+            'cat': [],
+            'sns': [],
+            'rol': [],
+        }
+        # This is done in order to ensure we don't overwrite an id if a
+        # sentence / line contains this exact string for some reason.
+        found_id, found_sent = False, False
+        for line in lines:
+            if line.startswith('#'):
+                if not found_id and 'newdoc id' in line:
+                    temp_doc['id'] = line.split(' = ')[-1]
+                    found_id = True
+                elif not found_sent and 'raw sent' in line:
+                    temp_doc['raw_sent'] = line.split(' = ')[-1]
+                    found_sent = True
+            else:
+                # Sanity check.
+                items = line.split('\t')
+                assert len(items) == 7, "Error in doc %s" % temp_doc['id']
+
+                # tok:gold is in there two times for some reason?
+                # That is why it is ignored here.
+                tok, _, sym, sem, cat, sns, rol = items
+                # assert tok == tok1, "What is different here"
+
+                # None aliases are defined above.
+                temp_doc['tok'].append(tok)
+                temp_doc['sym'].append(sym)
+                temp_doc['sem'].append(sem if sem != SEM_NONE else None)
+                temp_doc['cat'].append(cat)
+                temp_doc['sns'].append(sns if sns != SNS_NONE else None)
+                temp_doc['rol'].append(rol if rol != ROL_NONE else None)
+
+        if not found_id and debug_log:
+            logging.warning('No id for doc with sent: %s' %
+                            temp_doc['raw_sent'])
+
+        return ConllDoc(**temp_doc)
 
     def get_category(self, category: AnnCategory) -> List[List[str]]:
         ''' Returns all annotations of a certain category, this is sort of
@@ -182,3 +200,6 @@ class ConllDataset:
 
     def __len__(self) -> int:
         return len(self.docs)
+
+    def __iter__(self) -> Iterator[ConllDoc]:
+        return iter(self.docs)
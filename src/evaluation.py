@@ -0,0 +1,194 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from src.columnar import ColumnarConllDataset
+from src.conll import AnnCategory
+
+# Id of unannotated tokens (None / SNS_NONE) in encoded labels
+NO_LABEL = -1
+
+
+@dataclass
+class EncodedLabels:
+    ''' Synset labels of a dataset or prediction file as integer ids, with
+        the token offset of every doc:
+
+            ids:     [-1, 4, 7, -1, ...]
+            offsets: [0, 12, 30, ...]
+    '''
+    ids: np.ndarray
+    offsets: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+@dataclass
+class Scores:
+    ''' The accuracy scores that evaluate.py reports '''
+    synsets: float
+    mean_per_sentence: float
+    full_sentences: float
+
+
+class LabelEncoder:
+    ''' Maps synset strings to integer ids. Gold labels and predictions have
+        to be encoded with the same encoder to be comparable.
+    '''
+
+    def __init__(self) -> None:
+        self.vocab: Dict[str, int] = {}
+
+    def encode(self, labels: Iterable[Iterable[Optional[str]]]) -> EncodedLabels:
+        ''' Encodes labels per doc, e.g. a list of lists of predictions'''
+        vocab = self.vocab
+        ids = []
+        offsets = [0]
+        for doc_labels in labels:
+            ids.extend(vocab.setdefault(label, len(vocab)) if label
+                       else NO_LABEL for label in doc_labels)
+            offsets.append(len(ids))
+        return EncodedLabels(np.array(ids, dtype=np.int64),
+                             np.array(offsets, dtype=np.int64))
+
+    def encode_dataset(
+        self,
+        dataset: ColumnarConllDataset,
+        category: AnnCategory = AnnCategory.SNS
+    ) -> EncodedLabels:
+        ''' Encodes a column of a dataset directly from its string ids'''
+        lookup = np.array([
+            self.vocab.setdefault(string, len(self.vocab)) if string
+            else NO_LABEL for string in dataset.strings
+        ], dtype=np.int64)
+        column = np.frombuffer(dataset.columns[category], dtype=np.uint32)
+        offsets = np.frombuffer(dataset.doc_offsets, dtype=np.uint32)
+        return EncodedLabels(lookup[column], offsets.astype(np.int64))
+
+
+def _clean(labels: EncodedLabels):
+    ''' Removes unannotated tokens, returns the remaining ids, the number of
+        labels per doc and the offset of every doc in the remaining ids.
+    '''
+    keep = labels.ids != NO_LABEL
+    counts = np.diff(np.concatenate(([0], np.cumsum(keep)))[labels.offsets])
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return labels.ids[keep], counts, starts
+
+
+def _compare_docs(gold: EncodedLabels, predictions: EncodedLabels):
+    ''' Compares the labels of gold and predictions per doc. Returns the
+        cleaned ids of both sides and, for the docs that occur in both, the
+        number of labels on both sides, whether the docs are comparable (same
+        number of labels), the number of correct labels per doc and whether
+        every cleaned gold label was predicted correctly.
+    '''
+    gold_ids, gold_counts, gold_starts = _clean(gold)
+    pred_ids, pred_counts, pred_starts = _clean(predictions)
+
+    # Sentence level, only sentences with the same number of labels on both
+    # sides can be compared.
+    n_docs = min(len(gold), len(predictions))
+    gold_counts, gold_starts = gold_counts[:n_docs], gold_starts[:n_docs]
+    pred_counts, pred_starts = pred_counts[:n_docs], pred_starts[:n_docs]
+    comparable = gold_counts == pred_counts
+    counts = np.where(comparable, gold_counts, 0)
+
+    # Gather the labels of all comparable docs and count correct ones per doc
+    doc_of_label = np.repeat(np.arange(n_docs), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    gold_positions = gold_starts[doc_of_label] + local
+    correct = (gold_ids[gold_positions]
+               == pred_ids[pred_starts[doc_of_label] + local])
+    correct_per_doc = np.bincount(doc_of_label, weights=correct,
+                                  minlength=n_docs)
+    correct_labels = np.zeros(len(gold_ids), dtype=bool)
+    correct_labels[gold_positions] = correct
+
+    return (gold_ids, pred_ids, gold_counts, pred_counts, comparable,
+            correct_per_doc, correct_labels)
+
+
+def compute_scores(gold: EncodedLabels, predictions: EncodedLabels) -> Scores:
+    ''' Computes all accuracy scores with array operations. Unannotated
+        tokens are removed from both sides first, after which the labels are
+        compared by position: over all labels for the synset score (0 if the
+        number of labels differs), per doc for the sentence scores.
+    '''
+    (gold_ids, pred_ids, gold_counts, pred_counts, comparable,
+     correct_per_doc, _) = _compare_docs(gold, predictions)
+    n_docs = len(gold_counts)
+
+    # Synset level
+    if len(gold_ids) != len(pred_ids):
+        logging.warning('Provided different length lists for accuracy score')
+        synsets = 0.0
+    elif not len(gold_ids):
+        logging.warning('Provided empty lists for accuracy score')
+        synsets = 0.0
+    else:
+        synsets = float(np.mean(gold_ids == pred_ids))
+
+    annotated = (gold_counts > 0) & (pred_counts > 0)
+    if not annotated.any():
+        raise ZeroDivisionError('No annotated sentences to evaluate')
+    per_sentence = np.where(comparable & annotated,
+                            correct_per_doc / np.maximum(gold_counts, 1), 0)
+    # Summed in order (cumsum) instead of pairwise, so the result is equal
+    # to a plain sum() of the per-sentence accuracies.
+    per_sentence = per_sentence[annotated]
+    mean_per_sentence = float(np.cumsum(per_sentence)[-1] / len(per_sentence))
+
+    if len(gold) != len(predictions):
+        logging.warning('Provided different length lists for accuracy score')
+        full_sentences = 0.0
+    elif not n_docs:
+        full_sentences = 0.0
+    else:
+        full_sentences = float(np.mean(comparable
+                                       & (correct_per_doc == gold_counts)))
+
+    return Scores(synsets, mean_per_sentence, full_sentences)
+
+
+def label_correctness(
+    gold: EncodedLabels,
+    predictions: EncodedLabels
+) -> Tuple[np.ndarray, np.ndarray]:
+    ''' Returns the ids of all annotated gold labels and whether each of
+        them was predicted correctly. Labels in docs with a different number
+        of predicted labels count as wrong.
+    '''
+    gold_ids, *_, correct_labels = _compare_docs(gold, predictions)
+    return gold_ids, correct_labels
+
+
+def doc_statistics(
+    gold: EncodedLabels,
+    predictions: EncodedLabels
+) -> Tuple[np.ndarray, np.ndarray]:
+    ''' Splits every score into a numerator and denominator per doc, so
+        that the score of any weighted selection of docs w (e.g. a bootstrap
+        resample) is (w @ numerators) / (w @ denominators). Returns two
+        arrays of shape (n_scores, n_docs), in the order of Scores.
+
+        Synsets are counted per doc here, a doc with a different number of
+        labels than the gold doc has no correct synsets. The score over all
+        docs only differs from compute_scores() for such predictions.
+    '''
+    _, _, gold_counts, pred_counts, comparable, correct_per_doc, _ = \
+        _compare_docs(gold, predictions)
+
+    annotated = ((gold_counts > 0) & (pred_counts > 0)).astype(np.float64)
+    per_sentence = np.where(comparable,
+                            correct_per_doc / np.maximum(gold_counts, 1), 0)
+    full = (comparable & (correct_per_doc == gold_counts)).astype(np.float64)
+
+    numerators = np.stack([correct_per_doc, per_sentence * annotated, full])
+    denominators = np.stack([gold_counts.astype(np.float64), annotated,
+                             np.ones_like(full)])
+    return numerators, denominators
@@ -0,0 +1,229 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import torch
+from simpletransformers.classification import ClassificationModel
+
+from src.wordnet import GlossParts, join_wn_context
+
+
+class PairEncoder:
+    ''' Builds model inputs for text pairs from cached token ids. Every unique
+        text (a sentence or a gloss) is tokenized only once, no matter how
+        many pairs it occurs in.
+    '''
+
+    def __init__(self, tokenizer, max_seq_length: int) -> None:
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+        self.num_special = tokenizer.num_special_tokens_to_add(pair=True)
+        self._token_ids: Dict[str, List[int]] = {}
+
+    def token_ids(self, text: str) -> List[int]:
+        ''' Returns the token ids of a text, without special tokens'''
+        if (ids := self._token_ids.get(text)) is None:
+            ids = self._token_ids[text] = self.tokenizer.encode(
+                text, add_special_tokens=False
+            )
+        return ids
+
+    def pair_length(self, text_a: str, text_b: str) -> int:
+        ''' Returns the length of the encoded pair, without encoding it'''
+        length = (len(self.token_ids(text_a)) + len(self.token_ids(text_b))
+                  + self.num_special)
+        return min(length, self.max_seq_length)
+
+    def truncated_lengths(self, len_a: int, len_b: int) -> Tuple[int, int]:
+        ''' Returns the number of tokens of both texts that fit in the
+            maximum sequence length, the same as the longest_first
+            truncation of the tokenizer. Fast (Rust) tokenizers give the
+            shorter text (the first one on a tie) at least half of the
+            space, the odd token goes to the other one. The Python
+            tokenizers remove one token at a time from the longer text
+            (the second one on a tie).
+        '''
+        budget = max(0, self.max_seq_length - self.num_special)
+        if len_a + len_b <= budget:
+            return len_a, len_b
+
+        if not getattr(self.tokenizer, 'is_fast', False):
+            for _ in range(len_a + len_b - budget):
+                if len_a > len_b:
+                    len_a -= 1
+                else:
+                    len_b -= 1
+            return len_a, len_b
+
+        swap = len_a > len_b
+        short, long = (len_b, len_a) if swap else (len_a, len_b)
+        keep_short = short
+        keep_long = short if short > budget else max(short, budget - short)
+        if keep_short + keep_long > budget:
+            keep_short = budget // 2
+            keep_long = keep_short + budget % 2
+        short, long = min(short, keep_short), min(long, keep_long)
+        return (long, short) if swap else (short, long)
+
+    def encode_pair(
+        self,
+        text_a: str,
+        text_b: str
+    ) -> Tuple[List[int], List[int]]:
+        ''' Returns the input ids and token type ids of a text pair,
+            truncated to the maximum sequence length. The output is the
+            same as tokenizer(text_a, text_b, truncation='longest_first',
+            max_length=max_seq_length).
+        '''
+        ids_a, ids_b = self.token_ids(text_a), self.token_ids(text_b)
+        len_a, len_b = self.truncated_lengths(len(ids_a), len(ids_b))
+        ids_a, ids_b = ids_a[:len_a], ids_b[:len_b]
+
+        return (
+            self.tokenizer.build_inputs_with_special_tokens(ids_a, ids_b),
+            self.tokenizer.create_token_type_ids_from_sequences(ids_a, ids_b),
+        )
+
+
+def collate(
+    model: ClassificationModel,
+    batch: Sequence[Tuple[List[int], List[int]]]
+) -> Dict[str, torch.Tensor]:
+    ''' Pads a batch of encoded pairs to its longest pair and returns the
+        model inputs on the device of the model.
+    '''
+    pad_id = model.tokenizer.pad_token_id
+    length = max(len(input_ids) for input_ids, _ in batch)
+
+    input_ids = torch.full((len(batch), length), pad_id)
+    token_type_ids = torch.zeros((len(batch), length), dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+    for row, (ids, types) in enumerate(batch):
+        input_ids[row, :len(ids)] = torch.tensor(ids)
+        token_type_ids[row, :len(types)] = torch.tensor(types)
+        attention_mask[row, :len(ids)] = 1
+
+    inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+    if 'token_type_ids' in model.tokenizer.model_input_names:
+        inputs['token_type_ids'] = token_type_ids
+    return {k: v.to(model.device) for k, v in inputs.items()}
+
+
+def length_sorted(
+    features: Sequence[Tuple[List[int], List[int]]]
+) -> List[int]:
+    ''' Indices of the features from short to long, so that batches of
+        consecutive features need little padding.
+    '''
+    return sorted(range(len(features)), key=lambda i: len(features[i][0]))
+
+
+def run_model(
+    model: ClassificationModel,
+    inputs: Dict[str, torch.Tensor]
+) -> torch.Tensor:
+    ''' Returns the logits of a batch, from the torch model or, for a model
+        loaded with the onnx argument, from its ONNX Runtime session.
+    '''
+    if model.args.onnx:
+        names = [node.name for node in model.model.get_inputs()]
+        if (missing := [name for name in names if name not in inputs]):
+            raise ValueError(f'The ONNX model expects the inputs '
+                             f'{", ".join(missing)}, which the batch lacks')
+        outputs = model.model.run(
+            None, {name: inputs[name].cpu().numpy() for name in names}
+        )
+        return torch.from_numpy(outputs[0])
+    return model.model(**inputs)[0]
+
+
+def forward_batches(
+    model: ClassificationModel,
+    features: Sequence[Tuple[List[int], List[int]]],
+    batch_size: int
+) -> List[float]:
+    ''' Runs encoded pairs through the model and returns the raw output of
+        the positive class. The pairs are batched by length and every batch
+        is padded to its longest pair.
+    '''
+    order = length_sorted(features)
+
+    if not model.args.onnx:
+        model.model.eval()
+    scores: List[float] = [0.0] * len(features)
+    with torch.no_grad():
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            logits = run_model(model, collate(model, [features[i]
+                                                      for i in rows]))
+            for i, score in zip(rows, logits[:, 1].tolist()):
+                scores[i] = score
+    return scores
+
+
+def score_pairs(
+    model: ClassificationModel,
+    pairs: Iterable[Sequence[str]],
+    batch_size: Optional[int] = None,
+    encoder: Optional[PairEncoder] = None
+) -> List[float]:
+    ''' Scores (sentence, gloss) pairs with the sentence-pair classifier and
+        returns the raw output of the positive class for every pair, the
+        same as the logits of the model for the tokenizer's encoding of the
+        pairs. (model.predict() of simpletransformers leaves out the token
+        type ids, so its raw outputs can differ slightly.) Duplicate pairs
+        are encoded and scored only once and the score is copied to all of
+        them.
+    '''
+    if encoder is None:
+        encoder = PairEncoder(model.tokenizer, model.args.max_seq_length)
+
+    unique: Dict[Tuple[str, str], int] = {}
+    index = [unique.setdefault((pair[0], pair[1]), len(unique))
+             for pair in pairs]
+
+    features = [encoder.encode_pair(text_a, text_b)
+                for text_a, text_b in unique]
+    scores = forward_batches(
+        model, features, batch_size or model.args.eval_batch_size
+    )
+    return [scores[i] for i in index]
+
+
+# Gloss components in the order in which they are dropped when a sentence
+# pair doesn't fit, the definition of the sense itself is kept longest.
+DROP_ORDER = ('side', 'hypo', 'hyper', 'example', 'definition')
+
+
+class GlossTruncator:
+    ''' Shortens gloss contexts that don't fit in the maximum sequence length
+        together with their sentence. Instead of cutting off the tail of the
+        joined gloss, whole components are dropped in DROP_ORDER (the last
+        ones of a component first) until the rest fits. A gloss always keeps
+        at least one component, if that is still too long it is truncated
+        by the tokenizer as usual. The gloss gets at least half of the
+        sequence length, however long the sentence is.
+    '''
+
+    def __init__(self, tokenizer, max_seq_length: int) -> None:
+        self.encoder = PairEncoder(tokenizer, max_seq_length)
+        self.max_seq_length = max_seq_length
+
+    def __call__(self, text_a: str, parts: GlossParts) -> str:
+        available = self.max_seq_length - self.encoder.num_special
+        budget = max(available - len(self.encoder.token_ids(text_a)),
+                     available // 2)
+
+        # Every component is followed by a '.' in the joined context
+        lengths = [len(self.encoder.token_ids(text)) + 1 for _, text in parts]
+        total = sum(lengths)
+        keep = [True] * len(parts)
+        kept = len(parts)
+        for component in DROP_ORDER:
+            for i in reversed(range(len(parts))):
+                if total <= budget or kept <= 1:
+                    break
+                if keep[i] and parts[i][0] == component:
+                    keep[i] = False
+                    total -= lengths[i]
+                    kept -= 1
+
+        return join_wn_context(text for (_, text), k in zip(parts, keep) if k)
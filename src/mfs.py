@@ -0,0 +1,143 @@
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+from src.conll import AnnCategory, ConllDoc
+from src.wordnet import (SenseIndex, check_wordnet_version,
+                         installed_wordnet_version)
+
+# Prediction for lemmas without any WordNet entry
+NO_ENTRY = 'NO WORDNET ENTRY FOUND'
+
+
+def create_freq_dict(conll_docs: Iterable[ConllDoc]):
+    """Creates a nested dictionary with the sense frequencies for each
+    lemma, pos-tag combination, from a ConllDataset or a stream of docs.
+    E.g. {'forget.v': {'02': 1, '04': 2}, 'week.n': {'01': 1}}"""
+    sense_frequencies = {}
+    for doc in conll_docs:
+        for syn in doc.get_category(AnnCategory.SNS):
+            if syn:
+                lem, pos, sen = syn.split(".")
+                lem_pos = lem+"."+pos
+                if lem_pos in sense_frequencies:
+                    # Increase frequency count of the specific sense
+                    sense_frequencies[lem_pos][sen] = sense_frequencies[lem_pos].get(sen, 0) + 1
+                else:
+                    # Add lemma & pos-tag to the dictionary
+                    sense_frequencies[lem_pos] = {sen: 1}
+
+    return sense_frequencies
+
+
+class MostFrequentSense:
+    ''' Precompiled most frequent sense model: a table from lemma.pos to the
+        predicted synset, i.e. the most frequent sense in the train data or
+        else the first WordNet sense (None if there is no WordNet entry).
+
+            {'forget.v': 'forget.v.04', 'dog.n': 'dog.n.01', 'xyz.n': None}
+
+        Lemmas that were not resolved when fitting are looked up in the
+        sense index (if any) on first use. The first senses depend on the
+        WordNet version, which is stored with the table; a saved table can
+        only be loaded with that version installed.
+    '''
+    version = 1
+
+    def __init__(
+        self,
+        table: Dict[str, Optional[str]],
+        sense_index: Optional[SenseIndex] = None,
+        wordnet_version: Optional[str] = None
+    ) -> None:
+        self.table = table
+        self.sense_index = sense_index
+        self.wordnet_version = wordnet_version
+
+    @classmethod
+    def fit(
+        cls,
+        train_docs: Iterable[ConllDoc],
+        sense_index: Optional[SenseIndex] = None,
+        lemmas: Iterable[str] = ()
+    ) -> 'MostFrequentSense':
+        ''' Builds the table from the sense frequencies of the train docs.
+            The first WordNet sense is resolved up front for every lemma.pos
+            in `lemmas` that does not occur in the train data, e.g. the
+            lemmas of the dev and test sets.
+        '''
+        table: Dict[str, Optional[str]] = {}
+        for lem_pos, frequencies in create_freq_dict(train_docs).items():
+            # Ties go to the sense seen first, the same as max() on the dict
+            table[lem_pos] = lem_pos + "." + max(frequencies,
+                                                 key=frequencies.get)
+
+        model = cls(table, sense_index, installed_wordnet_version())
+        for lem_pos in lemmas:
+            model.predict_lemma(lem_pos)
+        return model
+
+    def predict_lemma(self, lem_pos: str) -> Optional[str]:
+        ''' Returns the predicted synset for a lemma.pos string'''
+        try:
+            return self.table[lem_pos]
+        except KeyError:
+            pass
+
+        if self.sense_index is None:
+            return None
+        lem, pos = lem_pos.rsplit(".", 1)
+        sense = self.table[lem_pos] = self.sense_index.first_sense(lem, pos)
+        return sense
+
+    def predict(self, sns: Iterable[Optional[str]]) -> List[Optional[str]]:
+        ''' Predicts a synset for every annotated token of a doc, given the
+            gold synsets (only their lemma and pos-tag are used): the most
+            frequent sense in the train data, else the first WordNet sense,
+            else NO_ENTRY.
+        '''
+        table = self.table
+        predictions: List[Optional[str]] = []
+        for syn in sns:
+            if not syn:
+                predictions.append(None)
+                continue
+            lem_pos = syn[:syn.rindex(".")]
+            sense = (table[lem_pos] if lem_pos in table
+                     else self.predict_lemma(lem_pos))
+            predictions.append(sense if sense else NO_ENTRY)
+        return predictions
+
+    def save(self, path: str) -> None:
+        if (folder := os.path.dirname(path)):
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'version': self.version,
+                       'wordnet_version': self.wordnet_version,
+                       'senses': self.table}, f)
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        sense_index: Optional[SenseIndex] = None,
+        check_version: bool = True
+    ) -> 'MostFrequentSense':
+        ''' Loads a table saved by save(). With check_version, it has to be
+            fitted with the installed WordNet version (if WordNet is
+            installed), like SenseIndex.load().
+        '''
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != cls.version:
+            raise ValueError(f'Unsupported model version in {path}')
+        wordnet_version = data.get('wordnet_version')
+        if check_version:
+            check_wordnet_version(
+                wordnet_version,
+                f'Lookup table {path} (see statistical_baseline.py --fit)'
+            )
+        return cls(data['senses'], sense_index, wordnet_version)
+
+    def __len__(self) -> int:
+        return len(self.table)
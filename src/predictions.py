@@ -0,0 +1,152 @@
+import json
+import os
+import pickle
+from typing import IO, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Predictions of one doc: its position in the input file, its id and the
+# predicted synset (or None) of every token
+Record = Tuple[int, Optional[str], List[Optional[str]]]
+
+
+def is_jsonl(path: str) -> bool:
+    return path.endswith('.jsonl')
+
+
+class PredictionWriter:
+    ''' Writes predictions as JSON lines, one doc per line, as soon as they
+        are available:
+
+            {"index": 0, "id": "p00/d0004", "senses": ["male.n.02", null]}
+
+        The file is flushed to disk every flush_every docs. Doc ids are not
+        unique in the PMB data, so docs are identified by their index in the
+        input file. With resume=True the docs of an existing file are kept
+        (a partially written last line is dropped) and writing continues
+        after them; `done` is the number of docs that can be skipped.
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        resume: bool = False,
+        flush_every: int = 100
+    ) -> None:
+        self.path = path
+        self.flush_every = flush_every
+        self.done = 0
+        self.done_ids: List[Optional[str]] = []
+        self._pending = 0
+
+        if (folder := os.path.dirname(path)):
+            os.makedirs(folder, exist_ok=True)
+        if resume and os.path.exists(path):
+            size = 0
+            for index, doc_id, _, end in _scan(path):
+                if index != self.done:
+                    break
+                self.done_ids.append(doc_id)
+                self.done += 1
+                size = end
+            # Cut off whatever came after the last complete doc
+            with open(path, 'r+b') as f:
+                f.truncate(size)
+            self._file: IO[str] = open(path, 'a')
+        else:
+            self._file = open(path, 'w')
+
+    def write(self, doc_id: Optional[str], senses: Sequence[Optional[str]]):
+        self._file.write(json.dumps({'index': self.done, 'id': doc_id,
+                                     'senses': list(senses)}) + '\n')
+        self.done += 1
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def write_all(
+        self,
+        doc_ids: Iterable[Optional[str]],
+        predictions: Iterable[Sequence[Optional[str]]]
+    ) -> None:
+        for doc_id, senses in zip(doc_ids, predictions):
+            self.write(doc_id, senses)
+
+    def flush(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self) -> 'PredictionWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _scan(path: str) -> Iterator[Tuple[int, Optional[str], List, int]]:
+    ''' Yields the complete records of a JSON lines file with the byte
+        offset of their end, stopping at the first incomplete line.
+    '''
+    with open(path, 'rb') as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            end += len(line)
+            yield record['index'], record['id'], record['senses'], end
+
+
+def read_predictions(path: str) -> Iterator[Record]:
+    ''' Streams the predictions of a file, one doc at a time. Both the JSON
+        lines format and the pickled list of lists (without doc ids) that
+        older versions wrote are supported.
+    '''
+    if is_jsonl(path):
+        for index, doc_id, senses, _ in _scan(path):
+            yield index, doc_id, senses
+        return
+
+    with open(path, 'rb') as f:
+        for index, senses in enumerate(pickle.load(f)):
+            yield index, None, senses
+
+
+def iter_senses(
+    path: str,
+    doc_ids: Optional[Sequence[Optional[str]]] = None
+) -> Iterator[List[Optional[str]]]:
+    ''' Streams the predicted senses per doc. If the doc ids of the gold
+        data are given, the docs in the file are checked against them.
+    '''
+    for index, doc_id, senses in read_predictions(path):
+        if doc_ids is not None and doc_id is not None:
+            if index >= len(doc_ids) or doc_ids[index] != doc_id:
+                raise ValueError(f'Doc {index} ({doc_id}) in {path} does not '
+                                 f'match the evaluation file')
+        yield senses
+
+
+def write_predictions(
+    path: str,
+    predictions: Sequence[Sequence[Optional[str]]],
+    doc_ids: Optional[Sequence[Optional[str]]] = None
+) -> None:
+    ''' Writes all predictions at once, as JSON lines if the path ends with
+        .jsonl and else as a pickle.
+    '''
+    if is_jsonl(path):
+        if doc_ids is None:
+            doc_ids = [None] * len(predictions)
+        with PredictionWriter(path) as writer:
+            writer.write_all(doc_ids, predictions)
+    else:
+        with open(path, 'wb') as f:
+            pickle.dump(predictions, f)
@@ -0,0 +1,110 @@
+import resource
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+# A stage is run as fn() -> (latencies in seconds, counts), where counts
+# holds the number of processed units, e.g. {'docs': 10, 'tokens': 120}.
+StageFn = Callable[[], Tuple[List[float], Dict[str, int]]]
+
+
+@dataclass
+class StageResult:
+    ''' Timings of a single benchmark stage. Throughput is given per unit
+        of work per second, latency percentiles in milliseconds per item
+        (what an item is depends on the stage, e.g. a doc or a synset).
+        peak_python_mb is the peak of the Python heap during the stage
+        (tracemalloc, not including e.g. torch tensors) and max_rss_mb the
+        peak resident set size of the process so far.
+    '''
+    name: str
+    seconds: float
+    counts: Dict[str, int]
+    throughput: Dict[str, float] = field(default_factory=dict)
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+    peak_python_mb: float = 0.0
+    max_rss_mb: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def percentiles(
+    seconds: Sequence[float],
+    points: Iterable[int] = (50, 90, 99)
+) -> Dict[str, float]:
+    ''' Latency percentiles in milliseconds'''
+    if not len(seconds):
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {f'p{p}': round(float(np.percentile(ms, p)), 3) for p in points}
+
+
+def timed(fn: Callable[[Any], Any], items: Iterable[Any]) -> List[float]:
+    ''' Calls fn on every item, returns the time every call took'''
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def max_rss_mb() -> float:
+    ''' Peak resident set size of this process in MB'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def run_stage(name: str, fn: StageFn, memory: bool = True) -> StageResult:
+    ''' Runs a stage and returns its timings. With memory, the stage is run
+        a second time with tracemalloc to get its peak Python heap, so the
+        tracing doesn't slow down the timed run.
+    '''
+    start = time.perf_counter()
+    latencies, counts = fn()
+    seconds = time.perf_counter() - start
+
+    result = StageResult(
+        name, round(seconds, 4), counts,
+        throughput={f'{unit}_per_s': round(n / seconds, 2)
+                    for unit, n in counts.items() if seconds > 0},
+        latency_ms=percentiles(latencies)
+    )
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        result.peak_python_mb = round(peak / 1024 ** 2, 2)
+    result.max_rss_mb = round(max_rss_mb(), 1)
+    return result
+
+
+def compare_results(
+    old: Dict[str, Any],
+    new: Dict[str, Any]
+) -> List[Tuple[str, str, float, float, float]]:
+    ''' Compares the throughput and latencies of the stages that occur in
+        two benchmark result files. Returns (stage, metric, old, new, ratio)
+        rows, where ratio is new / old.
+    '''
+    old_stages = {stage['name']: stage for stage in old['stages']}
+    rows = []
+    for stage in new['stages']:
+        if (previous := old_stages.get(stage['name'])) is None:
+            continue
+        for group in ('throughput', 'latency_ms'):
+            for metric, value in stage[group].items():
+                old_value = previous[group].get(metric)
+                if old_value:
+                    rows.append((stage['name'], metric, old_value, value,
+                                 round(value / old_value, 3)))
+    return rows
@@ -0,0 +1,222 @@
+import logging
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from src.candidates import PrefilterStats, candidate_names
+from src.conll import AnnCategory, ConllDoc
+from src.wordnet import SenseIndex, sense_proximity
+
+logger = logging.getLogger(__name__)
+
+class NegativeSampler:
+    ''' Chooses the negative senses of a training token. Without
+        max_negatives every other sense is a negative. Otherwise at most
+        max_negatives are kept: the hard_negatives senses that are closest
+        to the gold sense in WordNet (siblings and direct hypernyms or
+        hyponyms first, see sense_proximity) and a random selection of the
+        rest, which changes every epoch. The selection only depends on the
+        seed and the epoch. If the proximity of a gold sense can't be
+        computed (e.g. a label that is not in WordNet), all its negatives
+        are random.
+    '''
+
+    def __init__(
+        self,
+        max_negatives: Optional[int] = None,
+        hard_negatives: Optional[int] = None,
+        seed: int = 0,
+        proximity: Callable[[str, str], float] = sense_proximity
+    ) -> None:
+        self.max_negatives = max_negatives
+        if hard_negatives is None:
+            hard_negatives = (max_negatives or 0) // 2
+        self.hard_negatives = min(hard_negatives, max_negatives or 0)
+        self.seed = seed
+        self.proximity = proximity
+        self._ranking: Dict[str, Optional[List[str]]] = {}
+
+    def rng(self, epoch: int) -> np.random.Generator:
+        return np.random.default_rng([self.seed, epoch])
+
+    def ranked(self, gold: str, negatives: List[str]) -> Optional[List[str]]:
+        ''' The negatives from closest to the gold sense to farthest, ties
+            in WordNet order, or None if the proximity can't be computed.
+            Computed once per gold sense.
+        '''
+        if gold not in self._ranking:
+            try:
+                self._ranking[gold] = sorted(
+                    negatives, key=lambda sense: -self.proximity(gold, sense)
+                )
+            except ValueError as e:
+                logger.warning('No hard negatives for %s: %s', gold, e)
+                self._ranking[gold] = None
+        return self._ranking[gold]
+
+    def select(
+        self,
+        gold: str,
+        senses: List[str],
+        rng: np.random.Generator
+    ) -> List[str]:
+        ''' Returns the gold sense (if it is a candidate) and the selected
+            negatives, in the order of senses.
+        '''
+        negatives = [sense for sense in senses if sense != gold]
+        if self.max_negatives is None or len(negatives) <= self.max_negatives:
+            return senses
+
+        if (ranking := self.ranked(gold, negatives)) is None:
+            n_hard, ranking = 0, negatives
+        else:
+            n_hard = self.hard_negatives
+        selected = set(ranking[:n_hard])
+        rest = ranking[n_hard:]
+        n_easy = self.max_negatives - n_hard
+        selected.update(rest[i] for i in rng.choice(len(rest), n_easy,
+                                                    replace=False))
+        return [sense for sense in senses if sense == gold or sense in selected]
+
+
+class PairDataset(Sequence):
+    ''' The labelled sentence pairs of a training epoch, stored as (doc
+        index, token index, candidate synset id) triples in compact arrays.
+        The text of a pair is only created on access, the gloss comes from
+        gloss(sense, sentence), e.g. a gloss cache lookup:
+
+            dataset[0] -> ['The dog barks.', 'a member of the genus ...', 1]
+    '''
+
+    def __init__(
+        self,
+        index: 'TrainingIndex',
+        docs: np.ndarray,
+        tokens: np.ndarray,
+        synsets: np.ndarray,
+        labels: np.ndarray,
+        gloss: Callable[[str, str], str]
+    ) -> None:
+        self.index = index
+        self.docs = docs
+        self.tokens = tokens
+        self.synsets = synsets
+        self.labels = labels
+        self.gloss = gloss
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        sentence = self.index.sentences[self.docs[idx]]
+        sense = self.index.synsets[self.synsets[idx]]
+        return [sentence, self.gloss(sense, sentence), int(self.labels[idx])]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class TrainingIndex:
+    ''' The annotated tokens of the training data: the doc they occur in,
+        their position in it, their gold synset and their candidate senses,
+        in flat arrays of ids into `synsets`. The sentence pairs of an epoch
+        are drawn from it with a NegativeSampler, so the negatives can be
+        resampled every epoch without preparing (and holding) the text of
+        all pairs up front.
+    '''
+
+    def __init__(self) -> None:
+        self.sentences: List[str] = []
+        self.synsets: List[str] = []
+        self._synset_ids: Dict[str, int] = {}
+        self.token_docs = np.zeros(0, dtype=np.int32)
+        self.token_positions = np.zeros(0, dtype=np.int32)
+        self.token_gold = np.zeros(0, dtype=np.int32)
+        self.candidate_offsets = np.zeros(1, dtype=np.int64)
+        self.candidate_ids = np.zeros(0, dtype=np.int32)
+
+    def synset_id(self, name: str) -> int:
+        return self._synset_ids.setdefault(name, len(self._synset_ids))
+
+    @classmethod
+    def build(
+        cls,
+        conll_data: Iterable[ConllDoc],
+        sense_index: Optional[SenseIndex] = None,
+        skip_trivial: bool = False,
+        stats: Optional[PrefilterStats] = None
+    ) -> 'TrainingIndex':
+        ''' Collects the tokens in the same way as prepare_train() in
+            system.py, tokens with less than two candidates are left out
+            with skip_trivial.
+        '''
+        index = cls()
+        docs, positions, gold = array('i'), array('i'), array('i')
+        offsets, candidates = array('q', [0]), array('i')
+        for doc in conll_data:
+            doc_index = len(index.sentences)
+            index.sentences.append(doc.raw_sent)
+            for position, syn in enumerate(doc.get_category(AnnCategory.SNS)):
+                if not syn:
+                    continue
+
+                lem, pos, _ = syn.split(".")
+                senses = candidate_names(lem, pos, sense_index)
+                trivial = skip_trivial and len(senses) <= 1
+                if stats is not None:
+                    stats.add(len(senses), trivial)
+                if trivial:
+                    continue
+
+                docs.append(doc_index)
+                positions.append(position)
+                gold.append(index.synset_id(syn))
+                candidates.extend(index.synset_id(sense) for sense in senses)
+                offsets.append(len(candidates))
+
+        index.synsets = list(index._synset_ids)
+        index.token_docs = np.array(docs, dtype=np.int32)
+        index.token_positions = np.array(positions, dtype=np.int32)
+        index.token_gold = np.array(gold, dtype=np.int32)
+        index.candidate_offsets = np.array(offsets, dtype=np.int64)
+        index.candidate_ids = np.array(candidates, dtype=np.int32)
+        return index
+
+    def candidates(self, token: int) -> List[str]:
+        start, end = self.candidate_offsets[token:token + 2]
+        return [self.synsets[i] for i in self.candidate_ids[start:end]]
+
+    def epoch(
+        self,
+        sampler: NegativeSampler,
+        epoch: int,
+        gloss: Callable[[str, str], str]
+    ) -> PairDataset:
+        ''' Samples the sentence pairs of an epoch, the label is 1 for the
+            gold sense. Only the ids of the pairs are stored, see
+            PairDataset.
+        '''
+        rng = sampler.rng(epoch)
+        docs, tokens, synsets, labels = (array('i'), array('i'), array('i'),
+                                         array('b'))
+        for token in range(len(self)):
+            gold = self.synsets[self.token_gold[token]]
+            selected = sampler.select(gold, self.candidates(token), rng)
+            docs.extend([self.token_docs[token]] * len(selected))
+            tokens.extend([self.token_positions[token]] * len(selected))
+            synsets.extend(self._synset_ids[sense] for sense in selected)
+            labels.extend(1 if sense == gold else 0 for sense in selected)
+
+        return PairDataset(
+            self, np.array(docs, dtype=np.int32),
+            np.array(tokens, dtype=np.int32),
+            np.array(synsets, dtype=np.int32),
+            np.array(labels, dtype=np.int8), gloss
+        )
+
+    def n_pairs(self) -> int:
+        ''' Number of sentence pairs without negative sampling'''
+        return int(self.candidate_offsets[-1])
+
+    def __len__(self) -> int:
+        return len(self.token_docs)
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+_STOP = object()
+
+
+class MicroBatcher:
+    ''' Coalesces items that are submitted concurrently (e.g. by the threads
+        of an HTTP server) into batches that are processed by a single worker
+        thread. A batch is closed when it holds max_batch_size items or when
+        max_latency seconds have passed since its first item arrived,
+        whichever comes first.
+
+        process_batch gets a list of items and has to return a list with a
+        result for every item. An exception in that list is raised for its
+        item only, an exception raised by process_batch itself for every
+        item of the batch. Everything it touches (model, SQLite cache) is
+        only used from the worker thread. on_close is run on that thread as
+        well, when it stops, e.g. to close a SQLite connection it opened.
+    '''
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_latency: float = 0.01,
+        on_close: Optional[Callable[[], None]] = None
+    ) -> None:
+        self.process_batch = process_batch
+        self.on_close = on_close
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.batches = 0
+        self.items = 0
+        self._queue: 'queue.Queue[Any]' = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'MicroBatcher':
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, item: Any) -> Future:
+        ''' Queues an item, the returned future holds its result'''
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any, timeout: Optional[float] = None) -> Any:
+        ''' Submits an item and waits for its result'''
+        return self.submit(item).result(timeout)
+
+    def close(self) -> None:
+        ''' Processes the queued items and stops the worker thread'''
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _collect(self, first: Tuple[Any, Future]) -> Tuple[List, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self) -> None:
+        try:
+            self._process()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+
+    def _process(self) -> None:
+        stop = False
+        while not stop:
+            entry = self._queue.get()
+            if entry is _STOP:
+                break
+            batch, stop = self._collect(entry)
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            self.batches += 1
+            self.items += len(batch)
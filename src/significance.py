@@ -0,0 +1,223 @@
+from dataclasses import dataclass
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Per system: numerators and denominators per doc, see doc_statistics()
+DocStats = Tuple[np.ndarray, np.ndarray]
+
+
+@dataclass
+class Interval:
+    ''' Bootstrap confidence interval of a score'''
+    score: float
+    low: float
+    high: float
+
+
+@dataclass
+class Comparison:
+    ''' Paired comparison of two systems on one score. The p-values are
+        two-sided, NaN if the test was not run.
+    '''
+    delta: float
+    p_bootstrap: float
+    p_randomization: float
+
+
+def _ratio(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return numerators / denominators
+
+
+def observed(stats: DocStats) -> np.ndarray:
+    ''' Scores over all docs, shape (n_scores,)'''
+    numerators, denominators = stats
+    return _ratio(numerators.sum(axis=1), denominators.sum(axis=1))
+
+
+def _bootstrap_chunk(
+    systems: Sequence[DocStats],
+    size: int,
+    seed: np.random.SeedSequence
+) -> np.ndarray:
+    ''' Scores of all systems on `size` resamples of the docs, shape
+        (n_systems, size, n_scores). Every row of the weight matrix holds
+        how often each doc is drawn, all systems use the same rows.
+    '''
+    rng = np.random.default_rng(seed)
+    n_docs = systems[0][0].shape[1]
+    weights = rng.multinomial(n_docs, np.full(n_docs, 1 / n_docs),
+                              size=size).astype(np.float64)
+    return np.stack([_ratio(weights @ numerators.T, weights @ denominators.T)
+                     for numerators, denominators in systems])
+
+
+def _randomization_chunk(
+    systems: Sequence[DocStats],
+    size: int,
+    seed: np.random.SeedSequence
+) -> np.ndarray:
+    ''' Differences in scores between two systems when the outputs of the
+        systems are swapped for a random half of the docs, shape
+        (size, n_scores).
+    '''
+    rng = np.random.default_rng(seed)
+    (num_a, den_a), (num_b, den_b) = systems
+    swaps = rng.integers(0, 2, size=(size, num_a.shape[1])).astype(np.float64)
+    shuffled_a = _ratio(num_a.sum(axis=1) + swaps @ (num_b - num_a).T,
+                        den_a.sum(axis=1) + swaps @ (den_b - den_a).T)
+    shuffled_b = _ratio(num_b.sum(axis=1) + swaps @ (num_a - num_b).T,
+                        den_b.sum(axis=1) + swaps @ (den_a - den_b).T)
+    return shuffled_a - shuffled_b
+
+
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(systems: Sequence[DocStats]):
+    _worker_state.update(systems=systems)
+
+
+def _run_chunk(job: Tuple[Callable, int, np.random.SeedSequence]):
+    chunk_fn, size, seed = job
+    return chunk_fn(_worker_state['systems'], size, seed)
+
+
+def _resample(
+    chunk_fn: Callable,
+    systems: Sequence[DocStats],
+    n_resamples: int,
+    seed: int,
+    workers: int,
+    chunk_size: int,
+    axis: int
+) -> np.ndarray:
+    ''' Runs n_resamples resamples in chunks of at most chunk_size rows, in a
+        process pool if workers > 1. Every chunk has its own seed derived
+        from `seed`, so the result doesn't depend on the number of workers.
+    '''
+    sizes = [min(chunk_size, n_resamples - start)
+             for start in range(0, n_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(chunk_fn, size, chunk_seed)
+            for size, chunk_seed in zip(sizes, seeds)]
+
+    if workers > 1 and len(jobs) > 1:
+        with Pool(min(workers, len(jobs)), initializer=_init_worker,
+                  initargs=(systems,)) as pool:
+            chunks = pool.map(_run_chunk, jobs)
+    else:
+        _init_worker(systems)
+        chunks = [_run_chunk(job) for job in jobs]
+    return np.concatenate(chunks, axis=axis)
+
+
+def bootstrap(
+    systems: Sequence[DocStats],
+    n_resamples: int = 10000,
+    seed: int = 1,
+    workers: int = 1,
+    chunk_size: int = 1000
+) -> np.ndarray:
+    ''' Paired bootstrap resampling at the doc level: every resample draws
+        n_docs docs with replacement, the same docs for every system.
+        Returns the scores of all resamples, shape
+        (n_systems, n_resamples, n_scores).
+    '''
+    return _resample(_bootstrap_chunk, systems, n_resamples, seed, workers,
+                     chunk_size, axis=1)
+
+
+def confidence_intervals(
+    stats: DocStats,
+    samples: np.ndarray,
+    alpha: float = 0.05
+) -> List[Interval]:
+    ''' Percentile intervals per score from the bootstrap samples of one
+        system, shape (n_resamples, n_scores).
+    '''
+    low, high = np.nanquantile(samples, [alpha / 2, 1 - alpha / 2], axis=0)
+    return [Interval(*values) for values in zip(observed(stats), low, high)]
+
+
+def bootstrap_p_values(
+    stats_a: DocStats,
+    stats_b: DocStats,
+    samples_a: np.ndarray,
+    samples_b: np.ndarray
+) -> np.ndarray:
+    ''' Two-sided p-values of the difference between two systems, from
+        paired bootstrap samples: the fraction of resampled differences
+        that are at least twice the observed difference away from zero,
+        i.e. the resampled distribution shifted to the null hypothesis
+        (Berg-Kirkpatrick et al., 2012).
+    '''
+    delta = observed(stats_a) - observed(stats_b)
+    deltas = samples_a - samples_b
+    return np.mean(np.abs(deltas - delta) >= np.abs(delta), axis=0)
+
+
+def randomization_p_values(
+    stats_a: DocStats,
+    stats_b: DocStats,
+    n_resamples: int = 10000,
+    seed: int = 1,
+    workers: int = 1,
+    chunk_size: int = 1000
+) -> np.ndarray:
+    ''' Two-sided p-values of the difference between two systems with an
+        approximate randomization test that swaps the outputs of the systems
+        per doc.
+    '''
+    delta = np.abs(observed(stats_a) - observed(stats_b))
+    deltas = _resample(_randomization_chunk, (stats_a, stats_b), n_resamples,
+                       seed, workers, chunk_size, axis=0)
+    exceed = np.sum(np.abs(deltas) >= delta - 1e-12, axis=0)
+    return (exceed + 1) / (n_resamples + 1)
+
+
+def compare(
+    systems: Sequence[DocStats],
+    n_bootstrap: int = 0,
+    n_randomization: int = 0,
+    seed: int = 1,
+    workers: int = 1,
+    alpha: float = 0.05
+) -> Tuple[List[List[Interval]], Dict[Tuple[int, int], List[Comparison]]]:
+    ''' Runs the requested tests for every system and every pair of systems.
+        Returns the confidence intervals per system (empty without
+        bootstrap) and the comparison per score for every pair (i, j) with
+        i < j, where delta is the score of i minus the score of j.
+    '''
+    n_docs = min(numerators.shape[1] for numerators, _ in systems)
+    systems = [(numerators[:, :n_docs], denominators[:, :n_docs])
+               for numerators, denominators in systems]
+
+    intervals: List[List[Interval]] = []
+    samples = None
+    if n_bootstrap:
+        samples = bootstrap(systems, n_bootstrap, seed, workers)
+        intervals = [confidence_intervals(stats, system_samples, alpha)
+                     for stats, system_samples in zip(systems, samples)]
+
+    n_scores = systems[0][0].shape[0]
+    comparisons = {}
+    for i in range(len(systems)):
+        for j in range(i + 1, len(systems)):
+            delta = observed(systems[i]) - observed(systems[j])
+            p_bootstrap = np.full(n_scores, np.nan)
+            p_randomization = np.full(n_scores, np.nan)
+            if samples is not None:
+                p_bootstrap = bootstrap_p_values(systems[i], systems[j],
+                                                 samples[i], samples[j])
+            if n_randomization:
+                p_randomization = randomization_p_values(
+                    systems[i], systems[j], n_randomization, seed, workers
+                )
+            comparisons[(i, j)] = [
+                Comparison(float(d), float(p_b), float(p_r))
+                for d, p_b, p_r in zip(delta, p_bootstrap, p_randomization)
+            ]
+    return intervals, comparisons
@@ -0,0 +1,148 @@
+import logging
+import math
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+import torch
+from simpletransformers.classification import ClassificationModel
+from transformers import get_linear_schedule_with_warmup
+
+from src.inference import PairEncoder, collate
+
+logger = logging.getLogger(__name__)
+
+# Model arguments of ClassificationModel.train_model() that train_bucketed()
+# doesn't support. It doesn't evaluate during training (so there is no early
+# stopping) and only saves the final model, not checkpoints.
+UNSUPPORTED_ARGS = ('evaluate_during_training', 'use_early_stopping',
+                    'save_steps')
+
+
+def bucketed_batches(
+    lengths: Sequence[int],
+    batch_size: int,
+    rng: np.random.Generator,
+    pool_size: int = 100
+) -> List[List[int]]:
+    ''' Groups indices into batches of similar length. The indices are
+        shuffled and split into pools of pool_size batches, every pool is
+        sorted by length and cut into batches, and the order of all batches
+        is shuffled again. Batches need little padding, while every epoch
+        still sees the data in a different order.
+    '''
+    lengths = np.asarray(lengths)
+    order = rng.permutation(len(lengths))
+    pool = batch_size * pool_size
+
+    batches = []
+    for start in range(0, len(order), pool):
+        chunk = order[start:start + pool]
+        chunk = chunk[np.argsort(lengths[chunk], kind='stable')]
+        batches.extend(chunk[i:i + batch_size].tolist()
+                       for i in range(0, len(chunk), batch_size))
+    return [batches[i] for i in rng.permutation(len(batches))]
+
+
+def train_bucketed(
+    model: ClassificationModel,
+    train_data: Sequence[Sequence],
+    epochs: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    seed: int = 0,
+    output_dir: Optional[str] = None,
+    resample: Optional[Callable[[int], Sequence[Sequence]]] = None
+) -> float:
+    ''' Fine-tunes the sentence-pair classifier on (text_a, text_b, label)
+        rows, like model.train_model() but with batches of pairs of similar
+        length that are padded to their longest pair instead of to the
+        maximum sequence length. The rows are only encoded per batch, so
+        train_data can be a lazy sequence like a PairDataset that creates
+        the text of a pair on access. The optimizer settings come from the model
+        arguments (AdamW with linear warmup and decay). The model is saved
+        to output_dir (the output_dir of the model arguments by default)
+        and the mean loss of the last epoch is returned. The
+        gradient_accumulation_steps and fp16 (on a GPU) arguments are used,
+        the ones in UNSUPPORTED_ARGS are ignored with a warning.
+
+        train_data is used for the first epoch. If resample is given, it is
+        called with the epoch number for the data of every later epoch
+        (e.g. with new negatives), so only one epoch is held at a time.
+    '''
+    args = model.args
+    epochs = epochs or args.num_train_epochs
+    batch_size = batch_size or args.train_batch_size
+    accumulation = max(1, args.gradient_accumulation_steps)
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    if (ignored := [name for name in UNSUPPORTED_ARGS
+                    if getattr(args, name, None)]):
+        logger.warning('Bucketed training ignores the model arguments %s',
+                       ', '.join(ignored))
+
+    encoder = PairEncoder(model.tokenizer, args.max_seq_length)
+    use_amp = bool(args.fp16) and str(model.device).startswith('cuda')
+    scaler = torch.amp.GradScaler('cuda', enabled=use_amp)
+
+    # Resampled epochs have as many pairs as the first one
+    steps_per_epoch = math.ceil(
+        math.ceil(len(train_data) / batch_size) / accumulation
+    )
+    total_steps = steps_per_epoch * epochs
+    no_decay = ('bias', 'LayerNorm.weight')
+    parameters = [
+        {'params': [p for n, p in model.model.named_parameters()
+                    if not any(nd in n for nd in no_decay)],
+         'weight_decay': args.weight_decay},
+        {'params': [p for n, p in model.model.named_parameters()
+                    if any(nd in n for nd in no_decay)],
+         'weight_decay': 0.0},
+    ]
+    optimizer = torch.optim.AdamW(parameters, lr=args.learning_rate,
+                                  eps=args.adam_epsilon)
+    scheduler = get_linear_schedule_with_warmup(
+        optimizer, math.ceil(total_steps * args.warmup_ratio), total_steps
+    )
+
+    model.model.train()
+    loss = 0.0
+    data = train_data
+    lengths = None
+    for epoch in range(epochs):
+        if epoch and resample is not None:
+            data = resample(epoch)
+            lengths = None
+        # The lengths only change with the data, they come from the token
+        # ids that the encoder caches per text
+        if lengths is None:
+            lengths = [encoder.pair_length(text_a, text_b)
+                       for text_a, text_b, _ in data]
+        total_loss = 0.0
+        batches = bucketed_batches(lengths, batch_size, rng)
+        for step, rows in enumerate(batches, 1):
+            batch = [data[i] for i in rows]
+            inputs = collate(model, [encoder.encode_pair(text_a, text_b)
+                                     for text_a, text_b, _ in batch])
+            inputs['labels'] = torch.tensor([label for _, _, label in batch],
+                                            device=model.device)
+            with torch.autocast('cuda', enabled=use_amp):
+                batch_loss = model.model(**inputs)[0]
+            scaler.scale(batch_loss / accumulation).backward()
+            if step % accumulation == 0 or step == len(batches):
+                scaler.unscale_(optimizer)
+                torch.nn.utils.clip_grad_norm_(model.model.parameters(),
+                                               args.max_grad_norm)
+                scaler.step(optimizer)
+                scaler.update()
+                scheduler.step()
+                optimizer.zero_grad()
+
+            total_loss += batch_loss.item()
+            if step % 1000 == 0:
+                logger.info('Epoch %d, step %d/%d, loss %.4f', epoch + 1,
+                            step, len(batches), total_loss / step)
+        loss = total_loss / max(len(batches), 1)
+        logger.info('Epoch %d done, loss %.4f', epoch + 1, loss)
+
+    model.model.eval()
+    model.save_model(output_dir or args.output_dir, model=model.model)
+    return loss
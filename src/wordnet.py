@@ -1,13 +1,81 @@
-from dataclasses import dataclass
-from typing import List, Literal
+import json
+import os
+import re
+import sqlite3
+from dataclasses import dataclass, fields
+from typing import (TYPE_CHECKING, Dict, Iterable, List, Literal, Optional,
+                    Tuple, Union)
 
-from nltk import download as nltk_download
-from nltk.corpus import wordnet as wn
-from nltk.corpus.reader.wordnet import Synset
-from argparse import Namespace
+# NLTK is slow to import and WordNet is only needed when it is actually
+# queried (not when reading from a prebuilt index or cache), so both are
+# loaded on first use through get_wordnet().
+if TYPE_CHECKING:
+    from nltk.corpus.reader.wordnet import Synset, WordNetCorpusReader
 
-nltk_download('omw-1.4', quiet=True)
-nltk_download('wordnet', quiet=True)
+_WORDNET_RESOURCES = {
+    'wordnet': 'corpora/wordnet',
+    'omw-1.4': 'corpora/omw-1.4',
+}
+_wordnet: Optional['WordNetCorpusReader'] = None
+
+
+def ensure_wordnet() -> None:
+    ''' Makes sure the WordNet data is available, downloading it only if it
+        can't be found locally (zipped or unpacked). Setup scripts can call
+        this up front, otherwise it is done on first use of get_wordnet().
+    '''
+    from nltk import data as nltk_data
+    from nltk import download as nltk_download
+
+    for resource, path in _WORDNET_RESOURCES.items():
+        try:
+            nltk_data.find(path)
+        except LookupError:
+            nltk_download(resource, quiet=True)
+
+
+def get_wordnet() -> 'WordNetCorpusReader':
+    ''' Returns the NLTK WordNet reader, checking the data once per process'''
+    global _wordnet
+    if _wordnet is None:
+        ensure_wordnet()
+        from nltk.corpus import wordnet
+        _wordnet = wordnet
+    return _wordnet
+
+
+def installed_wordnet_version() -> Optional[str]:
+    ''' Returns the version of the installed WordNet data, or None if it is
+        not installed. It is read from the header of a data file, like
+        WordNetCorpusReader.get_version() does, so the reader isn't loaded.
+    '''
+    from nltk import data as nltk_data
+
+    try:
+        pointer = nltk_data.find('corpora/wordnet/data.adj')
+    except LookupError:
+        return None
+    with pointer.open() as f:
+        for _, line in zip(range(50), f):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', 'replace')
+            match = re.search(r'Word[nN]et (\d+|\d+\.\d+) Copyright', line)
+            if match is not None:
+                return match.group(1)
+    return None
+
+
+def check_wordnet_version(version: Optional[str], description: str) -> None:
+    ''' Raises a ValueError if WordNet is installed in another version than
+        the one a file (e.g. 'Sense index cache/senses.json') was built
+        from, the sense numbering differs between versions.
+    '''
+    installed = installed_wordnet_version()
+    if installed is not None and version != installed:
+        raise ValueError(
+            f'{description} was built from WordNet {version or "(unknown)"}, '
+            f'but WordNet {installed} is installed. Rebuild it'
+        )
 
 
 @dataclass
@@ -27,7 +95,7 @@ def make_sns_str(lem: str, pos: str, sense: int) -> str:
         return f'{lem}.{pos}.0{sense}'
 
 
-def get_sns_context(synset: Synset, options: ContextOptions) -> List[str]:
+def get_sns_context(synset: 'Synset', options: ContextOptions) -> List[str]:
     ''' Get the definition and example(s) from a synset'''
     context = []
     if options.add_definition and (definition := synset.definition()):
@@ -39,17 +107,38 @@ def get_sns_context(synset: Synset, options: ContextOptions) -> List[str]:
     return context
 
 
-def make_wn_context(sns: Synset, options: ContextOptions) -> str:
-    ''' Combines available wordnet gloss context into a single string'''
-    wn_context = get_sns_context(sns, options)
+# Components of a gloss context, see make_wn_context_parts
+GlossParts = List[Tuple[str, str]]
+
+
+def make_wn_context_parts(
+    sns: Union['Synset', str],
+    options: ContextOptions
+) -> GlossParts:
+    ''' Collects the available wordnet gloss context as (component, text)
+        pairs, in the order in which make_wn_context joins them. The
+        components are 'definition' and 'example' of the synset itself and
+        'hypo', 'hyper' and 'side' for the definitions and examples of
+        related synsets.
+    '''
+    if isinstance(sns, str):
+        sns = get_wordnet().synset(sns)
+    parts = []
+    if options.add_definition and (definition := sns.definition()):
+        parts.append(('definition', definition))
+
+    if options.add_example and (examples := sns.examples()):
+        parts.extend(('example', example) for example in examples)
 
     if options.add_hypo and (hyponyms := sns.hyponyms()):
         for hypo in hyponyms:
-            wn_context.extend(get_sns_context(hypo, options))
+            parts.extend(('hypo', text)
+                         for text in get_sns_context(hypo, options))
 
     if options.add_hyper and (hypernyms := sns.hypernyms()):
         for hyper in hypernyms:
-            wn_context.extend(get_sns_context(hyper, options))
+            parts.extend(('hyper', text)
+                         for text in get_sns_context(hyper, options))
 
     if options.add_side and (hypernyms := sns.hypernyms()):
         for hyper in hypernyms:
@@ -57,14 +146,346 @@ def make_wn_context(sns: Synset, options: ContextOptions) -> str:
                 # Skip the starting sns since we have it already
                 if sns._name == hypo._name:
                     continue
-                wn_context.extend(get_sns_context(hypo, options))
+                parts.extend(('side', text)
+                             for text in get_sns_context(hypo, options))
 
-    return '' if not wn_context else '. '.join(wn_context) + '.'
+    return parts
 
 
-def get_wn_senses(lem: str, pos: Literal['v', 'n', 'a', 'r']) -> List[Synset]:
+def join_wn_context(texts: Iterable[str]) -> str:
+    ''' Joins gloss context texts into a single string'''
+    texts = list(texts)
+    return '' if not texts else '. '.join(texts) + '.'
+
+
+def make_wn_context(sns: Union['Synset', str], options: ContextOptions) -> str:
+    ''' Combines available wordnet gloss context into a single string'''
+    return join_wn_context(
+        text for _, text in make_wn_context_parts(sns, options)
+    )
+
+
+def sense_proximity(name_a: str, name_b: str) -> float:
+    ''' How close two synsets are in the WordNet hierarchy: 1.0 for
+        siblings (a shared direct hypernym) and direct hypernyms/hyponyms of
+        each other, else their path similarity (0.0 without a path). Raises
+        a ValueError for a name that is not a synset of the installed
+        WordNet.
+    '''
+    from nltk.corpus.reader.wordnet import WordNetError
+
+    wn = get_wordnet()
+    try:
+        sns_a, sns_b = wn.synset(name_a), wn.synset(name_b)
+    except WordNetError as e:
+        raise ValueError(str(e)) from e
+    hyper_a, hyper_b = set(sns_a.hypernyms()), set(sns_b.hypernyms())
+    if sns_b in hyper_a or sns_a in hyper_b or hyper_a & hyper_b:
+        return 1.0
+    return sns_a.path_similarity(sns_b) or 0.0
+
+
+def get_wn_senses(lem: str, pos: Literal['v', 'n', 'a', 'r']) -> List['Synset']:
     """Uses the lemma and POS-tag to retrieve the WordNet senses"""
+    wn = get_wordnet()
     pos_dict = {"v": wn.VERB, "n": wn.NOUN, "a": wn.ADJ, "r": wn.ADV}
     senses = wn.synsets(lem, pos=pos_dict[pos])
 
     return senses
+
+
+class SenseIndex:
+    ''' Prebuilt lemma.pos -> ordered sense (synset name) index, so looking up
+        the senses of a lemma is a dictionary read instead of a wn.synsets()
+        call. The result of the first-sense check of the baselines is stored
+        with it. Lemmas that are not in the index are looked up in WordNet
+        once and remembered, so an empty index works as a plain memo.
+
+        Index files are built once per WordNet version and only read after
+        that, so they can be shared between processes. The version is stored
+        in the file, an index of another version than the installed one
+        can't be loaded.
+    '''
+
+    def __init__(
+        self,
+        senses: Optional[Dict[str, List[str]]] = None,
+        first_is_lemma: Iterable[str] = (),
+        version: Optional[str] = None
+    ) -> None:
+        self.senses_dict = senses if senses is not None else {}
+        self.first_is_lemma = set(first_is_lemma)
+        self.version = version
+
+    @classmethod
+    def build(
+        cls,
+        lemmas: Optional[Iterable[Tuple[str, str]]] = None
+    ) -> 'SenseIndex':
+        ''' Builds the index for the given (lemma, pos) pairs, or for all
+            lemmas in WordNet.
+        '''
+        wn = get_wordnet()
+        if lemmas is None:
+            lemmas = ((lem, pos) for pos in ('n', 'v', 'a', 'r')
+                      for lem in wn.all_lemma_names(pos=pos))
+
+        index = cls(version=wn.get_version())
+        for lem, pos in lemmas:
+            index._add(lem.lower(), pos)
+        return index
+
+    def _add(self, lem: str, pos: str) -> List[str]:
+        key = f'{lem}.{pos}'
+        senses = get_wn_senses(lem, pos)
+        if self.version is None:
+            self.version = get_wordnet().get_version()
+        self.senses_dict[key] = [sense.name() for sense in senses]
+        if senses and lem in {l.lower() for l in senses[0].lemma_names()}:
+            self.first_is_lemma.add(key)
+        return self.senses_dict[key]
+
+    def senses(self, lem: str, pos: str) -> List[str]:
+        ''' Returns the synset names of all senses of a lemma, in WordNet
+            order (the equivalent of get_wn_senses).
+        '''
+        lem = lem.lower()
+        senses = self.senses_dict.get(f'{lem}.{pos}')
+        return senses if senses is not None else self._add(lem, pos)
+
+    def first_sense(self, lem: str, pos: str) -> Optional[str]:
+        ''' Returns the first WordNet sense of a lemma as a synset string, or
+            None if there is no WordNet entry. If the lemma itself is not one
+            of the lemma names of the first synset (e.g. for derived forms),
+            the name of that synset is returned instead.
+        '''
+        senses = self.senses(lem, pos)
+        if not senses:
+            return None
+        if f'{lem.lower()}.{pos}' in self.first_is_lemma:
+            return make_sns_str(lem, pos, 1)
+        return senses[0]
+
+    def save(self, path: str) -> None:
+        if (folder := os.path.dirname(path)):
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'version': self.version,
+                'senses': self.senses_dict,
+                'first_is_lemma': sorted(self.first_is_lemma),
+            }, f)
+
+    @classmethod
+    def load(cls, path: str, check_version: bool = True) -> 'SenseIndex':
+        ''' Loads an index saved by save(). With check_version, it has to be
+            built from the installed WordNet version (if WordNet is
+            installed), the sense numbering differs between versions.
+        '''
+        with open(path) as f:
+            data = json.load(f)
+        version = data.get('version')
+        if check_version:
+            check_wordnet_version(
+                version, f'Sense index {path} (see build_wordnet_cache.py)'
+            )
+        return cls(data['senses'], data['first_is_lemma'], version)
+
+    def __len__(self) -> int:
+        return len(self.senses_dict)
+
+
+# Bit of every context option in the cache key. The bits are fixed, so that
+# reordering the fields of ContextOptions doesn't change the meaning of the
+# keys in existing caches. New options get a new bit.
+OPTION_BITS = {
+    'add_hypo': 0,
+    'add_hyper': 1,
+    'add_side': 2,
+    'add_example': 3,
+    'add_definition': 4,
+}
+
+
+def options_key(options: ContextOptions) -> int:
+    ''' Encodes a set of context options as a bitmask, used as cache key'''
+    key = 0
+    for field in fields(options):
+        if field.name not in OPTION_BITS:
+            raise KeyError(f'Context option {field.name} has no bit in '
+                           'OPTION_BITS')
+        if getattr(options, field.name):
+            key |= 1 << OPTION_BITS[field.name]
+    return key
+
+
+class GlossCache:
+    ''' Persistent cache of make_wn_context output, stored in an SQLite file
+        and keyed on (synset name, ContextOptions). The cache can be filled
+        up front with build(), after which get() does not need to traverse
+        WordNet anymore. Misses are computed with NLTK and (unless the cache
+        is opened read-only) written back to disk. The separate components of
+        every context (make_wn_context_parts) are stored as well, for
+        get_parts(). With the path ':memory:' nothing is written to disk, it
+        only saves repeated WordNet lookups within one process.
+    '''
+
+    def __init__(self, path: str, read_only: bool = False) -> None:
+        self.path = path
+        self.read_only = read_only
+        self._conn: Optional[sqlite3.Connection] = None
+        self._memory: Dict[Tuple[str, int], str] = {}
+        self._parts: Dict[Tuple[str, int], GlossParts] = {}
+        self._pending = 0
+
+    def __getstate__(self) -> dict:
+        # Connections can't be shared between processes, every process
+        # opens its own one on first use.
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_memory'] = {}
+        state['_parts'] = {}
+        state['_pending'] = 0
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.read_only:
+                self._conn = sqlite3.connect(
+                    f'file:{self.path}?mode=ro', uri=True
+                )
+            else:
+                if (folder := os.path.dirname(self.path)):
+                    os.makedirs(folder, exist_ok=True)
+                # Several processes may write to the cache at once
+                self._conn = sqlite3.connect(self.path, timeout=60)
+                self._conn.execute('PRAGMA journal_mode=WAL')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS glosses ('
+                    'synset TEXT NOT NULL, options INTEGER NOT NULL, '
+                    'context TEXT NOT NULL, PRIMARY KEY (synset, options))'
+                )
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS gloss_parts ('
+                    'synset TEXT NOT NULL, options INTEGER NOT NULL, '
+                    'parts TEXT NOT NULL, PRIMARY KEY (synset, options))'
+                )
+        return self._conn
+
+    def get(self, sense: Union['Synset', str], options: ContextOptions) -> str:
+        ''' Returns the wordnet gloss context of a sense (synset or name)'''
+        name = sense if isinstance(sense, str) else sense.name()
+        key = (name, options_key(options))
+        if (context := self._memory.get(key)) is not None:
+            return context
+
+        row = self.conn.execute(
+            'SELECT context FROM glosses WHERE synset = ? AND options = ?', key
+        ).fetchone()
+        if row:
+            context = row[0]
+        else:
+            context = make_wn_context(sense, options)
+            if not self.read_only:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO glosses VALUES (?, ?, ?)',
+                    (*key, context)
+                )
+                self._pending += 1
+                if self._pending >= 1000:
+                    self.flush()
+
+        self._memory[key] = context
+        return context
+
+    def get_parts(
+        self,
+        sense: Union['Synset', str],
+        options: ContextOptions
+    ) -> GlossParts:
+        ''' Returns the components of the wordnet gloss context of a sense,
+            see make_wn_context_parts()
+        '''
+        name = sense if isinstance(sense, str) else sense.name()
+        key = (name, options_key(options))
+        if (parts := self._parts.get(key)) is not None:
+            return parts
+
+        try:
+            row = self.conn.execute(
+                'SELECT parts FROM gloss_parts '
+                'WHERE synset = ? AND options = ?', key
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # Read-only cache from before parts were stored
+            row = None
+        if row:
+            parts = [(component, text)
+                     for component, text in json.loads(row[0])]
+        else:
+            parts = make_wn_context_parts(sense, options)
+            if not self.read_only:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO gloss_parts VALUES (?, ?, ?)',
+                    (*key, json.dumps(parts))
+                )
+                self._pending += 1
+                if self._pending >= 1000:
+                    self.flush()
+
+        self._parts[key] = parts
+        return parts
+
+    def build(
+        self,
+        synsets: Iterable['Synset'],
+        options: ContextOptions,
+        chunk_size: int = 5000
+    ) -> int:
+        ''' Precomputes the gloss context of all given synsets, returns the
+            number of entries written.
+        '''
+        okey = options_key(options)
+        total = 0
+        chunk = []
+        for synset in synsets:
+            parts = make_wn_context_parts(synset, options)
+            chunk.append((synset.name(), okey, parts))
+            if len(chunk) >= chunk_size:
+                total += self._insert_parts(chunk)
+                chunk = []
+        return total + self._insert_parts(chunk)
+
+    def _insert(self, rows: List[Tuple[str, int, str]]) -> int:
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO glosses VALUES (?, ?, ?)', rows
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def _insert_parts(self, rows: List[Tuple[str, int, GlossParts]]) -> int:
+        ''' Writes the components and the joined context of every row'''
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO gloss_parts VALUES (?, ?, ?)',
+            [(name, okey, json.dumps(parts)) for name, okey, parts in rows]
+        )
+        return self._insert([
+            (name, okey, join_wn_context(text for _, text in parts))
+            for name, okey, parts in rows
+        ])
+
+    def flush(self) -> None:
+        ''' Writes entries that were computed on a cache miss to disk'''
+        if self._conn is not None and self._pending:
+            self._conn.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM glosses').fetchone()[0]
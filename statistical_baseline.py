@@ -10,13 +10,21 @@ Description:
     It uses the most frequent senses from the PMB gold layer train
     data, and if the sense is not included in this, it predicts
     the first sense from WordNet.
+
+    The lookup table can be fitted once and saved with --fit, predicting with
+    --model then only needs one dictionary lookup per token.
 """
 
 import argparse
+import os
 import pickle
 
-from src.conll import AnnCategory, ConllDataset
-from src.wordnet import get_wn_senses, make_sns_str
+from src.breakdown import lemma_counts
+from src.columnar import load_conll
+from src.conll import AnnCategory
+# create_freq_dict used to live here, it is still importable from the script
+from src.mfs import NO_ENTRY, MostFrequentSense, create_freq_dict  # noqa: F401
+from src.wordnet import SenseIndex
 
 
 def create_arg_parser():
@@ -24,81 +32,70 @@ def create_arg_parser():
     parser.add_argument("-d", "--dataset", default='dev', type=str,
                         help="Type of data set: train, dev, eval or test",
                         choices=["dev", "eval", "test", "train"])
+    parser.add_argument("-s", "--sense_index", default=None, type=str,
+                        help="Path to a prebuilt sense index "
+                             "(see build_wordnet_cache.py)")
+    parser.add_argument("-m", "--model", default=None, type=str,
+                        help="Path to a fitted lookup table, e.g. "
+                             "cache/mfs.json")
+    parser.add_argument("--fit", action='store_true',
+                        help="Fit the lookup table on the train data and "
+                             "save it to --model, without predicting")
+    parser.add_argument("-t", "--train_file", default='data/train.conll',
+                        type=str, help="Train file to fit the lookup table")
     args = parser.parse_args()
     return args
 
 
-def baseline(sns, lookup_dict):
-    """Uses the synsets for extracting the lemma and pos-tag, then
-    predicts the most frequent sense from the lookup dictionary
-    or if this can't be found, predict the first sense """
-    predictions = []
-    for syn in sns:
-        # This is done so we always end up with the same number of items per
-        # list (predictions and actual dataset).
-        if not syn:
-            predictions.append(None)
-            continue
-
-        lem, pos, _ = syn.split(".")
-        lem_pos = lem + "." + pos
-        # Try and get the most frequent sense from the lookup dict:
-        if lem_pos in lookup_dict:
-            most_freq_sense = max(lookup_dict[lem_pos], key=lookup_dict[lem_pos].get)
-            predictions.append(lem_pos+"."+most_freq_sense)
-
-        # Else: take the first sense from WordNet as our prediction
-        else:
-            senses = get_wn_senses(lem, pos)
-            if not senses:
-                print(f'No Wordnet entry found for: {syn}')
-                predictions.append('NO WORDNET ENTRY FOUND')
-                continue
-
-            # Check whether the lemma is in the list of all lemmas
-            lemma_names = {l.lower() for l in senses[0].lemma_names()}
-            if lem.lower() in lemma_names:
-                predictions.append(make_sns_str(lem, pos, 1))
-            else:
-                predictions.append(senses[0].name())
-
-    return predictions
-
-
-def create_freq_dict(conll_dataset):
-    """Creates a nested dictionary with the sense frequencies for each
-    lemma, pos-tag combination.
-    E.g. {'forget.v': {'02': 1, '04': 2}, 'week.n': {'01': 1}}"""
-    sense_frequencies = {}
-    for sns in conll_dataset.get_category(AnnCategory.SNS):
-        for syn in sns:
-            if syn:
-                lem, pos, sen = syn.split(".")
-                lem_pos = lem+"."+pos
-                if lem_pos in sense_frequencies:
-                    # Increase frequency count of the specific sense
-                    sense_frequencies[lem_pos][sen] = sense_frequencies[lem_pos].get(sen, 0) + 1
-                else:
-                    # Add lemma & pos-tag to the dictionary
-                    sense_frequencies[lem_pos] = {sen: 1}
-
-    return sense_frequencies
+def dataset_lemmas():
+    """All lemma.pos combinations of the data sets, so their first WordNet
+    sense can be resolved when fitting"""
+    lemmas = set()
+    for dataset in ["dev", "eval", "test", "train"]:
+        if os.path.exists("data/" + dataset + ".conll"):
+            lemmas.update(lemma_counts(
+                load_conll("data/" + dataset + ".conll")
+            ))
+    return sorted(lemmas)
 
 
 def main():
-    # Load data set
     args = create_arg_parser()
-    dataset = ConllDataset("data/" + args.dataset + ".conll")
-
-    print(f'\nLoaded {len(dataset)} documents\n')
-
-    # Create lookup dictionary with sense frequencies for each
-    # lemma, pos-tag combination from the training data
-    sense_frequencies = create_freq_dict(ConllDataset("data/train.conll"))
 
-    # Predict senses for each document
-    predictions = [baseline(sns, sense_frequencies)
-                   for sns in dataset.get_category(AnnCategory.SNS)]
+    # Without a prebuilt index, lemmas are looked up in WordNet once each
+    if args.sense_index:
+        sense_index = SenseIndex.load(args.sense_index)
+    else:
+        sense_index = SenseIndex()
+
+    if args.fit:
+        if not args.model:
+            raise SystemExit("--fit needs a --model path to save to")
+        # Create lookup table with the most frequent sense for each lemma,
+        # pos-tag combination from the training data
+        model = MostFrequentSense.fit(
+            load_conll(args.train_file), sense_index,
+            dataset_lemmas()
+        )
+        model.save(args.model)
+        print(f"Lookup table with {len(model)} entries has been written to "
+              f"file: '{args.model}'")
+        return
+
+    if args.model:
+        model = MostFrequentSense.load(args.model, sense_index)
+    else:
+        model = MostFrequentSense.fit(
+            load_conll(args.train_file), sense_index
+        )
+
+    # Predict senses for each document, from the parsed column cache
+    dataset = load_conll("data/" + args.dataset + ".conll")
+    predictions = [model.predict(doc.get_category(AnnCategory.SNS))
+                   for doc in dataset]
+    print(f'\nPredicted senses for {len(predictions)} documents\n')
+    if (missing := sum(pred.count(NO_ENTRY) for pred in predictions)):
+        print(f'No Wordnet entry found for {missing} tokens')
 
     # Write results to pickle file
     with open('results/statistical_baseline_predictions_' + args.dataset + '.pickle', 'wb') as pred_file:
@@ -10,18 +10,33 @@ Description:
 """
 
 import argparse
-import pickle
-from typing import Any, List
+import asyncio
+import copy
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import Pool, get_context
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple)
 
 import pandas as pd
 import torch
-from nltk.corpus.reader.wordnet import Synset
 from simpletransformers.classification import (ClassificationArgs,
                                                ClassificationModel)
 
-from src.conll import AnnCategory, ConllDataset
-from src.wordnet import (ContextOptions, get_wn_senses, make_sns_str,
-                         make_wn_context)
+from src.backends import BACKENDS, load_model
+from src.biencoder import GlossIndex, predict_biencoder
+from src.candidates import PrefilterStats, candidate_names, trivial_prediction
+from src.columnar import load_conll
+from src.conll import AnnCategory, ConllDataset, ConllDoc
+from src.inference import GlossTruncator, PairEncoder, score_pairs
+from src.predictions import PredictionWriter, is_jsonl, write_predictions
+from src.sampling import NegativeSampler, TrainingIndex
+from src.training import train_bucketed
+from src.wordnet import (ContextOptions, GlossCache, SenseIndex, make_sns_str,
+                         make_wn_context, make_wn_context_parts)
 
 
 def create_arg_parser():
@@ -31,7 +46,9 @@ def create_arg_parser():
     parser.add_argument("-p", "--prediction_file", default='./data/dev.conll',
                         type=str, help="Location of development file.")
     parser.add_argument("-o", "--outfile", default='./data/output_s1.pickle',
-                        type=str, help="Path to write output to.")
+                        type=str, help="Path to write output to. With a "
+                                       ".jsonl extension predictions are "
+                                       "written per doc while predicting.")
     parser.add_argument('--add_hypo', action='store_true', default=False,
                         help='Adds hyponym gloss information to context.')
     parser.add_argument('--add_hyper', action='store_true', default=False,
@@ -45,67 +62,325 @@ def create_arg_parser():
     parser.add_argument('--add_example', action='store_true', default=False,
                         help='Adds example(s) to context for all selected '
                              'relations (if available).')
-    return parser.parse_args()
+    parser.add_argument('--scoring', default='cross', type=str,
+                        choices=['cross', 'bi'],
+                        help='Score every sentence/gloss pair with the '
+                             'sentence-pair classifier (cross), or compare '
+                             'separate sentence and precomputed gloss '
+                             'embeddings (bi). Bi is experimental: it is '
+                             'much faster, but the embeddings come from the '
+                             'encoder of the classifier, which was not '
+                             'trained to make them comparable, and its '
+                             'accuracy has not been measured.')
+    parser.add_argument('--gloss_index', default='cache/gloss_index',
+                        type=str, help='Path (without extension) of the gloss '
+                                       'embedding index for --scoring bi. It '
+                                       'is rebuilt if the model or context '
+                                       'options changed.')
+    parser.add_argument('--batched', action='store_true', default=False,
+                        help='Score the candidate senses of all tokens in '
+                             'large batches instead of one call per token.')
+    parser.add_argument('--pipelined', action='store_true', default=False,
+                        help='Stream the prediction file and build sentence '
+                             'pairs (in --workers processes) while the model '
+                             'runs, instead of one stage after the other.')
+    parser.add_argument('--model_dir', default=None, type=str,
+                        help='Directory of a model saved by an earlier run. '
+                             'It is used for prediction without training.')
+    parser.add_argument('--model_type', default='bert', type=str,
+                        help='Model type of the model in --model_dir.')
+    parser.add_argument('--backend', default='fp32', choices=BACKENDS,
+                        help='How the model is run for prediction: as is, '
+                             'with dynamic int8 quantization (CPU) or '
+                             'exported to ONNX Runtime (CPU, needs the onnx '
+                             'and onnxruntime packages).')
+    parser.add_argument('--sharded', action='store_true', default=False,
+                        help='Predict on the CPU in --workers processes, '
+                             'each with its own copy of the trained model '
+                             'and a contiguous part of the prediction file. '
+                             'Sentence pairs are scored in batches, as with '
+                             '--batched.')
+    parser.add_argument('--threads', default=None, type=int,
+                        help='Number of torch threads per worker in sharded '
+                             'mode, by default the cores are divided '
+                             'evenly between the workers.')
+    parser.add_argument('--queue_size', default=64, type=int,
+                        help='Maximum number of prepared shards of 16 docs '
+                             'waiting for the model in pipelined mode.')
+    parser.add_argument('--batch_size', default=64, type=int,
+                        help='Number of sentence pairs per forward pass in '
+                             'batched, pipelined and sharded prediction mode.')
+    parser.add_argument('--gloss_cache', default=None, type=str,
+                        help='Path to a gloss context cache (see '
+                             'build_wordnet_cache.py). Missing entries are '
+                             'added to it.')
+    parser.add_argument('--sense_index', default=None, type=str,
+                        help='Path to a prebuilt sense index (see '
+                             'build_wordnet_cache.py).')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes used to prepare the '
+                             'training data with --dataframe_training and, '
+                             'in pipelined mode, the sentence pairs to '
+                             'predict. In sharded mode the number of model '
+                             'replicas.')
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help='Continue after the last doc in an existing '
+                             '.jsonl outfile instead of starting over.')
+    parser.add_argument('--flush_every', default=100, type=int,
+                        help='Number of docs after which a .jsonl outfile is '
+                             'flushed to disk.')
+    parser.add_argument('--keep_trivial', action='store_true', default=False,
+                        help='Keep the sentence pairs of tokens with a single '
+                             'candidate sense in the training data.')
+    parser.add_argument('--truncate_glosses', action='store_true',
+                        default=False,
+                        help='Drop the least important gloss components '
+                             '(side, hypo, hyper, examples) of sentence '
+                             'pairs that are longer than the maximum '
+                             'sequence length, instead of cutting off the '
+                             'end of the gloss.')
+    parser.add_argument('--max_negatives', default=None, type=int,
+                        help='Maximum number of negative senses per training '
+                             'token, by default all other senses are used.')
+    parser.add_argument('--hard_negatives', default=None, type=int,
+                        help='Number of the negatives that are the senses '
+                             'closest to the gold sense in WordNet, the '
+                             'others are random. Defaults to half of '
+                             '--max_negatives.')
+    parser.add_argument('--sampling_seed', default=0, type=int,
+                        help='Seed of the negative sampling.')
+    parser.add_argument('--dataframe_training', action='store_true',
+                        default=False,
+                        help='Prepare all sentence pairs up front and train '
+                             'with simpletransformers on a DataFrame of '
+                             'them, padded to the maximum sequence length. '
+                             'By default the pairs are created per batch '
+                             'and batches of pairs of similar length are '
+                             'padded to their longest pair. That loop uses '
+                             'gradient accumulation and fp16 like '
+                             'simpletransformers, but doesn\'t evaluate '
+                             'during training, stop early or save '
+                             'checkpoints.')
+    args = parser.parse_args()
+
+    for name in ('max_negatives', 'hard_negatives'):
+        if (value := getattr(args, name)) is not None and value < 0:
+            parser.error(f'--{name} must be 0 or more, not {value}')
+    # The DataFrame is prepared once, there is nothing to resample per epoch
+    if args.dataframe_training and (args.max_negatives is not None
+                                    or args.hard_negatives is not None):
+        parser.error('--max_negatives and --hard_negatives can\'t be used '
+                     'with --dataframe_training')
+    # Bi-encoder scoring runs serially on the torch model
+    if args.scoring == 'bi':
+        for name in ('sharded', 'pipelined'):
+            if getattr(args, name):
+                parser.error(f'--{name} can\'t be used with --scoring bi')
+        if args.backend == 'onnx':
+            parser.error('--scoring bi needs the torch model, it can\'t be '
+                         'used with --backend onnx')
+    return args
+
+
+def gloss_context(
+    sense: str,
+    pmb_context: str,
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache] = None,
+    truncator: Optional[GlossTruncator] = None
+) -> str:
+    """Get definitions and example sentences from the WordNet gloss of a
+    sense, shortened by the truncator (if any) to fit with the sentence"""
+    if truncator is not None:
+        if gloss_cache is not None:
+            parts = gloss_cache.get_parts(sense, options)
+        else:
+            parts = make_wn_context_parts(sense, options)
+        return truncator(pmb_context, parts)
+    if gloss_cache is not None:
+        return gloss_cache.get(sense, options)
+    return make_wn_context(sense, options)
 
 
 def prepare_sense_data(
-    syn: Synset,
+    syn: str,
     pmb_context: str,
     options: ContextOptions,
-    with_labels: bool = False
+    with_labels: bool = False,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    senses: Optional[List[str]] = None,
+    truncator: Optional[GlossTruncator] = None
 ) -> List[List[Any]]:
-    """Prepare data to be in a useful format for text-pair classification"""
+    """Prepare data to be in a useful format for text-pair classification.
+    With a truncator, glosses that are too long for the model lose their
+    least important components first."""
     data = []
 
     # Look up all possible synsets (senses) for this lemma and POS
-    lem, pos, _ = syn.split(".")
-    senses = get_wn_senses(lem, pos)
+    if senses is None:
+        lem, pos, _ = syn.split(".")
+        senses = candidate_names(lem, pos, sense_index)
 
     for sense in senses:
-        # Get definitions and example sentences from WordNet gloss
-        wn_context = make_wn_context(sense, options)
+        wn_context = gloss_context(sense, pmb_context, options, gloss_cache,
+                                   truncator)
 
         # For correct synsets, add label 1 and add 0 for incorrect ones
         if with_labels:
             data.append([
                 pmb_context,
                 wn_context,
-                1 if syn == sense._name else 0
+                1 if syn == sense else 0
             ])
         else:
             data.append([pmb_context, wn_context])
     return data
 
 
+def prepare_doc(
+    pmb_context: str,
+    sns: Iterable[Optional[str]],
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    skip_trivial: bool = False,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
+) -> List[List[Any]]:
+    """Prepare the labelled sentence pairs for all synsets of a single doc.
+    With skip_trivial, tokens with less than two candidate senses are left
+    out, their pairs carry no information about which sense is right."""
+    data = []
+    for syn in sns:
+        if not syn:
+            continue
+
+        lem, pos, _ = syn.split(".")
+        senses = candidate_names(lem, pos, sense_index)
+        trivial = skip_trivial and len(senses) <= 1
+        if stats is not None:
+            stats.add(len(senses), trivial)
+        if trivial:
+            continue
+
+        # We need a flat list here, not per document!
+        data.extend(
+            prepare_sense_data(
+                syn, pmb_context, options, with_labels=True,
+                gloss_cache=gloss_cache, sense_index=sense_index,
+                senses=senses, truncator=truncator
+            )
+        )
+    return data
+
+
 def prepare_train(
-    conll_data: ConllDataset,
-    options: ContextOptions
+    conll_data: Iterable[ConllDoc],
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    workers: int = 1,
+    skip_trivial: bool = False,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
 ) -> List[List[Any]]:
-    """Prepare training data to be in a useful format for text-pair classification"""
+    """Prepare training data to be in a useful format for text-pair classification.
+    With multiple workers the docs are split into contiguous shards that are
+    prepared in a process pool, the output is the same as the serial version."""
+    if workers > 1:
+        return _prepare_train_parallel(
+            conll_data, options, gloss_cache, sense_index, workers,
+            skip_trivial, stats, truncator
+        )
+
     data = []
+    for doc in conll_data:
+        data.extend(prepare_doc(
+            doc.raw_sent, doc.get_category(AnnCategory.SNS),
+            options, gloss_cache, sense_index, skip_trivial, stats, truncator
+        ))
+    return data
 
-    for doc in conll_data.docs:
-        pmb_context = doc.raw_sent
-        for syn in doc.get_category(AnnCategory.SNS):
-            if not syn:
-                continue
-            # We need a flat list here, not per document!
-            data.extend(
-                prepare_sense_data(
-                    syn, pmb_context, options, with_labels=True
-                )
-            )
+
+# Shared state of the data preparation worker processes
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_prepare_worker(
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache],
+    sense_index: Optional[SenseIndex],
+    skip_trivial: bool = False,
+    truncator: Optional[GlossTruncator] = None
+) -> None:
+    # With the fork start method the cache is inherited as is, but every
+    # process needs its own SQLite connection (copies don't keep it).
+    if gloss_cache is not None:
+        gloss_cache = copy.copy(gloss_cache)
+    _worker_state.update(
+        options=options, gloss_cache=gloss_cache, sense_index=sense_index,
+        skip_trivial=skip_trivial, truncator=truncator
+    )
+
+
+def _prepare_shard(
+    shard: List[Tuple[str, List[str]]]
+) -> Tuple[List[List[Any]], PrefilterStats]:
+    data = []
+    stats = PrefilterStats()
+    for pmb_context, sns in shard:
+        data.extend(prepare_doc(pmb_context, sns, stats=stats,
+                                **_worker_state))
+
+    if (gloss_cache := _worker_state['gloss_cache']) is not None:
+        gloss_cache.flush()
+    return data, stats
+
+
+def _prepare_train_parallel(
+    conll_data: Iterable[ConllDoc],
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache],
+    sense_index: Optional[SenseIndex],
+    workers: int,
+    skip_trivial: bool = False,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
+) -> List[List[Any]]:
+    """Prepare training data in a process pool, merged in the original order"""
+    # Only the sentence and synsets of every doc are sent to the workers
+    docs = [(doc.raw_sent, [syn for syn in doc.get_category(AnnCategory.SNS)
+                            if syn])
+            for doc in conll_data]
+    # A few shards per worker to even out differences in doc length
+    shard_size = max(1, math.ceil(len(docs) / (workers * 4)))
+    shards = [docs[i:i + shard_size] for i in range(0, len(docs), shard_size)]
+
+    data = []
+    with Pool(workers, initializer=_init_prepare_worker,
+              initargs=(options, gloss_cache, sense_index,
+                        skip_trivial, truncator)) as pool:
+        for shard_data, shard_stats in pool.imap(_prepare_shard, shards):
+            data.extend(shard_data)
+            if stats is not None:
+                stats.merge(shard_stats)
     return data
 
 
 def predict(
-    to_predict_file: ConllDataset,
+    to_predict_file: Iterable[ConllDoc],
     model: ClassificationModel,
-    options: ContextOptions
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
 ):
-    """ Predict all synsets from a file """
+    """ Predict all synsets from a file. Tokens with less than two candidate
+        senses are resolved without the model. """
     all_predictions = []
-    for doc in to_predict_file.docs:
+    for doc in to_predict_file:
         doc_pred = []
         pmb_context = doc.raw_sent
         for syn in doc.get_category(AnnCategory.SNS):
@@ -116,7 +391,19 @@ def predict(
                 continue
 
             lem, pos, _ = syn.split(".")
-            context = prepare_sense_data(syn, pmb_context, options)
+            senses = candidate_names(lem, pos, sense_index)
+            trivial = trivial_prediction(lem, pos, senses)
+            if stats is not None:
+                stats.add(len(senses), trivial is not None)
+            if trivial is not None:
+                doc_pred.append(trivial)
+                continue
+
+            context = prepare_sense_data(
+                syn, pmb_context, options,
+                gloss_cache=gloss_cache, sense_index=sense_index,
+                senses=senses, truncator=truncator
+            )
 
             # Predict correct synset
             _, raw_outputs = model.predict(context)
@@ -131,28 +418,375 @@ def predict(
     return all_predictions
 
 
-def main():
-    if not torch.cuda.is_available():
-        print('No gpu available!')
-        exit(1)
+def prepare_predict_doc(
+    pmb_context: str,
+    sns: Iterable[Optional[str]],
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
+) -> Tuple[List[Any], List[List[str]]]:
+    """Prepare the sentence pairs of a single doc for prediction. Returns,
+    for every token, None if it is unannotated, the prediction if the
+    pre-filter resolved it, or the synset and the slice of the returned
+    pairs that holds its candidates."""
+    pairs = []
+    doc_spans = []
+    for syn in sns:
+        if not syn:
+            doc_spans.append(None)
+            continue
+
+        lem, pos, _ = syn.split(".")
+        senses = candidate_names(lem, pos, sense_index)
+        trivial = trivial_prediction(lem, pos, senses)
+        if stats is not None:
+            stats.add(len(senses), trivial is not None)
+        if trivial is not None:
+            doc_spans.append(trivial)
+            continue
+
+        context = prepare_sense_data(
+            syn, pmb_context, options,
+            gloss_cache=gloss_cache, sense_index=sense_index,
+            senses=senses, truncator=truncator
+        )
+        doc_spans.append((syn, len(pairs), len(pairs) + len(context)))
+        pairs.extend(context)
+    return doc_spans, pairs
+
+
+def pick_senses(
+    doc_spans: List[Any],
+    prob_1: Sequence[float]
+) -> List[Optional[str]]:
+    """Pick the most probable sense of every token of a doc, given the scores
+    of the pairs of that doc (see prepare_predict_doc)"""
+    doc_pred = []
+    for span in doc_spans:
+        if not isinstance(span, tuple):
+            # Unannotated or resolved by the pre-filter
+            doc_pred.append(span)
+            continue
+
+        syn, start, end = span
+        lem, pos, _ = syn.split(".")
+        token_probs = prob_1[start:end]
+        sense_num_most_probable = token_probs.index(max(token_probs)) + 1
+        doc_pred.append(make_sns_str(lem, pos, sense_num_most_probable))
+    return doc_pred
+
+
+def predict_batched(
+    to_predict_file: Iterable[ConllDoc],
+    model: ClassificationModel,
+    options: ContextOptions,
+    batch_size: int = 64,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None
+):
+    """ Predict all synsets from a file, scoring the sentence pairs of all
+        tokens in fixed-size batches instead of one model call per token.
+        Every unique sentence and gloss is tokenized once and duplicate pairs
+        are scored once. Gives the same output as predict().
+    """
+    # Flatten all sentence pairs into a single stream, remembering which
+    # slice of that stream belongs to which doc.
+    pairs = []
+    docs = []
+    for doc in to_predict_file:
+        doc_spans, doc_pairs = prepare_predict_doc(
+            doc.raw_sent, doc.get_category(AnnCategory.SNS), options,
+            gloss_cache, sense_index, stats, truncator
+        )
+        docs.append((doc_spans, len(pairs), len(pairs) + len(doc_pairs)))
+        pairs.extend(doc_pairs)
+
+    encoder = PairEncoder(model.tokenizer, model.args.max_seq_length)
+    prob_1 = score_pairs(model, pairs, batch_size, encoder)
+
+    # Scatter the scores back per doc and pick the most probable senses
+    return [pick_senses(doc_spans, prob_1[start:end])
+            for doc_spans, start, end in docs]
+
+
+def _prepare_predict_shard(
+    shard: List[Tuple[str, List[Optional[str]]]]
+) -> Tuple[List[Tuple[List[Any], List[List[str]]]], PrefilterStats]:
+    stats = PrefilterStats()
+    prepared = [
+        prepare_predict_doc(pmb_context, sns, _worker_state['options'],
+                            _worker_state['gloss_cache'],
+                            _worker_state['sense_index'], stats,
+                            _worker_state['truncator'])
+        for pmb_context, sns in shard
+    ]
+    if (gloss_cache := _worker_state['gloss_cache']) is not None:
+        gloss_cache.flush()
+    return prepared, stats
+
+
+def _read_shard(
+    docs: Iterator[ConllDoc],
+    size: int
+) -> Tuple[List[str], List[Tuple[str, List[Optional[str]]]]]:
+    shard = list(itertools.islice(docs, size))
+    return ([doc.id for doc in shard],
+            [(doc.raw_sent, doc.get_category(AnnCategory.SNS))
+             for doc in shard])
+
+
+async def _predict_pipeline(
+    file_path: str,
+    model: ClassificationModel,
+    pool: ProcessPoolExecutor,
+    batch_size: int,
+    stats: Optional[PrefilterStats],
+    queue_size: int,
+    writer: Optional[PredictionWriter] = None,
+    shard_size: int = 16
+) -> List[List[Optional[str]]]:
+    """Reads docs, builds their sentence pairs in the process pool and scores
+    them with the model, all at the same time. The stages are connected by
+    bounded queues, so a slow model holds back reading and preparing instead
+    of letting the prepared pairs pile up. With a writer, the predictions are
+    written as soon as they are available instead of returned, and the docs
+    that the writer already holds are skipped."""
+    loop = asyncio.get_running_loop()
+    prepared: asyncio.Queue = asyncio.Queue(queue_size)
+    batches: asyncio.Queue = asyncio.Queue(2)
+    predictions: List[List[Optional[str]]] = []
+
+    async def read():
+        docs = ConllDataset.iter_docs(file_path)
+        if writer is not None:
+            done = await loop.run_in_executor(
+                None, lambda: [doc.id for doc in
+                               itertools.islice(docs, writer.done)]
+            )
+            check_resumable(done, writer)
+        while True:
+            doc_ids, shard = await loop.run_in_executor(None, _read_shard,
+                                                        docs, shard_size)
+            if not shard:
+                break
+            # Queued in input order, the futures resolve in any order
+            await prepared.put((doc_ids, loop.run_in_executor(
+                pool, _prepare_predict_shard, shard
+            )))
+        await prepared.put(None)
+
+    async def collect():
+        batch: List[Tuple[str, List[Any], List[List[str]]]] = []
+        n_pairs = 0
+        while (entry := await prepared.get()) is not None:
+            doc_ids, future = entry
+            shard_docs, shard_stats = await future
+            if stats is not None:
+                stats.merge(shard_stats)
+            for doc_id, (doc_spans, doc_pairs) in zip(doc_ids, shard_docs):
+                batch.append((doc_id, doc_spans, doc_pairs))
+                n_pairs += len(doc_pairs)
+            if n_pairs >= batch_size * 8:
+                await batches.put(batch)
+                batch, n_pairs = [], 0
+        await batches.put(batch)
+        await batches.put(None)
+
+    async def infer():
+        while (batch := await batches.get()) is not None:
+            pairs = [pair for _, _, doc_pairs in batch for pair in doc_pairs]
+            prob_1 = await loop.run_in_executor(
+                None, score_pairs, model, pairs, batch_size
+            )
+            start = 0
+            for doc_id, doc_spans, doc_pairs in batch:
+                end = start + len(doc_pairs)
+                doc_pred = pick_senses(doc_spans, prob_1[start:end])
+                if writer is not None:
+                    writer.write(doc_id, doc_pred)
+                else:
+                    predictions.append(doc_pred)
+                start = end
+
+    tasks = [asyncio.ensure_future(stage())
+             for stage in (read, collect, infer)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return predictions
+
+
+def predict_pipelined(
+    file_path: str,
+    model: ClassificationModel,
+    options: ContextOptions,
+    batch_size: int = 64,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    stats: Optional[PrefilterStats] = None,
+    workers: int = 1,
+    queue_size: int = 64,
+    writer: Optional[PredictionWriter] = None,
+    truncator: Optional[GlossTruncator] = None
+):
+    """ Predict all synsets from a file like predict_batched(), but stream
+        the file and overlap parsing, building the sentence pairs (in
+        `workers` processes) and running the model. At most queue_size
+        shards of docs are in flight, so memory use doesn't grow with the
+        size of the input. Gives the same output as predict().
+    """
+    with ProcessPoolExecutor(workers, initializer=_init_prepare_worker,
+                             initargs=(options, gloss_cache, sense_index,
+                                       False, truncator)) as pool:
+        return asyncio.run(_predict_pipeline(
+            file_path, model, pool, batch_size, stats, queue_size, writer
+        ))
+
+
+def _init_shard_worker(
+    model_type: str,
+    model_dir: str,
+    file_path: str,
+    threads: int,
+    batch_size: int,
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache],
+    sense_index: Optional[SenseIndex],
+    truncator: Optional[GlossTruncator] = None,
+    backend: str = 'fp32'
+) -> None:
+    """Load a model replica and the prediction file in a worker process"""
+    torch.set_num_threads(threads)
+    model = load_model(model_dir, model_type, backend, use_cuda=False,
+                       args={'silent': True})
+    _worker_state.update(
+        model=model, docs=load_conll(file_path).docs, batch_size=batch_size,
+        options=options, gloss_cache=gloss_cache, sense_index=sense_index,
+        truncator=truncator
+    )
 
-    args = create_arg_parser()
-    options = ContextOptions(
-        add_hypo=args.add_hypo, add_hyper=args.add_hyper,
-        add_side=args.add_side, add_example=args.add_example,
-        add_definition=args.add_definition
+
+def _predict_shard(
+    bounds: Tuple[int, int]
+) -> Tuple[List[List[Optional[str]]], PrefilterStats]:
+    """Predict the docs start:end of the prediction file in a worker"""
+    start, end = bounds
+    stats = PrefilterStats()
+    state = _worker_state
+    predictions = predict_batched(
+        state['docs'][start:end], state['model'], state['options'],
+        state['batch_size'], state['gloss_cache'], state['sense_index'],
+        stats, state['truncator']
     )
+    if state['gloss_cache'] is not None:
+        state['gloss_cache'].flush()
+    return predictions, stats
 
-    # Load input files
-    train_file = ConllDataset(args.train_file)
-    prediction_file = ConllDataset(args.prediction_file)
-    prepared_dataset = prepare_train(train_file, options)
 
-    # Prepare train set
-    train_df = pd.DataFrame(prepared_dataset)
-    train_df.columns = ["text_a", "text_b", "labels"]
+def predict_sharded(
+    file_path: str,
+    model_dir: str,
+    options: ContextOptions,
+    workers: int,
+    threads: Optional[int] = None,
+    batch_size: int = 64,
+    gloss_cache: Optional[GlossCache] = None,
+    sense_index: Optional[SenseIndex] = None,
+    stats: Optional[PrefilterStats] = None,
+    truncator: Optional[GlossTruncator] = None,
+    writer: Optional[PredictionWriter] = None,
+    model_type: str = 'bert',
+    backend: str = 'fp32'
+):
+    """ Predict all synsets from a file on the CPU with one replica of the
+        saved model in model_dir per worker process. The docs are split in
+        contiguous shards (a few per worker, to even out differences in doc
+        length) that are merged back in the original order, so the output
+        is the same as that of predict_batched(). The workers can't use
+        model.predict() like predict() does, as it starts a process pool of
+        its own. Every worker uses `threads` torch threads, by
+        default the cores are divided evenly between the workers. With a
+        writer, every shard is written as soon as it and the shards before
+        it are done.
+    """
+    doc_ids = load_conll(file_path).get_ids()
+    start = 0
+    if writer is not None:
+        check_resumable(doc_ids, writer)
+        start = writer.done
+
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    shard_size = max(1, math.ceil((len(doc_ids) - start) / (workers * 4)))
+    shards = [(i, min(i + shard_size, len(doc_ids)))
+              for i in range(start, len(doc_ids), shard_size)]
+
+    all_predictions = []
+    # Spawned workers don't inherit the thread pools of this process
+    context = get_context('spawn')
+    with context.Pool(workers, initializer=_init_shard_worker,
+                      initargs=(model_type, model_dir, file_path, threads,
+                                batch_size, options, gloss_cache, sense_index,
+                                truncator, backend)) as pool:
+        for (i, end), (predictions, shard_stats) in zip(
+                shards, pool.imap(_predict_shard, shards)):
+            if writer is not None:
+                writer.write_all(doc_ids[i:end], predictions)
+            else:
+                all_predictions.extend(predictions)
+            if stats is not None:
+                stats.merge(shard_stats)
+    return all_predictions
+
 
-    # Define and train model
+def check_resumable(
+    doc_ids: Sequence[Optional[str]],
+    writer: PredictionWriter
+) -> None:
+    """Check that a resumed writer holds predictions for the same docs"""
+    if list(doc_ids[:writer.done]) != writer.done_ids:
+        raise ValueError(f'{writer.path} does not hold predictions for the '
+                         'same docs, it can\'t be resumed')
+
+
+def predict_incrementally(
+    predict_fn: Callable[[List[ConllDoc]], List[List[Optional[str]]]],
+    to_predict_file: Iterable[ConllDoc],
+    writer: PredictionWriter
+) -> None:
+    """ Predict docs in chunks of writer.flush_every docs and write every
+        chunk as soon as it is done, starting after the docs that the
+        writer already holds when resuming. """
+    docs = iter(to_predict_file)
+    done = list(itertools.islice(docs, writer.done))
+    check_resumable([doc.id for doc in done], writer)
+
+    while (chunk := list(itertools.islice(docs, writer.flush_every))):
+        writer.write_all([doc.id for doc in chunk], predict_fn(chunk))
+
+
+def candidate_senses(
+    conll_data: Iterable[ConllDoc],
+    sense_index: SenseIndex
+) -> List[str]:
+    """ Returns the names of all candidate senses of the synsets in a file """
+    senses = set()
+    for doc in conll_data:
+        for syn in doc.get_category(AnnCategory.SNS):
+            if syn:
+                lem, pos, _ = syn.split(".")
+                senses.update(sense_index.senses(lem, pos))
+    return sorted(senses)
+
+
+def create_model_args() -> ClassificationArgs:
+    """Arguments of the model that is trained"""
     model_args = ClassificationArgs()
     model_args.evaluation_strategy = "steps"
     model_args.eval_steps = 1000
@@ -169,16 +803,157 @@ def main():
     model_args.early_stopping_metric_minimize = False
     model_args.early_stopping_patience = 1
     model_args.evaluate_during_training_steps = 1000
+    return model_args
 
-    model = ClassificationModel("bert", "bert-base-uncased", args=model_args)
-    model.train_model(train_df)
 
-    # Predict synsets
-    predictions = predict(prediction_file, model, options)
+def train(
+    model: ClassificationModel,
+    args: argparse.Namespace,
+    options: ContextOptions,
+    gloss_cache: Optional[GlossCache],
+    sense_index: Optional[SenseIndex],
+    truncator: Optional[GlossTruncator] = None
+) -> None:
+    """Prepare the training data and train the model, which is saved to
+    the output_dir of its arguments"""
+    # The training docs come from the parsed column cache
+    train_file = load_conll(args.train_file)
+    train_stats = PrefilterStats()
+    if args.dataframe_training:
+        train_data = prepare_train(
+            train_file, options, gloss_cache, sense_index, args.workers,
+            skip_trivial=not args.keep_trivial, stats=train_stats,
+            truncator=truncator
+        )
+        print(f'Training data: {train_stats}')
+        train_df = pd.DataFrame(train_data,
+                                columns=["text_a", "text_b", "labels"])
+        del train_data
+
+        model.train_model(train_df)
+        return
+
+    # The pairs of an epoch are sampled from an index of the training
+    # tokens, their text is only created when a batch needs it. Without a
+    # gloss cache on disk the glosses are kept in memory, so WordNet is only
+    # walked once per sense and not for every access in every epoch.
+    if gloss_cache is None:
+        gloss_cache = GlossCache(':memory:')
+    index = TrainingIndex.build(train_file, sense_index,
+                                not args.keep_trivial, train_stats)
+    sampler = NegativeSampler(args.max_negatives, args.hard_negatives,
+                              args.sampling_seed)
+    gloss = partial(gloss_context, options=options,
+                    gloss_cache=gloss_cache, truncator=truncator)
+    epoch_data = partial(index.epoch, sampler, gloss=gloss)
+    train_data = epoch_data(0)
+    print(f'Training data: {train_stats}, {len(train_data)} of '
+          f'{index.n_pairs()} sentence pairs per epoch after sampling')
+
+    # Without --max_negatives every epoch has the same pairs
+    train_bucketed(model, train_data, seed=model.args.seed,
+                   resample=epoch_data if args.max_negatives is not None
+                   else None)
 
-    # Write results to pickle file
-    with open(args.outfile, 'wb') as pred_file:
-        pickle.dump(predictions, pred_file)
+
+def main():
+    args = create_arg_parser()
+    options = ContextOptions(
+        add_hypo=args.add_hypo, add_hyper=args.add_hyper,
+        add_side=args.add_side, add_example=args.add_example,
+        add_definition=args.add_definition
+    )
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    gloss_cache = GlossCache(args.gloss_cache) if args.gloss_cache else None
+    if args.sense_index:
+        sense_index = SenseIndex.load(args.sense_index)
+    else:
+        sense_index = SenseIndex()
+
+    # The docs to predict come from the parsed column cache, the pipelined
+    # and sharded modes read the file themselves
+    prediction_file = load_conll(args.prediction_file)
+
+    # Define model, the training data is prepared with its tokenizer. A
+    # saved model is only used for prediction.
+    if args.model_dir:
+        model_type, model_dir = args.model_type, args.model_dir
+        model = load_model(model_dir, model_type, args.backend)
+    else:
+        model_args = create_model_args()
+        model_type, model_dir = "bert", model_args.output_dir
+        model = ClassificationModel(model_type, "bert-base-uncased",
+                                    args=model_args,
+                                    use_cuda=torch.cuda.is_available())
+    truncator = (GlossTruncator(model.tokenizer, model.args.max_seq_length)
+                 if args.truncate_glosses else None)
+
+    # Train model and reload it for the requested backend
+    if not args.model_dir:
+        train(model, args, options, gloss_cache, sense_index, truncator)
+        if args.backend != 'fp32':
+            model = load_model(model_dir, model_type, args.backend)
+
+    # Predict synsets, tokens with less than two candidates skip the model
+    predict_stats = PrefilterStats()
+    if args.scoring == 'bi':
+        gloss_index = GlossIndex.load(args.gloss_index, model, options)
+        if gloss_index is None:
+            gloss_index = GlossIndex.build(
+                model, candidate_senses(prediction_file, sense_index),
+                options, args.gloss_index, gloss_cache, args.batch_size
+            )
+        predict_fn = partial(
+            predict_biencoder, model=model, gloss_index=gloss_index,
+            sense_index=sense_index, gloss_cache=gloss_cache,
+            batch_size=args.batch_size, stats=predict_stats
+        )
+    elif args.batched:
+        predict_fn = partial(
+            predict_batched, model=model, options=options,
+            batch_size=args.batch_size, gloss_cache=gloss_cache,
+            sense_index=sense_index, stats=predict_stats, truncator=truncator
+        )
+    else:
+        predict_fn = partial(
+            predict, model=model, options=options, gloss_cache=gloss_cache,
+            sense_index=sense_index, stats=predict_stats, truncator=truncator
+        )
+
+    # Predictions in the .jsonl format are written while predicting
+    writer = None
+    if is_jsonl(args.outfile):
+        writer = PredictionWriter(args.outfile, args.resume, args.flush_every)
+
+    if args.sharded:
+        # The workers load the saved model, of --model_dir or of training
+        predictions = predict_sharded(
+            args.prediction_file, model_dir, options, args.workers,
+            args.threads, args.batch_size, gloss_cache, sense_index,
+            predict_stats, truncator, writer, model_type, args.backend
+        )
+    elif args.pipelined:
+        predictions = predict_pipelined(
+            args.prediction_file, model, options, args.batch_size,
+            gloss_cache, sense_index, predict_stats, args.workers,
+            args.queue_size, writer, truncator
+        )
+    elif writer is not None:
+        predict_incrementally(predict_fn, prediction_file, writer)
+    else:
+        predictions = predict_fn(prediction_file)
+    print(f'Prediction: {predict_stats}')
+
+    if gloss_cache is not None:
+        gloss_cache.close()
+
+    # Write results to file
+    if writer is not None:
+        writer.close()
+    else:
+        write_predictions(args.outfile, predictions)
     print("Predictions have been written to file: " + args.outfile)
 
 
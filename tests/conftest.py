@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+# Three small docs in the format of the PMB .conll files. The second one has
+# no annotated synsets, the third one has no raw sentence comment.
+CONLL = '''\
+# newdoc id = p00/d0001
+# raw sent = A dog barks
+A\tA\ta\tDIS\tnp/n\tO\t[]
+dog\tdog\tdog\tCON\tn\tdog.n.01\t[]
+barks\tbarks\tbark\tNOW\ts:dcl\\np\tbark.v.04\t[Agent]
+
+# newdoc id = p00/d0002
+# raw sent = Hi
+Hi\tHi\thi\tGRE\ts\tO\t[]
+
+# newdoc id = p00/d0003
+The\tThe\tthe\tDEF\tnp/n\tO\t[]
+grey\tgrey\tgrey\tCOL\tn/n\tgrey.a.01\t[Colour]
+cat\tcat\tcat\tCON\tn\tcat.n.01\t[]
+sleeps\tsleeps\tsleep\tNOW\ts:dcl\\np\tsleep.v.01\t[Agent]
+'''
+
+
+@pytest.fixture
+def conll_file(tmp_path):
+    path = tmp_path / 'data.conll'
+    path.write_text(CONLL)
+    return str(path)
+
+
+
+@pytest.fixture
+def fake_wordnet(tmp_path, monkeypatch):
+    """Installs a WordNet data directory with only the license header of
+    data.adj, enough for installed_wordnet_version()"""
+    from nltk import data as nltk_data
+
+    def install(version='3.0'):
+        folder = tmp_path / 'nltk_data' / 'corpora' / 'wordnet'
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / 'data.adj').write_text(
+            '  1 This software and database is being provided to you, the '
+            'LICENSEE, by\n'
+            f'  2 Princeton University under the following license.  '
+            f'WordNet {version} Copyright 2006 by Princeton University.\n'
+        )
+        monkeypatch.setattr(nltk_data, 'path', [str(tmp_path / 'nltk_data')])
+
+    return install
+
+# Words of the tiny model's vocabulary, other words are [UNK]
+WORDS = ('a the dog barks bark cat sleeps grey at animal feline that of '
+         'gloss domesticated colour ash').split()
+
+
+@pytest.fixture(scope='session')
+def tiny_model_dir(tmp_path_factory):
+    """A tiny randomly initialised BERT sentence-pair classifier, saved in
+    the format of system.py"""
+    import torch
+    from transformers import (BertConfig, BertForSequenceClassification,
+                              BertTokenizerFast)
+
+    path = str(tmp_path_factory.mktemp('model'))
+    with open(os.path.join(path, 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+                          + sorted(set(WORDS))))
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=len(set(WORDS)) + 5, hidden_size=32,
+                        num_hidden_layers=1, num_attention_heads=2,
+                        intermediate_size=64)
+    BertForSequenceClassification(config).save_pretrained(path)
+    BertTokenizerFast(os.path.join(path, 'vocab.txt')).save_pretrained(path)
+    return path
@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+from src.backends import ONNX_MODEL, export_onnx, load_model  # noqa: E402
+from src.inference import score_pairs  # noqa: E402
+
+PAIRS = [
+    ('the dog barks at the cat', 'a domesticated animal'),
+    ('the cat sleeps', 'a feline animal that sleeps'),
+    ('grey dog', 'the colour of ash'),
+]
+
+
+@pytest.fixture(scope='module')
+def model_dir(tiny_model_dir, tmp_path_factory):
+    # A copy, the tests write the ONNX export next to the model
+    path = str(tmp_path_factory.mktemp('onnx_model'))
+    shutil.copytree(tiny_model_dir, path, dirs_exist_ok=True)
+    return path
+
+
+def test_onnx_matches_fp32(model_dir):
+    args = {'silent': True, 'max_seq_length': 32}
+    fp32 = load_model(model_dir, backend='fp32', use_cuda=False, args=args)
+    onnx = load_model(model_dir, backend='onnx', args=args)
+    assert onnx.args.onnx
+    np.testing.assert_allclose(score_pairs(onnx, PAIRS, batch_size=2),
+                               score_pairs(fp32, PAIRS, batch_size=2),
+                               atol=1e-4)
+
+
+def test_export_replaces_partial_export(model_dir):
+    onnx_dir = os.path.join(model_dir, 'onnx')
+    if os.path.isdir(onnx_dir):
+        for name in os.listdir(onnx_dir):
+            os.remove(os.path.join(onnx_dir, name))
+    else:
+        os.makedirs(onnx_dir)
+    # What an interrupted export leaves behind
+    with open(os.path.join(onnx_dir, 'config.json'), 'w') as f:
+        f.write('{')
+
+    assert export_onnx(model_dir) == onnx_dir
+    assert os.path.exists(os.path.join(onnx_dir, ONNX_MODEL))
+    # No temporary export directories are left
+    assert [name for name in os.listdir(model_dir)
+            if name.startswith('onnx')] == ['onnx']
+
+
+def test_missing_onnx_input(model_dir):
+    from src.inference import collate, run_model
+
+    onnx = load_model(model_dir, backend='onnx', args={'silent': True})
+    inputs = collate(onnx, [([2, 5, 3], [0, 0, 0])])
+    del inputs['attention_mask']
+    with pytest.raises(ValueError, match='attention_mask'):
+        run_model(onnx, inputs)
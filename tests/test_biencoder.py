@@ -0,0 +1,48 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+import system
+from src.biencoder import model_fingerprint
+
+
+def make_model():
+    torch.manual_seed(0)
+    return SimpleNamespace(model=torch.nn.Sequential(
+        torch.nn.Embedding(10, 4), torch.nn.Linear(4, 2)
+    ))
+
+
+def test_fingerprint_covers_all_weights():
+    model = make_model()
+    fingerprint = model_fingerprint(model)
+    assert model_fingerprint(make_model()) == fingerprint
+
+    # Fine-tuning that leaves the embeddings alone changes the fingerprint
+    with torch.no_grad():
+        model.model[1].weight[0, 0] += 1
+    assert model_fingerprint(model) != fingerprint
+
+
+def test_fingerprint_of_quantized_model():
+    model = make_model()
+    model.model = torch.ao.quantization.quantize_dynamic(
+        model.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    fingerprint = model_fingerprint(model)
+    assert fingerprint == model_fingerprint(model)
+    assert fingerprint != model_fingerprint(make_model())
+
+
+@pytest.mark.parametrize('argv', [['--sharded'], ['--pipelined'],
+                                  ['--backend', 'onnx']])
+def test_bi_scoring_rejects_other_modes(monkeypatch, capsys, argv):
+    monkeypatch.setattr(sys, 'argv', ['system.py', '--scoring', 'bi', *argv])
+    with pytest.raises(SystemExit):
+        system.create_arg_parser()
+    assert '--scoring bi' in capsys.readouterr().err
+
+    monkeypatch.setattr(sys, 'argv', ['system.py', *argv])
+    system.create_arg_parser()
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from src.columnar import (CACHE_SUFFIX, ColumnarConllDataset, _source_info,
+                          load_conll)
+from src.conll import AnnCategory, ConllDataset
+
+
+def assert_same_docs(dataset, conll_file):
+    expected = ConllDataset(conll_file)
+    assert len(dataset) == len(expected)
+    for doc, expected_doc in zip(dataset, expected):
+        assert doc.id == expected_doc.id
+        assert doc.raw_sent == expected_doc.raw_sent
+        for category in AnnCategory:
+            assert list(doc.get_category(category)) == \
+                expected_doc.get_category(category)
+
+
+def test_columnar_matches_conll_dataset(conll_file):
+    dataset = ColumnarConllDataset.from_file(conll_file)
+    assert_same_docs(dataset, conll_file)
+    assert dataset.get_ids() == ['p00/d0001', 'p00/d0002', 'p00/d0003']
+    assert dataset.get_sents()[2] is None
+    assert list(dataset.docs[0].sns) == [None, 'dog.n.01', 'bark.v.04']
+
+
+def test_streamed_docs_match_loaded_docs(conll_file):
+    streamed = list(ConllDataset.iter_docs(conll_file))
+    loaded = ConllDataset(conll_file).docs
+    assert [doc.id for doc in streamed] == [doc.id for doc in loaded]
+    assert [doc.sns for doc in streamed] == [doc.sns for doc in loaded]
+
+
+def test_cache_round_trip(conll_file):
+    dataset = load_conll(conll_file)
+    assert dataset._mmap is None
+    assert os.path.exists(conll_file + CACHE_SUFFIX)
+
+    cached = load_conll(conll_file)
+    assert cached._mmap is not None
+    assert_same_docs(cached, conll_file)
+
+
+def test_cache_of_empty_file_is_reused(tmp_path):
+    path = str(tmp_path / 'empty.conll')
+    open(path, 'w').close()
+    assert len(load_conll(path)) == 0
+    mtime = os.stat(path + CACHE_SUFFIX).st_mtime_ns
+
+    cached = load_conll(path)
+    assert cached._mmap is not None
+    assert len(cached) == 0 and cached.get_ids() == []
+    assert os.stat(path + CACHE_SUFFIX).st_mtime_ns == mtime
+
+
+def test_cache_is_rebuilt_when_the_source_changes(conll_file):
+    load_conll(conll_file)
+    with open(conll_file, 'a') as f:
+        f.write('\n# newdoc id = p00/d0004\n'
+                'Run\tRun\trun\tIMP\ts\trun.v.01\t[]\n')
+
+    dataset = load_conll(conll_file)
+    assert dataset._mmap is None
+    assert dataset.get_ids()[-1] == 'p00/d0004'
+    assert_same_docs(load_conll(conll_file), conll_file)
+
+
+@pytest.mark.parametrize('corrupt', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:10],
+    lambda data: data[:16] + b'\xff' * (len(data) - 16),
+    lambda data: data[:16] + b'[1, 2]' + b' ' * (len(data) - 22),
+    lambda data: data[:-4],
+])
+def test_corrupt_cache_is_rebuilt(conll_file, corrupt):
+    load_conll(conll_file)
+    cache_path = conll_file + CACHE_SUFFIX
+    with open(cache_path, 'rb') as f:
+        data = f.read()
+    with open(cache_path, 'wb') as f:
+        f.write(corrupt(data))
+
+    dataset = load_conll(conll_file)
+    assert dataset._mmap is None
+    assert_same_docs(dataset, conll_file)
+    # The rebuilt cache is valid again
+    assert load_conll(conll_file)._mmap is not None
+
+
+def test_load_rejects_other_source(conll_file, tmp_path):
+    cache_path = str(tmp_path / 'other.cache')
+    ColumnarConllDataset.from_file(conll_file).save(
+        cache_path, {'path': conll_file, **_source_info(conll_file)}
+    )
+    other = tmp_path / 'other.conll'
+    other.write_text('# newdoc id = x\nA\tA\ta\tDIS\tnp/n\tO\t[]\n')
+    assert ColumnarConllDataset.load(
+        cache_path, {'path': str(other), **_source_info(str(other))}
+    ) is None
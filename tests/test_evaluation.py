@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from src.columnar import ColumnarConllDataset
+from src.conll import AnnCategory, ConllDataset
+from src.evaluation import (LabelEncoder, compute_scores, doc_statistics,
+                            label_correctness)
+
+
+def accuracy(gold, predictions):
+    if len(gold) != len(predictions) or not gold:
+        return 0
+    return sum(g == p for g, p in zip(gold, predictions)) / len(gold)
+
+
+def reference_scores(gold_docs, pred_docs):
+    """The scores as evaluate.py computed them on lists of strings, before
+    the labels were encoded"""
+    gold = [[label for label in doc if label] for doc in gold_docs]
+    pred = [[label for label in doc if label] for doc in pred_docs]
+    synsets = accuracy([label for doc in gold for label in doc],
+                       [label for doc in pred for label in doc])
+    per_sentence = [accuracy(g, p) for g, p in zip(gold, pred) if g and p]
+    mean_per_sentence = sum(per_sentence) / len(per_sentence)
+    return synsets, mean_per_sentence, accuracy(gold, pred)
+
+
+def scores(gold_docs, pred_docs):
+    encoder = LabelEncoder()
+    gold = encoder.encode(gold_docs)
+    result = compute_scores(gold, encoder.encode(pred_docs))
+    return result.synsets, result.mean_per_sentence, result.full_sentences
+
+
+def random_docs(rng, n_docs=60, vocab=8):
+    labels = [f'word.n.0{i}' for i in range(1, vocab)]
+    return [[None if rng.random() < 0.4 else labels[rng.integers(len(labels))]
+             for _ in range(rng.integers(1, 10))]
+            for _ in range(n_docs)]
+
+
+def perturb(rng, docs, wrong=0.2, dropped=0.05):
+    """Predictions with some wrong labels and some docs with a missing
+    label, which makes them incomparable"""
+    predictions = []
+    for doc in docs:
+        doc = [label if not label or rng.random() > wrong else 'wrong.n.01'
+               for label in doc]
+        annotated = [i for i, label in enumerate(doc) if label]
+        if annotated and rng.random() < dropped:
+            doc[annotated[0]] = None
+        predictions.append(doc)
+    return predictions
+
+
+def test_simple_scores():
+    gold = [['a.n.01', None, 'b.v.01'], [None], ['c.n.01']]
+    pred = [['a.n.01', None, 'b.v.02'], [None], ['c.n.01']]
+    assert scores(gold, pred) == (2 / 3, (0.5 + 1) / 2, 2 / 3)
+    assert scores(gold, gold) == (1.0, 1.0, 1.0)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_scores_match_reference(seed):
+    rng = np.random.default_rng(seed)
+    gold = random_docs(rng)
+    pred = perturb(rng, gold)
+    assert scores(gold, pred) == reference_scores(gold, pred)
+
+
+def test_scores_with_missing_labels_or_docs():
+    gold = [['a.n.01', 'b.n.01'], ['c.n.01'], ['d.n.01']]
+    # A missing label makes the synset lists of different length
+    pred = [['a.n.01', None], ['c.n.01'], ['d.n.01']]
+    assert scores(gold, pred) == reference_scores(gold, pred)
+    # Missing docs at the end
+    pred = [['a.n.01', 'b.n.01'], ['c.n.01']]
+    assert scores(gold, pred) == reference_scores(gold, pred)
+
+
+def test_no_annotated_sentences():
+    with pytest.raises(ZeroDivisionError):
+        scores([[None]], [[None]])
+
+
+def test_encode_dataset_matches_encode(conll_file):
+    dataset = ColumnarConllDataset.from_file(conll_file)
+    encoder = LabelEncoder()
+    from_dataset = encoder.encode_dataset(dataset)
+    from_lists = encoder.encode(ConllDataset(conll_file)
+                                .get_category(AnnCategory.SNS))
+    assert from_dataset.ids.tolist() == from_lists.ids.tolist()
+    assert from_dataset.offsets.tolist() == from_lists.offsets.tolist()
+
+
+def test_label_correctness_and_doc_statistics():
+    rng = np.random.default_rng(1)
+    gold_docs = random_docs(rng)
+    pred_docs = perturb(rng, gold_docs, dropped=0)
+    encoder = LabelEncoder()
+    gold = encoder.encode(gold_docs)
+    pred = encoder.encode(pred_docs)
+    synsets, mean_per_sentence, full_sentences = scores(gold_docs, pred_docs)
+
+    gold_ids, correct = label_correctness(gold, pred)
+    assert len(gold_ids) == sum(label is not None
+                                for doc in gold_docs for label in doc)
+    assert correct.mean() == pytest.approx(synsets)
+
+    # All docs are comparable, so the totals equal the scores
+    numerators, denominators = doc_statistics(gold, pred)
+    totals = numerators.sum(axis=1) / denominators.sum(axis=1)
+    assert totals == pytest.approx([synsets, mean_per_sentence,
+                                    full_sentences])
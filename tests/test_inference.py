@@ -0,0 +1,59 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.inference import PairEncoder, score_pairs
+
+WORDS = [f'w{i}' for i in range(30)]
+
+
+@pytest.fixture(scope='module', params=['fast', 'python'])
+def tokenizer(request, tmp_path_factory):
+    from transformers import BertTokenizer, BertTokenizerFast
+
+    path = str(tmp_path_factory.mktemp('vocab') / 'vocab.txt')
+    with open(path, 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+                          + WORDS))
+    return (BertTokenizerFast if request.param == 'fast'
+            else BertTokenizer)(path)
+
+
+def test_truncation_matches_tokenizer(tokenizer):
+    # All combinations of text lengths, equal ones included, that don't fit
+    # or just fit in the maximum sequence length
+    for len_a, len_b, max_length in itertools.product(range(1, 13),
+                                                      range(1, 13),
+                                                      range(4, 20)):
+        text_a = ' '.join(WORDS[:len_a])
+        text_b = ' '.join(WORDS[15:15 + len_b])
+        expected = tokenizer(text_a, text_b, truncation='longest_first',
+                             max_length=max_length)
+        input_ids, token_type_ids = PairEncoder(
+            tokenizer, max_length
+        ).encode_pair(text_a, text_b)
+        assert (input_ids, token_type_ids) == \
+            (expected['input_ids'], expected['token_type_ids']), \
+            (len_a, len_b, max_length)
+
+
+def test_score_pairs_matches_model(tiny_model_dir):
+    import torch
+    from simpletransformers.classification import ClassificationModel
+
+    model = ClassificationModel(
+        'bert', tiny_model_dir, use_cuda=False,
+        args={'silent': True, 'max_seq_length': 9}
+    )
+    pairs = [['a dog barks at the cat', 'a domesticated animal'],
+             ['the cat sleeps', 'the grey cat sleeps'],
+             ['a grey dog', 'the colour of ash that a cat']]
+    inputs = model.tokenizer([a for a, _ in pairs], [b for _, b in pairs],
+                             truncation='longest_first', max_length=9,
+                             padding='max_length', return_tensors='pt')
+    model.model.eval()
+    with torch.no_grad():
+        expected = model.model(**inputs).logits[:, 1].numpy()
+    np.testing.assert_allclose(score_pairs(model, pairs, batch_size=2),
+                               expected, atol=1e-6)
@@ -0,0 +1,63 @@
+import pytest
+
+from src.conll import ConllDataset
+from src.mfs import NO_ENTRY, MostFrequentSense, create_freq_dict
+from src.wordnet import SenseIndex
+
+
+def make_sense_index():
+    return SenseIndex({'run.v': ['run.v.01', 'scat.v.01'], 'xyz.n': []},
+                      first_is_lemma=['run.v'])
+
+
+def test_fit_and_predict(conll_file):
+    docs = list(ConllDataset.iter_docs(conll_file))
+    assert create_freq_dict(docs)['dog.n'] == {'01': 1}
+
+    model = MostFrequentSense.fit(docs, make_sense_index())
+    assert model.predict([None, 'dog.n.05', 'bark.v.01']) == \
+        [None, 'dog.n.01', 'bark.v.04']
+    # Unseen lemmas get the first WordNet sense, if there is one
+    assert model.predict(['run.v.03', 'xyz.n.01']) == ['run.v.01', NO_ENTRY]
+
+
+class Doc:
+
+    def __init__(self, sns):
+        self.sns = sns
+
+    def get_category(self, category):
+        return self.sns
+
+
+def test_ties_go_to_the_first_sense_seen():
+    docs = [Doc(['go.v.02', 'go.v.01']), Doc(['go.v.01', 'go.v.02'])]
+    assert MostFrequentSense.fit(docs).predict_lemma('go.v') == 'go.v.02'
+
+
+def test_save_and_load(conll_file, tmp_path):
+    path = str(tmp_path / 'mfs.json')
+    model = MostFrequentSense.fit(ConllDataset.iter_docs(conll_file),
+                                  make_sense_index(), ['run.v'])
+    model.save(path)
+
+    loaded = MostFrequentSense.load(path)
+    assert loaded.table == model.table
+    assert loaded.predict_lemma('run.v') == 'run.v.01'
+    # Without a sense index, lemmas that were not fitted have no prediction
+    assert loaded.predict_lemma('cow.n') is None
+
+
+def test_load_checks_wordnet_version(conll_file, tmp_path, fake_wordnet):
+    fake_wordnet('3.0')
+    path = str(tmp_path / 'mfs.json')
+    model = MostFrequentSense.fit(ConllDataset.iter_docs(conll_file))
+    assert model.wordnet_version == '3.0'
+    model.save(path)
+    assert MostFrequentSense.load(path).wordnet_version == '3.0'
+
+    fake_wordnet('3.1')
+    with pytest.raises(ValueError, match='WordNet 3.0'):
+        MostFrequentSense.load(path)
+    assert MostFrequentSense.load(path, check_version=False).table == \
+        model.table
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+import system
+from src.conll import ConllDataset
+from src.predictions import (PredictionWriter, iter_senses, read_predictions,
+                             write_predictions)
+from src.wordnet import ContextOptions, GlossCache, SenseIndex, options_key
+
+DOC_IDS = ['p00/d0001', 'p00/d0002', 'p00/d0003']
+SENSES = {
+    'dog.n': ['dog.n.01', 'dog.n.02'], 'bark.v': ['bark.v.01', 'bark.v.04'],
+    'grey.a': ['grey.a.01'], 'cat.n': ['cat.n.01', 'cat.n.02'],
+    'sleep.v': ['sleep.v.01', 'sleep.v.02'],
+}
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path, flush_every=1) as writer:
+        writer.write_all(DOC_IDS[:2], [['dog.n.01', None], []])
+    assert list(read_predictions(path)) == [
+        (0, 'p00/d0001', ['dog.n.01', None]), (1, 'p00/d0002', []),
+    ]
+    assert list(iter_senses(path, DOC_IDS)) == [['dog.n.01', None], []]
+    with pytest.raises(ValueError):
+        list(iter_senses(path, DOC_IDS[1:]))
+
+
+def test_write_predictions_as_pickle(tmp_path):
+    path = str(tmp_path / 'out.pickle')
+    write_predictions(path, [['dog.n.01'], [None]])
+    assert list(read_predictions(path)) == [(0, None, ['dog.n.01']),
+                                            (1, None, [None])]
+
+
+def test_resume_drops_incomplete_line(tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path) as writer:
+        writer.write_all(DOC_IDS[:2], [['a.n.01'], ['b.n.01']])
+    with open(path, 'a') as f:
+        f.write('{"index": 2, "id": "p00/d0003", "sen')
+
+    with PredictionWriter(path, resume=True) as writer:
+        assert writer.done == 2
+        assert writer.done_ids == DOC_IDS[:2]
+        writer.write(DOC_IDS[2], ['c.n.01'])
+    assert [line['index'] for line in read_lines(path)] == [0, 1, 2]
+
+    # Without resume the file starts over
+    with PredictionWriter(path) as writer:
+        assert writer.done == 0
+    assert read_lines(path) == []
+
+
+def gold_senses(docs):
+    return [list(doc.sns) for doc in docs]
+
+
+def test_predict_incrementally_resumes(conll_file, tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path, flush_every=1) as writer:
+        system.predict_incrementally(gold_senses,
+                                     ConllDataset.iter_docs(conll_file),
+                                     writer)
+    expected = read_lines(path)
+
+    with PredictionWriter(path) as writer:
+        writer.write(DOC_IDS[0], expected[0]['senses'])
+    calls = []
+
+    def predict_fn(docs):
+        calls.append([doc.id for doc in docs])
+        return gold_senses(docs)
+
+    with PredictionWriter(path, resume=True, flush_every=1) as writer:
+        system.predict_incrementally(predict_fn,
+                                     ConllDataset.iter_docs(conll_file),
+                                     writer)
+    assert calls == [[DOC_IDS[1]], [DOC_IDS[2]]]
+    assert read_lines(path) == expected
+
+
+def test_predict_incrementally_rejects_other_docs(conll_file, tmp_path):
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path) as writer:
+        writer.write('p99/d9999', [None])
+    with PredictionWriter(path, resume=True) as writer:
+        with pytest.raises(ValueError):
+            system.predict_incrementally(gold_senses,
+                                         ConllDataset.iter_docs(conll_file),
+                                         writer)
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """Arguments of predict_pipelined with a filled gloss cache, a sense
+    index and a fake model that prefers the second sense"""
+    options = ContextOptions(add_definition=True)
+    cache = GlossCache(str(tmp_path / 'glosses.sqlite'))
+    cache._insert([(sense, options_key(options), f'gloss of {sense}')
+                   for senses in SENSES.values() for sense in senses])
+    cache.close()
+
+    def score_pairs(model, pairs, batch_size=64, encoder=None):
+        return [1.0 if gloss.endswith('02') else 0.0 for _, gloss in pairs]
+
+    monkeypatch.setattr(system, 'score_pairs', score_pairs)
+    return dict(model=None, options=options, batch_size=4,
+                gloss_cache=GlossCache(cache.path, read_only=True),
+                sense_index=SenseIndex(dict(SENSES)))
+
+
+def test_predict_pipelined_resumes(conll_file, tmp_path, pipeline):
+    expected = [[None, 'dog.n.02', 'bark.v.01'], [None],
+                [None, 'grey.a.01', 'cat.n.02', 'sleep.v.02']]
+    assert system.predict_pipelined(conll_file, **pipeline) == expected
+
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path) as writer:
+        writer.write(DOC_IDS[0], expected[0])
+    with PredictionWriter(path, resume=True) as writer:
+        system.predict_pipelined(conll_file, writer=writer, **pipeline)
+    assert [line['senses'] for line in read_lines(path)] == expected
+    assert [line['id'] for line in read_lines(path)] == DOC_IDS
+
+
+def test_predict_pipelined_rejects_other_docs(conll_file, tmp_path,
+                                              pipeline):
+    path = str(tmp_path / 'out.jsonl')
+    with PredictionWriter(path) as writer:
+        writer.write_all(['p00/d0001', 'p99/d9999'], [[None], [None]])
+    with PredictionWriter(path, resume=True) as writer:
+        with pytest.raises(ValueError):
+            system.predict_pipelined(conll_file, writer=writer, **pipeline)
+    # Nothing was appended
+    assert len(read_lines(path)) == 2
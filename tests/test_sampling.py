@@ -0,0 +1,198 @@
+import argparse
+import sys
+from functools import partial
+
+import pytest
+
+import system
+from src.conll import ConllDataset
+from src.sampling import NegativeSampler, TrainingIndex
+from src.wordnet import ContextOptions, GlossCache, SenseIndex, options_key
+
+SENSES = {
+    'dog.n': ['dog.n.01', 'dog.n.02', 'dog.n.03'],
+    'bark.v': ['bark.v.01', 'bark.v.02', 'bark.v.03', 'bark.v.04'],
+    'grey.a': ['grey.a.01'], 'cat.n': ['cat.n.01', 'cat.n.02'],
+    'sleep.v': ['sleep.v.01', 'sleep.v.02'],
+}
+OPTIONS = ContextOptions(add_definition=True)
+SENSES_20 = [f'word.n.{i:02d}' for i in range(1, 21)]
+
+
+def proximity(gold, sense):
+    """Fake WordNet proximity: senses with a close number are close"""
+    return -abs(int(gold[-2:]) - int(sense[-2:]))
+
+
+def test_uncapped_sampler_keeps_all_senses():
+    sampler = NegativeSampler()
+    assert sampler.select('dog.n.02', SENSES['dog.n'],
+                          sampler.rng(0)) == SENSES['dog.n']
+
+
+def test_sampler_is_deterministic_per_seed_and_epoch():
+    def selections(seed, epoch):
+        sampler = NegativeSampler(4, 0, seed=seed, proximity=proximity)
+        rng = sampler.rng(epoch)
+        return [sampler.select(gold, SENSES_20, rng)
+                for gold in SENSES_20[:5]]
+
+    assert selections(1, 0) == selections(1, 0)
+    assert selections(1, 0) != selections(1, 1)
+    assert selections(1, 0) != selections(2, 0)
+
+
+def test_sampler_keeps_gold_and_hard_negatives():
+    sampler = NegativeSampler(4, 2, proximity=proximity)
+    for epoch in range(5):
+        selected = sampler.select('word.n.10', SENSES_20, sampler.rng(epoch))
+        assert len(selected) == 5
+        # The closest senses, then two random ones, all in WordNet order
+        assert {'word.n.09', 'word.n.10', 'word.n.11'} <= set(selected)
+        assert selected == sorted(selected)
+
+
+def test_sampler_with_unknown_gold_sense(caplog):
+    def strict_proximity(gold, sense):
+        if gold not in SENSES_20:
+            raise ValueError(f'no synset {gold}')
+        return proximity(gold, sense)
+
+    sampler = NegativeSampler(4, 2, proximity=strict_proximity)
+    senses = SENSES_20 + ['word.n.99']
+    with caplog.at_level('WARNING', logger='src.sampling'):
+        selections = [sampler.select('word.n.99', senses, sampler.rng(epoch))
+                      for epoch in range(3)]
+    # The negatives are all random, the ranking is only tried once
+    assert len(caplog.records) == 1
+    for selected in selections:
+        assert len(selected) == 5 and 'word.n.99' in selected
+    assert selections[0] != selections[1]
+
+
+def test_sampler_without_negatives():
+    sampler = NegativeSampler(0, proximity=proximity)
+    assert sampler.hard_negatives == 0
+    assert sampler.select('word.n.03', SENSES_20,
+                          sampler.rng(0)) == ['word.n.03']
+
+
+@pytest.fixture
+def gloss_cache(tmp_path):
+    cache = GlossCache(str(tmp_path / 'glosses.sqlite'))
+    cache._insert([(sense, options_key(OPTIONS), f'gloss of {sense}')
+                   for senses in SENSES.values() for sense in senses])
+    cache.close()
+    return GlossCache(cache.path, read_only=True)
+
+
+def gloss(gloss_cache):
+    return partial(system.gloss_context, options=OPTIONS,
+                   gloss_cache=gloss_cache)
+
+
+@pytest.mark.parametrize('skip_trivial', [False, True])
+def test_epoch_matches_prepare_train(conll_file, gloss_cache, skip_trivial):
+    sense_index = SenseIndex(dict(SENSES))
+    index = TrainingIndex.build(ConllDataset.iter_docs(conll_file),
+                                sense_index, skip_trivial)
+    pairs = index.epoch(NegativeSampler(), 0, gloss(gloss_cache))
+
+    expected = system.prepare_train(ConllDataset.iter_docs(conll_file),
+                                    OPTIONS, gloss_cache, sense_index,
+                                    skip_trivial=skip_trivial)
+    assert len(pairs) == index.n_pairs() == len(expected)
+    assert [pairs[i] for i in range(len(pairs))] == expected
+    assert pairs[1:4] == expected[1:4]
+    assert pairs[::-2] == expected[::-2]
+    assert len(index) == (4 if skip_trivial else 5)
+
+
+def test_epoch_samples_negatives(conll_file, gloss_cache):
+    index = TrainingIndex.build(ConllDataset.iter_docs(conll_file),
+                                SenseIndex(dict(SENSES)))
+    sampler = NegativeSampler(1, 0, proximity=proximity)
+    pairs = index.epoch(sampler, 0, gloss(gloss_cache))
+
+    # dog (3 senses) and bark (4 senses) keep the gold and one negative
+    assert len(pairs) == 2 + 2 + 1 + 2 + 2
+    assert [gloss for _, gloss, label in pairs if label] == [
+        f'gloss of {sense}' for sense in ('dog.n.01', 'bark.v.04',
+                                          'grey.a.01', 'cat.n.01',
+                                          'sleep.v.01')
+    ]
+
+
+def parse(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ['system.py', *argv])
+    return system.create_arg_parser()
+
+
+def test_sampling_arguments(monkeypatch):
+    args = parse(monkeypatch, '--max_negatives', '0')
+    assert args.max_negatives == 0 and not args.dataframe_training
+    for argv in (['--max_negatives', '-1'], ['--hard_negatives', '-2'],
+                 ['--dataframe_training', '--max_negatives', '3'],
+                 ['--dataframe_training', '--hard_negatives', '1']):
+        with pytest.raises(SystemExit):
+            parse(monkeypatch, *argv)
+
+
+def train_args(conll_file, **kwargs):
+    args = dict(train_file=conll_file, keep_trivial=False, workers=1,
+                max_negatives=None, hard_negatives=None, sampling_seed=0,
+                dataframe_training=False)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class FakeModel:
+    def __init__(self):
+        self.args = argparse.Namespace(seed=0)
+        self.train_df = None
+
+    def train_model(self, train_df):
+        self.train_df = train_df
+
+
+@pytest.mark.parametrize('max_negatives', [None, 1])
+def test_train_is_lazy_by_default(conll_file, gloss_cache, monkeypatch,
+                                  max_negatives):
+    calls = []
+
+    def train_bucketed(model, train_data, seed=0, resample=None):
+        calls.append((train_data, resample))
+
+    monkeypatch.setattr(system, 'train_bucketed', train_bucketed)
+    monkeypatch.setattr(system, 'NegativeSampler',
+                        partial(NegativeSampler, proximity=proximity))
+    model = FakeModel()
+    system.train(model, train_args(conll_file, max_negatives=max_negatives),
+                 OPTIONS, gloss_cache, SenseIndex(dict(SENSES)))
+
+    (train_data, resample), = calls
+    assert model.train_df is None
+    assert train_data[0] == ['A dog barks', 'gloss of dog.n.01', 1]
+    # Only sampled negatives change between epochs
+    assert (resample is None) == (max_negatives is None)
+    if resample is not None:
+        assert len(resample(1)) == len(train_data)
+
+
+def test_dataframe_training(conll_file, gloss_cache, monkeypatch):
+    monkeypatch.setattr(system, 'train_bucketed', None)
+    model = FakeModel()
+    system.train(model, train_args(conll_file, dataframe_training=True),
+                 OPTIONS, gloss_cache, SenseIndex(dict(SENSES)))
+
+    expected = system.prepare_train(ConllDataset.iter_docs(conll_file),
+                                    OPTIONS, gloss_cache,
+                                    SenseIndex(dict(SENSES)),
+                                    skip_trivial=True)
+    assert list(model.train_df.columns) == ['text_a', 'text_b', 'labels']
+    assert len(model.train_df) == len(expected)
+    # The doc without a raw sentence has a missing text_a in the DataFrame
+    for column, values in zip(model.train_df.columns, zip(*expected)):
+        assert [value for value in model.train_df[column]
+                if isinstance(value, (str, int))] == \
+            [value for value in values if value is not None]
@@ -0,0 +1,159 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import server
+from src.candidates import trivial_prediction
+from src.mfs import NO_ENTRY, MostFrequentSense
+from src.serving import MicroBatcher
+from src.wordnet import ContextOptions, GlossCache, SenseIndex, options_key
+
+
+class StrictSenseIndex(SenseIndex):
+    """A sense index that doesn't fall back to WordNet"""
+
+    def _add(self, lem, pos):
+        raise KeyError(f'{lem}.{pos}')
+
+
+def fake_score_pairs(model, pairs, batch_size=64, encoder=None):
+    # The gloss of the second sense is the best match
+    return [1.0 if gloss.endswith('02') else 0.0 for _, gloss in pairs]
+
+
+@pytest.fixture
+def disambiguator(monkeypatch):
+    monkeypatch.setattr(server, 'score_pairs', fake_score_pairs)
+    monkeypatch.setattr(server, 'make_wn_context',
+                        lambda sense, options: f'gloss of {sense}')
+    sense_index = StrictSenseIndex({
+        'dog.n': ['dog.n.01', 'dog.n.02'], 'bark.v': ['bark.v.01'],
+        'run.v': ['run.v.01', 'run.v.02', 'run.v.03'], 'xyz.n': [],
+    })
+    return server.Disambiguator(None, ContextOptions(), sense_index)
+
+
+def test_micro_batcher_fails_every_item_if_the_batch_fails():
+    def process_batch(items):
+        raise RuntimeError('model failed')
+
+    batcher = MicroBatcher(process_batch, max_latency=0.05).start()
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(5)
+    batcher.close()
+
+
+def test_micro_batcher_fails_single_items():
+    def process_batch(items):
+        return [ValueError(item) if item < 0 else item * 2 for item in items]
+
+    batcher = MicroBatcher(process_batch, max_latency=0.05).start()
+    futures = [batcher.submit(item) for item in (1, -1, 2)]
+    assert futures[0].result(5) == 2
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5) == 4
+    batcher.close()
+    assert batcher.items == 3
+
+
+def test_disambiguator(disambiguator):
+    assert disambiguator([
+        ('The dog runs', ['dog.n', 'run.v', None]),
+        ('Dogs bark', ['dog.n', 'bark.v']),
+    ]) == [['dog.n.02', 'run.v.02', None], ['dog.n.02', 'bark.v.01']]
+
+
+def test_lemma_without_senses(disambiguator):
+    # The prediction of system.py for a token without candidates
+    assert trivial_prediction('xyz', 'n', []) == NO_ENTRY
+    assert disambiguator([('Dogs bark', ['dog.n', 'bark.v', 'xyz.n'])]) == \
+        [['dog.n.02', 'bark.v.01', NO_ENTRY]]
+
+    disambiguator.mfs = MostFrequentSense({'bark.v': 'bark.v.02',
+                                           'xyz.n': None})
+    assert disambiguator([('Dogs bark', ['bark.v', 'xyz.n'])]) == \
+        [['bark.v.02', NO_ENTRY]]
+
+
+def test_failing_request_does_not_fail_the_batch(disambiguator):
+    results = disambiguator([
+        ('The dog runs', ['dog.n', 'run.v']),
+        ('The cat sleeps', ['cat.n']),
+        ('Dogs bark', ['dog.n', 'bark.v']),
+    ])
+    assert results[0] == ['dog.n.02', 'run.v.02']
+    assert isinstance(results[1], KeyError)
+    assert results[2] == ['dog.n.02', 'bark.v.01']
+
+
+@pytest.mark.parametrize('lem_pos', ['dog', 'dog.x', '.n', 'dog.n.01', ''])
+def test_check_lemma_rejects(lem_pos):
+    with pytest.raises(ValueError):
+        server.check_lemma(lem_pos)
+
+
+def test_check_lemma_accepts():
+    for lem_pos in ('dog.n', 'run.v', 'grey.a', 'fast.r', 'st.john.n', None):
+        server.check_lemma(lem_pos)
+
+
+def post(port, data):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/disambiguate',
+        data=json.dumps(data).encode(), method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def start_server(disambiguator):
+    httpd = server.create_server(disambiguator, port=0)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def test_invalid_lemma_is_rejected_before_batching(disambiguator):
+    httpd = start_server(disambiguator)
+    port = httpd.server_port
+    try:
+        assert post(port, {'raw_sent': 'A dog', 'lemmas': [None, 'dog.n']}) \
+            == (200, {'senses': [None, 'dog.n.02']})
+        status, body = post(port, {'raw_sent': 'A dog', 'lemmas': ['dog']})
+        assert status == 400 and 'lemma.pos' in body['error']
+        assert post(port, {'raw_sent': 'A cat', 'lemmas': ['cat.n']})[0] == 500
+        assert httpd.batcher.items == 2
+    finally:
+        httpd.shutdown()
+        server.close_server(httpd)
+
+
+def test_shutdown_closes_gloss_cache(disambiguator, tmp_path):
+    options = ContextOptions()
+    cache = GlossCache(str(tmp_path / 'glosses.sqlite'))
+    cache._insert([(sense, options_key(options), f'cached gloss of {sense}')
+                   for sense in ('dog.n.01', 'dog.n.02')])
+    cache.close()
+    # The connection is opened by the batcher's worker thread
+    disambiguator.gloss_cache = GlossCache(cache.path)
+    closed = []
+    disambiguator.close = lambda: closed.append(
+        server.Disambiguator.close(disambiguator)
+    )
+
+    httpd = start_server(disambiguator)
+    assert post(httpd.server_port, {'raw_sent': 'A dog',
+                                    'lemmas': ['dog.n']}) == \
+        (200, {'senses': ['dog.n.02']})
+    httpd.shutdown()
+    server.close_server(httpd)
+    assert closed == [None]
+    assert disambiguator.gloss_cache._conn is None
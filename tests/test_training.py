@@ -0,0 +1,108 @@
+import argparse
+import logging
+from collections import Counter
+from functools import partial
+
+import numpy as np
+import pytest
+
+import src.training
+import src.wordnet
+import system
+from src.sampling import NegativeSampler
+from src.training import bucketed_batches, train_bucketed
+from src.wordnet import ContextOptions, SenseIndex
+
+SENSES = {
+    'dog.n': ['dog.n.01', 'dog.n.02', 'dog.n.03'],
+    'bark.v': ['bark.v.01', 'bark.v.02', 'bark.v.03', 'bark.v.04'],
+    'grey.a': ['grey.a.01'], 'cat.n': ['cat.n.01', 'cat.n.02'],
+    'sleep.v': ['sleep.v.01', 'sleep.v.02'],
+}
+ROWS = [['a dog barks', 'the gloss of a dog', 1],
+        ['a dog barks', 'a grey cat', 0],
+        ['the cat sleeps', 'a feline animal that sleeps', 1]] * 4
+
+
+@pytest.fixture
+def model(tiny_model_dir, tmp_path):
+    from simpletransformers.classification import ClassificationModel
+
+    return ClassificationModel(
+        'bert', tiny_model_dir, use_cuda=False,
+        args={'silent': True, 'max_seq_length': 16, 'train_batch_size': 2,
+              'num_train_epochs': 2, 'output_dir': str(tmp_path / 'out'),
+              'use_early_stopping': False, 'save_steps': 0}
+    )
+
+
+def test_bucketed_batches():
+    lengths = [5, 1, 9, 3, 7, 2, 8]
+    batches = bucketed_batches(lengths, 2, np.random.default_rng(0))
+    assert sorted(i for batch in batches for i in batch) == list(range(7))
+    for batch in batches:
+        assert [lengths[i] for i in batch] == \
+            sorted(lengths[i] for i in batch)
+
+
+def test_gradient_accumulation(model, monkeypatch):
+    schedules = []
+    make_schedule = src.training.get_linear_schedule_with_warmup
+
+    def get_schedule(optimizer, warmup_steps, total_steps):
+        scheduler = make_schedule(optimizer, warmup_steps, total_steps)
+        schedules.append((total_steps, scheduler))
+        return scheduler
+
+    monkeypatch.setattr(src.training, 'get_linear_schedule_with_warmup',
+                        get_schedule)
+    model.args.gradient_accumulation_steps = 4
+    train_bucketed(model, ROWS)
+
+    # 6 batches per epoch are 2 optimizer steps
+    (total_steps, scheduler), = schedules
+    assert total_steps == 4
+    assert scheduler.last_epoch == total_steps
+
+
+def test_unsupported_args_are_logged(model, caplog):
+    model.args.use_early_stopping = True
+    with caplog.at_level(logging.WARNING, logger='src.training'):
+        train_bucketed(model, ROWS, epochs=1)
+    assert 'use_early_stopping' in caplog.text
+
+
+def test_train_looks_up_glosses_once(conll_file, model, monkeypatch,
+                                     tmp_path):
+    # Every training doc has a raw sentence
+    train_file = tmp_path / 'train.conll'
+    with open(conll_file) as f:
+        train_file.write_text(f.read().replace(
+            '# newdoc id = p00/d0003\n',
+            '# newdoc id = p00/d0003\n# raw sent = The grey cat sleeps\n'
+        ))
+    lookups = Counter()
+
+    def make_wn_context(sense, options):
+        lookups[sense] += 1
+        return f'the gloss of {sense.split(".")[0]}'
+
+    def proximity(gold, sense):
+        return 0.0
+
+    monkeypatch.setattr(src.wordnet, 'make_wn_context', make_wn_context)
+    monkeypatch.setattr(system, 'make_wn_context', make_wn_context)
+    monkeypatch.setattr(system, 'NegativeSampler',
+                        partial(NegativeSampler, proximity=proximity))
+    args = argparse.Namespace(
+        train_file=str(train_file), keep_trivial=False, workers=1,
+        max_negatives=1, hard_negatives=None, sampling_seed=0,
+        dataframe_training=False
+    )
+    model.args.seed = 0
+    system.train(model, args, ContextOptions(add_definition=True), None,
+                 SenseIndex(dict(SENSES)))
+
+    # Two epochs with new negatives, every gloss is made only once
+    assert lookups and set(lookups.values()) == {1}
+    assert 'grey.a.01' not in lookups
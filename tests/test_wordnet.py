@@ -0,0 +1,134 @@
+from itertools import product
+
+import pytest
+
+from src import wordnet
+from src.wordnet import ContextOptions, GlossCache, SenseIndex, options_key
+
+
+class FakeSynset:
+    """The parts of an NLTK synset that make_wn_context_parts uses"""
+
+    def __init__(self, name, definition='', examples=(), hypernyms=(),
+                 hyponyms=()):
+        self._name = name
+        self._definition = definition
+        self._examples = list(examples)
+        self._hypernyms = list(hypernyms)
+        self._hyponyms = list(hyponyms)
+
+    def name(self):
+        return self._name
+
+    def definition(self):
+        return self._definition
+
+    def examples(self):
+        return self._examples
+
+    def hypernyms(self):
+        return self._hypernyms
+
+    def hyponyms(self):
+        return self._hyponyms
+
+
+def test_options_key_uses_fixed_bits():
+    assert options_key(ContextOptions()) == 0
+    assert options_key(ContextOptions(add_hypo=True)) == 1
+    assert options_key(ContextOptions(add_hyper=True)) == 2
+    assert options_key(ContextOptions(add_side=True)) == 4
+    assert options_key(ContextOptions(add_example=True)) == 8
+    assert options_key(ContextOptions(add_definition=True)) == 16
+
+    keys = {options_key(ContextOptions(*flags))
+            for flags in product([False, True], repeat=5)}
+    assert keys == set(range(32))
+
+
+def test_gloss_cache_round_trip(tmp_path):
+    path = str(tmp_path / 'glosses.sqlite')
+    animal = FakeSynset('animal.n.01', 'a living organism')
+    dog = FakeSynset('dog.n.01', 'a domestic canine', ['the dog barked'],
+                     hypernyms=[animal])
+    options = ContextOptions(add_definition=True, add_example=True,
+                             add_hyper=True)
+
+    cache = GlossCache(path)
+    assert cache.build([dog], options) == 1
+    cache.close()
+
+    cache = GlossCache(path, read_only=True)
+    assert len(cache) == 1
+    assert cache.get('dog.n.01', options) == (
+        'a domestic canine. the dog barked. a living organism.'
+    )
+    assert cache.get_parts('dog.n.01', options) == [
+        ('definition', 'a domestic canine'),
+        ('example', 'the dog barked'),
+        ('hyper', 'a living organism'),
+    ]
+    cache.close()
+
+
+def test_gloss_cache_writes_misses(tmp_path, monkeypatch):
+    path = str(tmp_path / 'glosses.sqlite')
+    options = ContextOptions(add_definition=True)
+    calls = []
+
+    def make_wn_context(sense, options):
+        calls.append(sense)
+        return f'gloss of {sense}'
+
+    monkeypatch.setattr(wordnet, 'make_wn_context', make_wn_context)
+    cache = GlossCache(path)
+    assert cache.get('dog.n.01', options) == 'gloss of dog.n.01'
+    assert cache.get('dog.n.01', options) == 'gloss of dog.n.01'
+    cache.close()
+    assert calls == ['dog.n.01']
+
+    # Read back from disk, other options are a different entry
+    cache = GlossCache(path, read_only=True)
+    assert cache.get('dog.n.01', options) == 'gloss of dog.n.01'
+    assert cache.get('dog.n.01', ContextOptions()) == 'gloss of dog.n.01'
+    cache.close()
+    assert calls == ['dog.n.01', 'dog.n.01']
+
+
+def test_installed_wordnet_version(tmp_path, monkeypatch, fake_wordnet):
+    from nltk import data as nltk_data
+    monkeypatch.setattr(nltk_data, 'path', [str(tmp_path)])
+    assert wordnet.installed_wordnet_version() is None
+
+    fake_wordnet('3.1')
+    assert wordnet.installed_wordnet_version() == '3.1'
+
+
+def test_sense_index_round_trip(tmp_path, fake_wordnet):
+    fake_wordnet('3.0')
+    path = str(tmp_path / 'senses.json')
+    index = SenseIndex(
+        {'dog.n': ['dog.n.01', 'frump.n.01'], 'dogs.n': ['dog.n.01'],
+         'xyz.n': []},
+        first_is_lemma=['dog.n'], version='3.0'
+    )
+    index.save(path)
+
+    loaded = SenseIndex.load(path)
+    assert loaded.version == '3.0'
+    assert len(loaded) == 3
+    assert loaded.senses('Dog', 'n') == ['dog.n.01', 'frump.n.01']
+    assert loaded.first_sense('dog', 'n') == 'dog.n.01'
+    # A derived form gets the name of the first synset
+    assert loaded.first_sense('dogs', 'n') == 'dog.n.01'
+    assert loaded.first_sense('xyz', 'n') is None
+
+
+def test_sense_index_of_other_wordnet_version(tmp_path, fake_wordnet):
+    fake_wordnet('3.1')
+    path = str(tmp_path / 'senses.json')
+    SenseIndex({'dog.n': ['dog.n.01']}, version='3.0').save(path)
+
+    with pytest.raises(ValueError, match='WordNet 3.0'):
+        SenseIndex.load(path)
+    assert SenseIndex.load(path, check_version=False).version == '3.0'